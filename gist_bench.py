@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Gist API 대체 서버 및 저장소 벤치마크
+기능:
+1. 로컬 Gist API 대체 서버: GET/PATCH /gists/<id>, 큰 파일 잘림(truncated) + raw_url,
+   속도 제한 헤더(X-RateLimit-*), 응답 지연, 5xx 오류 주입
+2. 저장소 벤치마크: 저장 방식별 로드 시간, 저장 지연, 드랍당 API 호출 수, 속도 제한/오류 상황 동작
+
+사용법:
+  python gist_bench.py serve [--port 8765] [--latency-ms 0] [--error-rate 0] [--rate-limit 5000]
+    -> GITHUB_API_URL=http://127.0.0.1:8765 으로 봇을 실행하면 실제 GitHub 대신 사용
+  python gist_bench.py bench [--records 20000] [--drops 20] [--latency-ms 20]
+"""
+
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict
+
+
+class GistStandIn:
+    """GitHub Gist API 대체 서버 (메모리 저장)
+
+    - 파일 내용이 truncate_bytes를 넘으면 GET 응답에서 잘라내고 truncated=True, raw_url 제공
+    - API 호출마다 속도 제한 잔여량 차감, 소진시 403 + X-RateLimit-Remaining: 0
+    - latency_ms 만큼 응답 지연, error_rate 확률로 502 응답
+    """
+    
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency_ms: float = 0.0,
+                 error_rate: float = 0.0, rate_limit: int = 5000, truncate_bytes: int = 1024 * 1024,
+                 seed: Optional[int] = None):
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.truncate_bytes = truncate_bytes
+        self.rng = random.Random(seed)
+        self.gists = {}  # {gist_id: {filename: content}}
+        self.lock = threading.Lock()
+        self.reset_counters()
+        
+        stand_in = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+            
+            def do_GET(self):
+                stand_in.handle(self, 'GET')
+            
+            def do_PATCH(self):
+                stand_in.handle(self, 'PATCH')
+        
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self.thread = None
+    
+    def reset_counters(self):
+        """호출 카운터와 속도 제한 잔여량 초기화"""
+        with self.lock:
+            self.remaining = self.rate_limit
+            self.reset_at = int(time.time()) + 3600
+            self.counters = {'GET': 0, 'PATCH': 0, 'raw': 0, 'rate_limited': 0, 'errors': 0,
+                             'bytes_in': 0, 'bytes_out': 0}
+    
+    def start(self) -> 'GistStandIn':
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+    
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def _send(self, handler, status: int, body: bytes, rate_headers: bool = True):
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json; charset=utf-8')
+        handler.send_header('Content-Length', str(len(body)))
+        if rate_headers:
+            handler.send_header('X-RateLimit-Limit', str(self.rate_limit))
+            handler.send_header('X-RateLimit-Remaining', str(max(0, self.remaining)))
+            handler.send_header('X-RateLimit-Reset', str(self.reset_at))
+        handler.end_headers()
+        handler.wfile.write(body)
+        with self.lock:
+            self.counters['bytes_out'] += len(body)
+    
+    def _gist_json(self, gist_id: str) -> bytes:
+        files = {}
+        for name, content in self.gists.get(gist_id, {}).items():
+            size = len(content.encode('utf-8'))
+            truncated = size > self.truncate_bytes
+            files[name] = {
+                'filename': name,
+                'size': size,
+                'truncated': truncated,
+                'content': content.encode('utf-8')[:self.truncate_bytes].decode('utf-8', 'ignore') if truncated else content,
+                'raw_url': f"{self.url}/raw/{gist_id}/{name}"
+            }
+        return json.dumps({'id': gist_id, 'files': files}).encode('utf-8')
+    
+    def handle(self, handler, method: str):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        parts = handler.path.strip('/').split('/')
+        
+        # raw 파일은 API 속도 제한 대상 아님
+        if method == 'GET' and len(parts) == 3 and parts[0] == 'raw':
+            with self.lock:
+                self.counters['raw'] += 1
+                content = self.gists.get(parts[1], {}).get(parts[2])
+            if content is None:
+                self._send(handler, 404, b'{"message": "Not Found"}', rate_headers=False)
+            else:
+                self._send(handler, 200, content.encode('utf-8'), rate_headers=False)
+            return
+        
+        # 속도 제한 조회도 API 한도에 포함되지 않음 (봇 헬스 체크가 사용)
+        if method == 'GET' and parts == ['rate_limit']:
+            with self.lock:
+                core = {'limit': self.rate_limit, 'remaining': self.remaining, 'reset': self.reset_at}
+            self._send(handler, 200, json.dumps({'resources': {'core': core}, 'rate': core}).encode('utf-8'))
+            return
+        
+        if len(parts) != 2 or parts[0] != 'gists':
+            self._send(handler, 404, b'{"message": "Not Found"}')
+            return
+        gist_id = parts[1]
+        
+        with self.lock:
+            self.counters[method] += 1
+            if self.remaining <= 0:
+                self.counters['rate_limited'] += 1
+                rate_limited = True
+            else:
+                self.remaining -= 1
+                rate_limited = False
+            failed = not rate_limited and self.rng.random() < self.error_rate
+            if failed:
+                self.counters['errors'] += 1
+        
+        if rate_limited:
+            self._send(handler, 403, b'{"message": "API rate limit exceeded"}')
+            return
+        if failed:
+            self._send(handler, 502, b'{"message": "Server Error"}')
+            return
+        
+        if method == 'PATCH':
+            length = int(handler.headers.get('Content-Length', 0))
+            body = handler.rfile.read(length)
+            with self.lock:
+                self.counters['bytes_in'] += len(body)
+                files = self.gists.setdefault(gist_id, {})
+                for name, entry in (json.loads(body).get('files') or {}).items():
+                    if entry is None:
+                        files.pop(name, None)
+                    else:
+                        files[name] = entry.get('content', '')
+        
+        with self.lock:
+            body = self._gist_json(gist_id)
+        self._send(handler, 200, body)
+    
+    def api_calls(self) -> int:
+        return self.counters['GET'] + self.counters['PATCH'] + self.counters['raw']
+
+
+def make_history(count: int) -> list:
+    """벤치마크용 드랍 이력 생성"""
+    return [
+        {
+            "wallet_address": "0x" + f"{i % 997:040x}",
+            "amount_wei": 2500000000000,
+            "timestamp": time.strftime('%Y-%m-%d %H:%M:%S KST', time.localtime(1.7e9 + i * 60)),
+            "telegram_id": str(1000 + i % 300),
+            "telegram_username": f"@user{i % 300}",
+            "tx_hash": f"0x{i:064x}",
+            "chat_id": -1000 - i % 5
+        }
+        for i in range(count)
+    ]
+
+
+def use_legacy_history_layout(wallet_manager):
+    """청크 전환 전 저장 방식 재현 - 드랍 이력 전체를 단일 drop_history.json으로 매번 PATCH
+    (manifest를 쓰지 않으므로 로드도 계속 단일 파일 경로를 탄다)
+    """
+    wallet_manager.save_drop_history = lambda history: wallet_manager._save_gist_json('drop_history.json', history)
+    return wallet_manager
+
+
+def simulate_drop(wallet_manager, ledger, history: list, daily_sent: Dict, index: int) -> bool:
+    """드랍 1건의 저장소 쓰기 흐름 재현 (원장 created/signed, 정산 후 flush 1회 - 일일 전송량, 이력, 원장 완료)
+    flush 주기 안에 드랍이 여러 건이면 flush 비용은 나눠지므로 드랍당 최악의 경우
+    """
+    intent_id = f"-1:{index}"
+    ok = ledger.create(intent_id, chat_id=-1, user_id='1', amount_wei=2500000000000) is not None
+    ok = ledger.update(intent_id, status='signed', nonce=index, tx_hash=f"0x{index:064x}", raw_tx='0x' + 'ab' * 110) and ok
+    ledger.complete(intent_id)
+    completed = ledger.deferred_ids()
+    daily_sent['total'] = daily_sent.get('total', 0) + 2500000000000
+    saved = wallet_manager.save_daily_sent({'bench': daily_sent})
+    history.append(dict(history[-1] if history else {}, tx_hash=f"0xbench{index}"))
+    saved = wallet_manager.save_drop_history(history) and saved
+    if saved:
+        saved = ledger.commit(completed)
+    return saved and ok
+
+
+def bench_mode(rbtc_bot, mode: str, records: int, drops: int, latency_ms: float) -> Dict:
+    """저장 방식 하나 측정"""
+    workdir = tempfile.TemporaryDirectory(prefix=f'gist_bench_{mode}_')
+    cwd = os.getcwd()
+    os.chdir(workdir.name)
+    stand_in = None
+    try:
+        history = make_history(records)
+        if mode == 'local':
+            with open('drop_history.json', 'w') as f:
+                json.dump(history, f, indent=2, ensure_ascii=False)
+            factory = lambda: rbtc_bot.WalletManager('', '')
+        else:
+            stand_in = GistStandIn(latency_ms=latency_ms).start()
+            # gist-legacy: 이전 단일 파일 형식으로 로드/저장, gist: 청크 형식 (한 번 저장해 전환)
+            stand_in.gists['bench'] = {'drop_history.json': json.dumps(history, indent=2, ensure_ascii=False)}
+            if mode == 'gist-legacy':
+                factory = lambda: use_legacy_history_layout(rbtc_bot.WalletManager('token', 'bench', api_url=stand_in.url))
+            else:
+                factory = lambda: rbtc_bot.WalletManager('token', 'bench', api_url=stand_in.url)
+                factory().save_drop_history(history)
+        
+        if stand_in:
+            stand_in.reset_counters()
+        started = time.perf_counter()
+        wallet_manager = factory()
+        loaded = wallet_manager.load_drop_history()
+        wallet_manager.release_snapshot()
+        load_seconds = time.perf_counter() - started
+        load_calls = stand_in.api_calls() if stand_in else 0
+        
+        ledger = rbtc_bot.DropLedger(wallet_manager)
+        if stand_in:
+            stand_in.reset_counters()
+        daily_sent = {}
+        failures = 0
+        started = time.perf_counter()
+        for i in range(drops):
+            if not simulate_drop(wallet_manager, ledger, loaded, daily_sent, i):
+                failures += 1
+        drop_seconds = time.perf_counter() - started
+        
+        result = {
+            'mode': mode,
+            'records': len(loaded),
+            'load_ms': load_seconds * 1000,
+            'load_calls': load_calls,
+            'drop_ms': drop_seconds * 1000 / max(1, drops),
+            'calls_per_drop': (stand_in.api_calls() / max(1, drops)) if stand_in else 0,
+            'upload_kb_per_drop': (stand_in.counters['bytes_in'] / 1024 / max(1, drops)) if stand_in else 0,
+            'failures': failures
+        }
+        
+        if stand_in:
+            # 속도 제한: 드랍 3건 분량의 호출만 허용한 뒤 소진
+            stand_in.rate_limit = int(result['calls_per_drop'] * 3)
+            stand_in.reset_counters()
+            limited_failures = sum(1 for i in range(drops) if not simulate_drop(wallet_manager, ledger, loaded, daily_sent, drops + i))
+            result['rate_limited_failures'] = limited_failures
+            result['rate_limited_calls'] = stand_in.counters['rate_limited']
+            
+            # 5xx 주입: 10% 확률로 502
+            stand_in.rate_limit = 5000
+            stand_in.error_rate = 0.1
+            stand_in.reset_counters()
+            result['error_failures'] = sum(1 for i in range(drops) if not simulate_drop(wallet_manager, ledger, loaded, daily_sent, drops * 2 + i))
+            result['injected_errors'] = stand_in.counters['errors']
+        return result
+    finally:
+        if stand_in:
+            stand_in.stop()
+        os.chdir(cwd)
+        workdir.cleanup()
+
+
+def run_bench(args):
+    os.environ.pop('GITHUB_GIST_TOKEN', None)
+    os.environ.pop('GITHUB_GIST_ID', None)
+    import logging
+    import rbtc_bot
+    logging.getLogger().setLevel(logging.CRITICAL)
+    
+    print(f"저장소 벤치마크 - 이력 {args.records:,}건, 드랍 {args.drops}건, 지연 {args.latency_ms}ms")
+    print(f"{'mode':<12}{'load ms':>10}{'load calls':>12}{'drop ms':>10}{'calls/drop':>12}{'KB/drop':>10}"
+          f"{'fail':>6}{'rl fail':>9}{'5xx fail':>10}")
+    for mode in ('local', 'gist-legacy', 'gist'):
+        r = bench_mode(rbtc_bot, mode, args.records, args.drops, args.latency_ms)
+        print(f"{r['mode']:<12}{r['load_ms']:>10.1f}{r['load_calls']:>12}{r['drop_ms']:>10.1f}"
+              f"{r['calls_per_drop']:>12.1f}{r['upload_kb_per_drop']:>10.1f}{r['failures']:>6}"
+              f"{r.get('rate_limited_failures', '-'):>9}{r.get('error_failures', '-'):>10}")
+
+
+def run_serve(args):
+    stand_in = GistStandIn(host=args.host, port=args.port, latency_ms=args.latency_ms,
+                           error_rate=args.error_rate, rate_limit=args.rate_limit)
+    print(f"Gist API 대체 서버: {stand_in.url} (GITHUB_API_URL={stand_in.url})")
+    try:
+        stand_in.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gist API 대체 서버 및 저장소 벤치마크")
+    sub = parser.add_subparsers(dest='command', required=True)
+    
+    serve = sub.add_parser('serve', help="로컬 Gist API 대체 서버 실행")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    serve.add_argument('--latency-ms', type=float, default=0.0)
+    serve.add_argument('--error-rate', type=float, default=0.0)
+    serve.add_argument('--rate-limit', type=int, default=5000)
+    
+    bench = sub.add_parser('bench', help="저장 방식별 벤치마크")
+    bench.add_argument('--records', type=int, default=20000)
+    bench.add_argument('--drops', type=int, default=20)
+    bench.add_argument('--latency-ms', type=float, default=20.0)
+    
+    args = parser.parse_args()
+    if args.command == 'serve':
+        run_serve(args)
+    else:
+        run_bench(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,31 +7,50 @@ RSK/Rootstock 체인 RBTC 드랍 텔레그램 봇
 """
 
 import os
+import sys
 import json
 import logging
 import random
-import re
 import time
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
-import telebot
-from dotenv import load_dotenv
-from web3 import Web3
-from eth_account import Account
-import requests
+from typing import Optional, Dict, Any, List, Mapping, NamedTuple
+from decimal import Decimal
+from dotenv import load_dotenv, dotenv_values
+import functools
+import importlib
 import threading
+import heapq
+from collections import deque, Counter
+import itertools
+import signal
+import multiprocessing
+import queue
+import gzip
+import base64
+import hashlib
+import tracemalloc
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# 환경변수 로드
+# 모듈 로드 시작 시각 (시작 시간 분석용)
+_MODULE_LOAD_STARTED = time.perf_counter()
+
+# 환경변수 로드 (.env보다 프로세스 환경변수가 우선 - 설정 리로드도 같은 순서를 따르도록 원래 값을 보관)
+PROCESS_ENV = dict(os.environ)
 load_dotenv()
 
 # 로깅 설정
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 
-# 로그 핸들러 설정
+# 로그 핸들러 설정 (파일은 첫 기록 때 열림 - 샤드 워커는 import만 하고 프론트 프로세스로 로그를 넘김)
 log_handler = RotatingFileHandler(
     'tx_bot.log',
     maxBytes=10*1024*1024,  # 10MB
-    backupCount=5  # 최대 5개 백업 파일
+    backupCount=5,  # 최대 5개 백업 파일
+    delay=True
 )
 
 logging.basicConfig(
@@ -47,6 +66,247 @@ logging.basicConfig(
 logging.getLogger('urllib3').setLevel(logging.WARNING)
 # telebot 로그 레벨 조정
 logging.getLogger('TeleBot').setLevel(logging.WARNING)
+# 스케줄러 작업 실행 로그 비활성화
+logging.getLogger('apscheduler').setLevel(logging.WARNING)
+
+# RBTC 금액은 내부적으로 정수 wei로만 다루고 표시할 때만 변환
+WEI_PER_RBTC = 10 ** 18
+
+def rbtc_to_wei(amount) -> int:
+    """RBTC 금액(문자열/숫자)을 정수 wei로 변환 - float는 문자열 표현 기준으로 변환"""
+    return int(Decimal(str(amount)) * WEI_PER_RBTC)
+
+def format_rbtc(amount_wei: int) -> str:
+    """wei 금액을 RBTC 표시 문자열(소수점 8자리)로 변환"""
+    return f"{Decimal(int(amount_wei)) / WEI_PER_RBTC:.8f}"
+
+class LazyModule:
+    """첫 속성 접근 시점에 import 하는 모듈 대리 객체 (시작 시간 단축)"""
+    
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+    
+    def __getattr__(self, attr: str):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+# 무거운 의존성은 처음 사용할 때 로드 (web3/eth_account는 TransactionManager에서 로드)
+telebot = LazyModule('telebot')
+requests = LazyModule('requests')
+
+class StartupTimer:
+    """시작 단계별 소요 시간 기록"""
+    
+    def __init__(self):
+        self.started = _MODULE_LOAD_STARTED
+        self.phases = []  # [(name, seconds)]
+        self.lock = threading.Lock()
+        self.record('module_load', time.perf_counter() - self.started)
+    
+    def record(self, name: str, seconds: float):
+        with self.lock:
+            self.phases.append((name, seconds))
+    
+    @contextmanager
+    def phase(self, name: str):
+        """with 블록 소요 시간 기록"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+    
+    def timed(self, name: str, func, *args, **kwargs):
+        """함수 실행 시간 기록 (병렬 작업용)"""
+        with self.phase(name):
+            return func(*args, **kwargs)
+    
+    def report(self):
+        """단계별 소요 시간 로그 출력"""
+        total = time.perf_counter() - self.started
+        breakdown = ', '.join(f"{name} {seconds:.3f}s" for name, seconds in self.phases)
+        logging.info(f"시작 시간: 총 {total:.3f}s ({breakdown})")
+
+class LeaderLease:
+    """리더 임대(lease) - 겹쳐 실행되는 배포 중 한 인스턴스만 폴링/드랍 처리
+
+    임대 문서 {holder, token, expires_at}를 상태 저장소(Gist 또는 로컬 파일)에 두고
+    heartbeat로 갱신한다. token은 획득할 때마다 1씩 증가하는 fencing 토큰이라
+    더 큰 token이 기록된 것을 본 이전 리더는 즉시 물러난다.
+    """
+    
+    HANDOFF_WINDOW_SECONDS = 300  # 이 시간 안에 끝난 임대를 이어받으면 핸드오프로 간주
+    
+    def __init__(self, wallet_manager: 'WalletManager', holder_id: str, lease_seconds: float = 30.0):
+        self.wallet_manager = wallet_manager
+        self.holder_id = holder_id
+        self.lease_seconds = lease_seconds
+        # Gist는 비교-교환(CAS)이 없으므로 기록 후 잠시 뒤 다시 읽어 경쟁 여부 확인
+        self.verify_delay = 0.1 if wallet_manager.use_local else 1.0
+        self.token = None
+        self.valid_until = 0.0  # 로컬 기준 임대 유효 시각
+        self.handoff = False  # 직전 리더로부터 이어받았는지 여부
+        self.lock = threading.Lock()
+    
+    def _write(self, token: int, expires_at: float) -> bool:
+        return self.wallet_manager.save_leader_lease({
+            'holder': self.holder_id,
+            'token': token,
+            'expires_at': expires_at
+        })
+    
+    def try_acquire(self) -> bool:
+        """임대가 비었거나 만료되었으면 획득"""
+        now = time.time()
+        lease = self.wallet_manager.load_leader_lease()
+        if lease is WalletManager.FETCH_FAILED:
+            # 조회 실패를 빈 임대로 보면 현재 리더가 살아 있는데도 가로챌 수 있음
+            logging.warning("리더 임대 조회 실패 - 획득 보류")
+            return False
+        lease = lease or {}
+        holder = lease.get('holder')
+        expires_at = float(lease.get('expires_at', 0))
+        
+        if holder and holder != self.holder_id and expires_at > now:
+            return False
+        
+        token = int(lease.get('token', 0)) + 1
+        if not self._write(token, now + self.lease_seconds):
+            return False
+        
+        time.sleep(self.verify_delay)
+        lease = self.wallet_manager.load_leader_lease()
+        if lease is WalletManager.FETCH_FAILED:
+            logging.warning("리더 임대 확인 조회 실패 - 획득 보류")
+            return False
+        lease = lease or {}
+        if lease.get('holder') != self.holder_id or lease.get('token') != token:
+            logging.info(f"리더 임대 경쟁에서 밀림: {lease.get('holder')} (token {lease.get('token')})")
+            return False
+        
+        with self.lock:
+            self.token = token
+            self.valid_until = now + self.lease_seconds
+            self.handoff = bool(holder) and holder != self.holder_id and now - expires_at < self.HANDOFF_WINDOW_SECONDS
+        logging.info(f"리더 임대 획득: {self.holder_id} (token {token})")
+        return True
+    
+    def wait_for_leadership(self, poll_seconds: float = 2.0) -> bool:
+        """리더가 될 때까지 대기 (대기 동안 다른 인스턴스가 리더)
+        Returns: True if waited for another leader
+        """
+        waited = False
+        while not self.try_acquire():
+            if not waited:
+                logging.info(f"대기 인스턴스로 시작 - 현재 리더 임대 만료/해제 대기 중 ({self.lease_seconds:.0f}초 주기)")
+            waited = True
+            time.sleep(poll_seconds)
+        return waited
+    
+    def renew(self) -> bool:
+        """임대 갱신 (heartbeat)
+        Returns: False if leadership was lost
+        """
+        lease = self.wallet_manager.load_leader_lease()
+        if lease is WalletManager.FETCH_FAILED:
+            # 다른 인스턴스의 임대를 확인할 수 없으므로 쓰지 않고, 기존 임대가 유효한 동안만 유지
+            logging.warning("리더 임대 조회 실패, 다음 heartbeat에 재시도")
+            return self.is_leader()
+        if lease is not None and (lease.get('holder') != self.holder_id or lease.get('token') != self.token):
+            logging.error(f"리더 임대 상실: {lease.get('holder')} (token {lease.get('token')})")
+            with self.lock:
+                self.token = None
+                self.valid_until = 0.0
+            return False
+        
+        now = time.time()
+        if not self._write(self.token, now + self.lease_seconds):
+            # 일시적 저장 실패 - 기존 임대가 유효한 동안은 유지
+            logging.warning("리더 임대 갱신 실패, 다음 heartbeat에 재시도")
+            return self.is_leader()
+        
+        with self.lock:
+            self.valid_until = now + self.lease_seconds
+        return True
+    
+    def holds(self, token: Optional[int]) -> bool:
+        """fencing 토큰 확인 - 지금도 그 토큰으로 임대를 보유 중인지"""
+        with self.lock:
+            return token is not None and token == self.token and time.time() < self.valid_until - 2.0
+    
+    def is_leader(self) -> bool:
+        """현재 유효한 임대를 보유 중인지 (만료 2초 전부터는 보유하지 않은 것으로 간주)"""
+        with self.lock:
+            return self.token is not None and time.time() < self.valid_until - 2.0
+    
+    def release(self):
+        """임대 즉시 반납 - 대기 인스턴스가 다음 확인 주기에 이어받음"""
+        if self.token is None:
+            return
+        lease = self.wallet_manager.load_leader_lease()
+        if lease is WalletManager.FETCH_FAILED:
+            logging.warning("리더 임대 조회 실패 - 반납 기록 생략 (만료로 이어받음)")
+        elif lease is None or (lease.get('holder') == self.holder_id and lease.get('token') == self.token):
+            self._write(self.token, time.time())
+            logging.info(f"리더 임대 반납: {self.holder_id} (token {self.token})")
+        with self.lock:
+            self.token = None
+            self.valid_until = 0.0
+
+class WalletAddress(str):
+    """검증/정규화된 지갑 주소 (EIP-55 체크섬 문자열)
+
+    등록 시 한 번만 검증해 체크섬 형태로 저장하므로 전송 경로에서는 다시 계산하지 않는다.
+    입력은 전부 소문자/대문자, EIP-55 체크섬, RSK EIP-1191 체크섬(chainId 30/31)을 허용한다.
+    """
+    
+    __slots__ = ()
+    
+    HEX_CHARS = frozenset('0123456789abcdefABCDEF')
+    RSK_CHAIN_IDS = (30, 31)  # 메인넷, 테스트넷
+    
+    @classmethod
+    def parse(cls, raw) -> Optional['WalletAddress']:
+        """주소 검증 및 정규화
+        Returns: WalletAddress, 유효하지 않으면 None
+        """
+        if isinstance(raw, cls):
+            return raw
+        if not isinstance(raw, str):
+            return None
+        return cls._parse_cached(raw.strip())
+    
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def _parse_cached(raw: str) -> Optional['WalletAddress']:
+        """정규식 없이 형식 검사 후 체크섬 검증 (결과 캐시)"""
+        if len(raw) != 42 or raw[:2] != '0x' or not WalletAddress.HEX_CHARS.issuperset(raw[2:]):
+            return None
+        
+        body = raw[2:]
+        lower = body.lower()
+        checksum = WalletAddress._checksum(lower)
+        
+        # 대소문자가 섞였으면 EIP-55 또는 RSK EIP-1191 체크섬과 일치해야 함
+        if body != lower and body != body.upper() and body != checksum:
+            if not any(body == WalletAddress._checksum(lower, chain_id) for chain_id in WalletAddress.RSK_CHAIN_IDS):
+                return None
+        
+        return WalletAddress('0x' + checksum)
+    
+    @staticmethod
+    def _checksum(lower: str, chain_id: Optional[int] = None) -> str:
+        """체크섬 계산 - chain_id 지정시 EIP-1191 (RSK), 없으면 EIP-55"""
+        from eth_utils import keccak
+        prefix = f"{chain_id}0x" if chain_id is not None else ''
+        digest = keccak(text=prefix + lower).hex()
+        return ''.join(c.upper() if int(digest[i], 16) >= 8 else c for i, c in enumerate(lower))
+    
+    def rsk_checksum(self, chain_id: int = 30) -> str:
+        """RSK 탐색기 표시용 EIP-1191 체크섬 주소"""
+        return '0x' + self._checksum(self[2:].lower(), chain_id)
 
 class LastWinnerTracker:
     """채팅방별 마지막 당첨자 추적 (간단한 라운드 로빈)"""
@@ -93,151 +353,1179 @@ class LastWinnerTracker:
         with self.lock:
             self.last_winners = data
 
-class WalletManager:
-    """GitHub Gist를 사용한 지갑 주소 관리 클래스"""
+class TokenBucketLimiter:
+    """계층형 토큰 버킷 드랍 속도 제한 (전체 / 채팅방별 / 사용자별)
+
+    각 레벨은 (충전 간격 초, 최대 버스트)로 설정하며 간격이 0 이하면 비활성화.
+    버킷은 [토큰, 갱신시각] 두 값만 보관하고, 가득 찬 버킷은 저장시 제거한다.
+    """
     
-    def __init__(self, gist_token: str = None, gist_id: str = None):
-        self.gist_token = gist_token or os.getenv('GITHUB_GIST_TOKEN')
-        self.gist_id = gist_id or os.getenv('GITHUB_GIST_ID')
-        
-        # Gist 사용 불가시 로컬 파일 백업
-        self.use_local = not (self.gist_token and self.gist_id)
-        self.wallet_file = "wallets.json"
-        
-        # 지갑 데이터 로드
-        self.wallets = self._load_wallets()
+    LEVELS = ('global', 'chat', 'user')
     
-    def _load_wallets(self) -> Dict[str, str]:
-        """지갑 데이터 로드 (Gist 또는 로컬)"""
-        if self.use_local:
-            try:
-                if os.path.exists(self.wallet_file):
-                    with open(self.wallet_file, 'r', encoding='utf-8') as f:
-                        return json.load(f)
-            except Exception as e:
-                logging.error(f"로컬 지갑 데이터 로드 실패: {e}")
-            return {}
-        
-        # GitHub Gist에서 로드
-        try:
-            headers = {
-                'Authorization': f'token {self.gist_token}',
-                'Accept': 'application/vnd.github.v3+json'
+    def __init__(self, limits: Dict[str, tuple]):
+        self.limits = {
+            level: (float(interval), max(1.0, float(burst)))
+            for level, (interval, burst) in limits.items()
+            if float(interval) > 0
+        }
+        self.buckets = {}  # {"level:key": [tokens, updated_at]}
+        self.lock = threading.Lock()
+    
+    def set_limits(self, limits: Dict[str, tuple]):
+        """레벨별 (간격, 버스트) 교체 - 기존 버킷 토큰은 유지"""
+        parsed = TokenBucketLimiter(limits).limits
+        with self.lock:
+            self.limits = parsed
+    
+    def _keys(self, chat_id: int, user_id: str) -> List[tuple]:
+        """적용 대상 (레벨, 버킷 키) 목록"""
+        keys = {'global': 'global:*', 'chat': f"chat:{chat_id}", 'user': f"user:{user_id}"}
+        return [(level, keys[level]) for level in self.LEVELS if level in self.limits]
+    
+    def _tokens(self, level: str, key: str, now: float) -> float:
+        """현재 시각 기준 충전된 토큰 수 (lock 안에서 호출)"""
+        interval, burst = self.limits[level]
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            return burst
+        return min(burst, bucket[0] + (now - bucket[1]) / interval)
+    
+    def check(self, chat_id: int, user_id: str) -> Optional[tuple]:
+        """드랍 가능 여부 확인 (토큰 소비 없음)
+        Returns: None if allowed, (level, wait_seconds) otherwise
+        """
+        now = time.time()
+        with self.lock:
+            for level, key in self._keys(chat_id, user_id):
+                tokens = self._tokens(level, key, now)
+                if tokens < 1.0:
+                    return level, (1.0 - tokens) * self.limits[level][0]
+        return None
+    
+    def reserve(self, chat_id: int, user_id: str) -> Optional[tuple]:
+        """확인과 차감을 한 번에 - 모든 레벨에 토큰이 있으면 1개씩 차감
+        동시에 처리되는 드랍(샤드 드랍 스레드 등)이 같은 토큰을 쓰지 않도록 lock 안에서 수행
+        Returns: None if reserved, (level, wait_seconds) otherwise
+        """
+        now = time.time()
+        with self.lock:
+            keys = self._keys(chat_id, user_id)
+            tokens = {}
+            for level, key in keys:
+                tokens[key] = self._tokens(level, key, now)
+                if tokens[key] < 1.0:
+                    return level, (1.0 - tokens[key]) * self.limits[level][0]
+            for level, key in keys:
+                self.buckets[key] = [tokens[key] - 1.0, now]
+        return None
+    
+    def refund(self, chat_id: int, user_id: str):
+        """드랍이 중단된 예약 토큰 반환 (최대 버스트까지)"""
+        now = time.time()
+        with self.lock:
+            for level, key in self._keys(chat_id, user_id):
+                self.buckets[key] = [min(self.limits[level][1], self._tokens(level, key, now) + 1.0), now]
+    
+    def consume(self, chat_id: int, user_id: str):
+        """예약 없이 확정된 드랍(원장 재처리)의 토큰 1개 차감"""
+        now = time.time()
+        with self.lock:
+            for level, key in self._keys(chat_id, user_id):
+                self.buckets[key] = [self._tokens(level, key, now) - 1.0, now]
+    
+    def save_to_dict(self) -> Dict[str, List[float]]:
+        """Gist 저장용 딕셔너리로 변환 (가득 찬 버킷 제외)"""
+        now = time.time()
+        with self.lock:
+            levels = {key: key.split(':', 1)[0] for key in self.buckets}
+            self.buckets = {
+                key: bucket for key, bucket in self.buckets.items()
+                if levels[key] in self.limits and self._tokens(levels[key], key, now) < self.limits[levels[key]][1]
             }
-            response = requests.get(
-                f'https://api.github.com/gists/{self.gist_id}',
-                headers=headers
-            )
-            
-            if response.status_code == 200:
-                gist_data = response.json()
-                if 'wallets.json' in gist_data['files']:
-                    content = gist_data['files']['wallets.json']['content']
-                    return json.loads(content)
-            else:
-                logging.error(f"Gist 로드 실패: {response.status_code}")
+            return {key: [round(b[0], 4), round(b[1], 3)] for key, b in self.buckets.items()}
+    
+    def load_from_dict(self, data: Dict[str, List[float]]):
+        """Gist에서 로드한 데이터 적용"""
+        with self.lock:
+            self.buckets = {
+                key: [float(value[0]), float(value[1])]
+                for key, value in (data or {}).items()
+                if isinstance(value, list) and len(value) == 2
+            }
+
+class DailyBudget:
+    """일일 드랍 예산 (전체 + 채팅방별)
+
+    리셋 시각과 시간대를 설정할 수 있고, 보관 기간이 지난 날짜 키는 자동으로 제거한다.
+    금액은 모두 정수 wei.
+    저장 형식: {day_key: {"total": wei, "chats": {chat_id: wei}}}
+    """
+    
+    def __init__(self, max_total: int, max_per_chat: int, reset_time: str = '09:00',
+                 tz_name: str = 'Asia/Seoul', retention_days: int = 7):
+        self.max_total = max_total
+        self.max_per_chat = max_per_chat
+        self.retention_days = retention_days
+        hour, _, minute = reset_time.partition(':')
+        self.reset_offset = timedelta(hours=int(hour), minutes=int(minute or 0))
+        try:
+            from zoneinfo import ZoneInfo
+            self.tz = ZoneInfo(tz_name)
         except Exception as e:
-            logging.error(f"Gist 데이터 로드 실패: {e}")
-        
-        return {}
+            logging.warning(f"시간대 로드 실패 ({tz_name}), 로컬 시간 사용: {e}")
+            self.tz = None
+        self.days = {}
+        self.lock = threading.Lock()
     
-    def _save_wallets(self) -> bool:
-        """지갑 데이터 저장 (Gist 또는 로컬)"""
-        if self.use_local:
+    def set_limits(self, max_total: int, max_per_chat: int):
+        """전체/채팅방 일일 한도 교체 (오늘 사용량은 유지)"""
+        with self.lock:
+            self.max_total = max_total
+            self.max_per_chat = max_per_chat
+    
+    def today_key(self) -> str:
+        """리셋 시각 기준 오늘 날짜 키 (리셋 시각 이전이면 전날)"""
+        now = datetime.now(self.tz)
+        return (now - self.reset_offset).date().isoformat()
+    
+    def day_offset(self) -> float:
+        """epoch 초를 날짜 키로 바꿀 때 더할 보정 초 (UTC 오프셋 - 리셋 시각)"""
+        now = datetime.now(self.tz) if self.tz else datetime.now().astimezone()
+        return (now.utcoffset() - self.reset_offset).total_seconds()
+    
+    def spent(self, day: str, chat_id: Optional[int] = None) -> int:
+        """전송량 조회 (wei, chat_id 지정시 채팅방 전송량)"""
+        with self.lock:
+            entry = self.days.get(day)
+            if not entry:
+                return 0
+            if chat_id is None:
+                return entry['total']
+            return entry['chats'].get(str(chat_id), 0)
+    
+    def remaining(self, day: str, chat_id: int) -> int:
+        """채팅방에서 오늘 더 보낼 수 있는 양 (wei) - 전체/채팅방 한도 중 작은 값"""
+        with self.lock:
+            entry = self.days.get(day) or {'total': 0, 'chats': {}}
+            total_left = self.max_total - entry['total']
+            chat_left = self.max_per_chat - entry['chats'].get(str(chat_id), 0)
+        return max(0, min(total_left, chat_left))
+    
+    def add(self, day: str, chat_id: int, amount_wei: int):
+        """전송량 반영 후 오래된 날짜 키 정리"""
+        with self.lock:
+            entry = self.days.setdefault(day, {'total': 0, 'chats': {}})
+            entry['total'] += amount_wei
+            key = str(chat_id)
+            entry['chats'][key] = entry['chats'].get(key, 0) + amount_wei
+        self.prune()
+    
+    def prune(self, days: Optional[Dict] = None) -> Dict:
+        """보관 기간이 지난 날짜 키 제거 (days 지정시 해당 딕셔너리 정리)"""
+        cutoff = (datetime.now(self.tz) - self.reset_offset - timedelta(days=self.retention_days)).date().isoformat()
+        if days is not None:
+            return {k: v for k, v in days.items() if k >= cutoff}
+        with self.lock:
+            self.days = {k: v for k, v in self.days.items() if k >= cutoff}
+            return self.days
+    
+    def save_to_dict(self) -> Dict:
+        """Gist 저장용 딕셔너리로 변환"""
+        with self.lock:
+            return {day: {'total': e['total'], 'chats': dict(e['chats'])} for day, e in self.days.items()}
+    
+    def load_from_dict(self, data: Dict):
+        """Gist에서 로드한 데이터 적용 (이전 {day: total} 형식, RBTC float 값은 wei로 변환)"""
+        days = {}
+        for day, value in (data or {}).items():
+            if isinstance(value, dict):
+                days[day] = {
+                    'total': self._to_wei(value.get('total', 0)),
+                    'chats': {str(k): self._to_wei(v) for k, v in (value.get('chats') or {}).items()}
+                }
+            else:
+                days[day] = {'total': self._to_wei(value), 'chats': {}}
+        with self.lock:
+            self.days = days
+        self.prune()
+    
+    @staticmethod
+    def _to_wei(value) -> int:
+        """저장된 값 변환 - 정수는 wei, float는 이전 형식의 RBTC 값"""
+        if isinstance(value, float):
+            return rbtc_to_wei(value)
+        return int(value)
+
+class AliasSampler:
+    """가중치 이산 분포 샘플러 (Vose alias 방식 - 테이블 생성 O(n), 추출 O(1))"""
+    
+    def __init__(self, weights: List[float], rng: Optional[random.Random] = None):
+        total = float(sum(weights))
+        if not weights or total <= 0:
+            raise ValueError("가중치 합은 0보다 커야 합니다")
+        n = len(weights)
+        self.rng = rng or random.Random()
+        self.prob = [0.0] * n
+        self.alias = [0] * n
+        scaled = [w * n / total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            lo, hi = small.pop(), large.pop()
+            self.prob[lo] = scaled[lo]
+            self.alias[lo] = hi
+            scaled[hi] -= 1.0 - scaled[lo]
+            (small if scaled[hi] < 1.0 else large).append(hi)
+        for i in small + large:
+            self.prob[i] = 1.0
+    
+    def sample(self) -> int:
+        """가중치에 비례한 인덱스 1개 추출"""
+        i = int(self.rng.random() * len(self.prob))
+        return i if self.rng.random() < self.prob[i] else self.alias[i]
+
+class DropPolicy:
+    """드랍 확률/금액 정책
+
+    - 금액 구간별 가중치 (alias 샘플러로 O(1) 추출)
+    - 채팅방별 드랍 확률 덮어쓰기
+    - 활동량 기반 확률 감소: 반감기로 감쇠하는 사용자별 메시지 점수가
+      activity_free를 넘으면 확률을 activity_free / 점수 비율로 낮춘다
+    """
+    
+    PRUNE_EVERY = 1024  # 관측 N회마다 감쇠된 활동 기록 정리
+    
+    def __init__(self, base_rate: float, tiers: List[tuple], chat_rates: Optional[Dict[int, float]] = None,
+                 activity_half_life: float = 600.0, activity_free: float = 10.0,
+                 rng: Optional[random.Random] = None):
+        self.base_rate = base_rate
+        self.tiers = tiers  # [(amount_wei, weight)]
+        self.chat_rates = chat_rates or {}
+        self.activity_half_life = activity_half_life
+        self.activity_free = activity_free
+        self.rng = rng or random.Random()
+        self.sampler = AliasSampler([weight for _, weight in tiers], self.rng)
+        self.activity = {}  # {user_id: [score, updated_at]}
+        self.observed = 0
+        self.lock = threading.Lock()
+    
+    @classmethod
+    def from_env(cls, base_rate: float, default_amount_wei: int, env: Optional[Mapping[str, str]] = None) -> 'DropPolicy':
+        """환경변수(또는 env 매핑)로 정책 생성
+
+        DROP_AMOUNT_TIERS=0.0000025:90,0.00001:9,0.0001:1  (RBTC:가중치)
+        CHAT_DROP_RATES=-100123:0.1,-100456:0.02             (chat_id:확률)
+        """
+        env = os.environ if env is None else env
+        tiers = []
+        for item in filter(None, env.get('DROP_AMOUNT_TIERS', '').split(',')):
             try:
-                with open(self.wallet_file, 'w', encoding='utf-8') as f:
-                    json.dump(self.wallets, f, indent=2, ensure_ascii=False)
-                return True
+                amount, _, weight = item.partition(':')
+                tiers.append((rbtc_to_wei(amount.strip()), float(weight or 1)))
             except Exception as e:
-                logging.error(f"로컬 지갑 데이터 저장 실패: {e}")
-                return False
+                logging.warning(f"DROP_AMOUNT_TIERS 항목 무시 ({item}): {e}")
+        tiers = [(amount, weight) for amount, weight in tiers if amount > 0 and weight > 0]
         
-        # GitHub Gist에 저장
-        try:
-            headers = {
-                'Authorization': f'token {self.gist_token}',
-                'Accept': 'application/vnd.github.v3+json'
-            }
-            
-            # 기존 Gist 내용 가져오기
-            response = requests.get(
-                f'https://api.github.com/gists/{self.gist_id}',
-                headers=headers
-            )
-            
-            files = {}
-            if response.status_code == 200:
-                gist_data = response.json()
-                # 기존 파일들 유지
-                for filename in ['wallets.json', 'daily_sent.json', 'limit_notifications.json', 'last_winners.json', 'blacklist.json']:
-                    if filename in gist_data['files']:
-                        files[filename] = {'content': gist_data['files'][filename]['content']}
+        chat_rates = {}
+        for item in filter(None, env.get('CHAT_DROP_RATES', '').split(',')):
+            try:
+                chat_id, _, rate = item.partition(':')
+                chat_rates[int(chat_id)] = float(rate)
+            except ValueError as e:
+                logging.warning(f"CHAT_DROP_RATES 항목 무시 ({item}): {e}")
+        
+        return cls(
+            base_rate,
+            tiers or [(default_amount_wei, 1.0)],
+            chat_rates,
+            activity_half_life=float(env.get('ACTIVITY_HALF_LIFE_SECONDS', '600')),
+            activity_free=float(env.get('ACTIVITY_FREE_MESSAGES', '10'))
+        )
+    
+    def describe_amount(self) -> str:
+        """1회 드랍량 표시 문자열"""
+        amounts = [amount for amount, _ in self.tiers]
+        if len(amounts) == 1:
+            return f"{format_rbtc(amounts[0])} RBTC"
+        return f"{format_rbtc(min(amounts))} ~ {format_rbtc(max(amounts))} RBTC"
+    
+    def expected_amount(self) -> float:
+        """1회 드랍 기대 금액 (wei)"""
+        total_weight = sum(weight for _, weight in self.tiers)
+        return sum(amount * weight for amount, weight in self.tiers) / total_weight
+    
+    def _decayed(self, entry: List[float], now: float) -> float:
+        if self.activity_half_life <= 0:
+            return entry[0]
+        return entry[0] * 0.5 ** ((now - entry[1]) / self.activity_half_life)
+    
+    def observe(self, user_id, now: Optional[float] = None) -> float:
+        """사용자 메시지 1건 반영 후 활동 점수 반환"""
+        now = time.time() if now is None else now
+        with self.lock:
+            entry = self.activity.get(user_id)
+            if entry is None:
+                entry = self.activity[user_id] = [0.0, now]
+            entry[0] = self._decayed(entry, now) + 1.0
+            entry[1] = now
+            self.observed += 1
+            if self.observed % self.PRUNE_EVERY == 0:
+                self.activity = {k: v for k, v in self.activity.items() if self._decayed(v, now) >= 0.5}
+            return entry[0]
+    
+    def rate_for(self, chat_id, user_id, now: Optional[float] = None) -> float:
+        """채팅방 설정과 사용자 활동량을 반영한 드랍 확률"""
+        rate = self.chat_rates.get(int(chat_id), self.base_rate)
+        entry = self.activity.get(user_id)
+        if entry and self.activity_free > 0:
+            score = self._decayed(entry, time.time() if now is None else now)
+            if score > self.activity_free:
+                rate *= self.activity_free / score
+        return rate
+    
+    def decide(self, chat_id, user_id, now: Optional[float] = None) -> Optional[int]:
+        """드랍 여부 결정 - 당첨이면 금액(wei), 아니면 None"""
+        if self.rng.random() >= self.rate_for(chat_id, user_id, now):
+            return None
+        return self.tiers[self.sampler.sample()][0]
+    
+    def simulate(self, messages: int, users: int, chats: int, max_daily_wei: int,
+                 max_per_chat_wei: int, seed: Optional[int] = None) -> Dict[str, Any]:
+        """하루 동안 가상 메시지를 흘려 일일 지출 예측 (쿨타임/연속 당첨 제한은 제외)
+
+        사용자별 메시지 비중은 파레토 분포(소수의 활발한 사용자)로 가정한다.
+        """
+        rng = random.Random(seed)
+        chat_ids = sorted(self.chat_rates)[:chats]
+        chat_ids += [-(i + 1) for i in range(chats - len(chat_ids))]
+        policy = DropPolicy(self.base_rate, self.tiers, self.chat_rates, self.activity_half_life,
+                            self.activity_free, rng)
+        user_sampler = AliasSampler([rng.paretovariate(1.2) for _ in range(users)], rng)
+        chat_sampler = AliasSampler([1.0] * len(chat_ids), rng)
+        
+        drops = 0
+        spent = 0
+        uncapped = 0
+        chat_spent = {}
+        exhausted_at = None
+        step = 86400.0 / messages
+        for i in range(messages):
+            now = i * step
+            user_id = user_sampler.sample()
+            chat_id = chat_ids[chat_sampler.sample()]
+            policy.observe(user_id, now)
+            amount = policy.decide(chat_id, user_id, now)
+            if amount is None:
+                continue
+            uncapped += amount
+            amount = min(amount, max_daily_wei - spent, max_per_chat_wei - chat_spent.get(chat_id, 0))
+            if amount <= 0:
+                if exhausted_at is None and spent >= max_daily_wei:
+                    exhausted_at = now
+                continue
+            drops += 1
+            spent += amount
+            chat_spent[chat_id] = chat_spent.get(chat_id, 0) + amount
+        
+        return {
+            'messages': messages,
+            'drops': drops,
+            'spent_wei': spent,
+            'uncapped_wei': uncapped,
+            'exhausted_at': exhausted_at,
+            'chat_spent_wei': chat_spent
+        }
+
+class SpamFilter:
+    """사용자별 최근 메시지 지문 기반 스팸 사전 필터
+
+    메시지는 문자만 남기고(공백/숫자/문장부호 제거) 연속 반복 문자를 하나로 줄여 정규화한다.
+    사용자마다 최근 window_size개 메시지의 (시각, simhash, 짧은 정규화 문자열)만 보관하고
+    - window_seconds 안에 max_messages개를 넘으면 도배(flood)
+    - 최근 메시지와 유사하면 반복(duplicate): 짧은 메시지는 2-gram 집합 Jaccard 유사도가
+      min_similarity 이상, 긴 메시지는 simhash 해밍 거리가 max_distance 이하
+    으로 판단해 다른 체크보다 먼저 거른다. 지문은 blake2b 기반이라 프로세스/샤드 워커/재시작과 무관하게 같다.
+    """
+    
+    PRUNE_EVERY = 1024  # 검사 N회마다 오래된 사용자 기록 정리
+    SHORT_TEXT = 64     # 정규화 후 이 길이 이하면 simhash 대신 2-gram 집합으로 비교
+    
+    def __init__(self, window_size: int = 8, window_seconds: float = 60.0, max_messages: int = 6,
+                 max_distance: int = 10, min_similarity: float = 0.5):
+        self.window_size = window_size
+        self.window_seconds = window_seconds
+        self.max_messages = max_messages
+        self.max_distance = max_distance
+        self.min_similarity = min_similarity
+        self.history = {}  # {user_id: deque[(timestamp, simhash, short_text)]}
+        self.stats = {'checked': 0, 'passed': 0, 'flood': 0, 'duplicate': 0}
+        self.lock = threading.Lock()
+    
+    @classmethod
+    def from_env(cls) -> 'SpamFilter':
+        """SPAM_* 환경변수로 필터 생성"""
+        return cls(
+            window_size=int(os.getenv('SPAM_WINDOW_SIZE', '8')),
+            window_seconds=float(os.getenv('SPAM_WINDOW_SECONDS', '60')),
+            max_messages=int(os.getenv('SPAM_MAX_MESSAGES', '6')),
+            max_distance=int(os.getenv('SPAM_SIMHASH_DISTANCE', '10')),
+            min_similarity=float(os.getenv('SPAM_MIN_SIMILARITY', '0.5'))
+        )
+    
+    @staticmethod
+    def normalize(text: str) -> str:
+        """문자만 남기고 소문자화, 연속 반복 문자는 하나로 (앞 512자만 사용)"""
+        return ''.join(char for char, _ in itertools.groupby(c for c in text[:512].lower() if c.isalpha()))
+    
+    @staticmethod
+    def bigrams(text: str) -> set:
+        return {text[i:i + 2] for i in range(len(text) - 1)} if len(text) > 1 else {text}
+    
+    @staticmethod
+    def simhash(text: str) -> int:
+        """정규화된 문자열의 3-gram 64비트 simhash (blake2b - 프로세스마다 같은 값)"""
+        if len(text) < 3:
+            grams = [text]
+        else:
+            grams = [text[i:i + 3] for i in range(len(text) - 2)]
+        weights = [0] * 64
+        for gram in grams:
+            h = int.from_bytes(hashlib.blake2b(gram.encode('utf-8'), digest_size=8).digest(), 'little')
+            for bit in range(64):
+                weights[bit] += 1 if h >> bit & 1 else -1
+        fingerprint = 0
+        for bit, weight in enumerate(weights):
+            if weight > 0:
+                fingerprint |= 1 << bit
+        return fingerprint
+    
+    def check(self, user_id, text: str, now: Optional[float] = None) -> Optional[str]:
+        """메시지 검사 후 기록 - 통과면 None, 아니면 사유 ('flood' | 'duplicate')"""
+        now = time.time() if now is None else now
+        # 문자가 하나도 없는 메시지(숫자/이모지만)는 공백만 뺀 원문으로 비교
+        normalized = self.normalize(text or '') or ''.join((text or '')[:512].split())
+        short = normalized if len(normalized) <= self.SHORT_TEXT else None
+        fingerprint = None if short is not None else self.simhash(normalized)
+        grams = self.bigrams(short) if short is not None else None
+        with self.lock:
+            self.stats['checked'] += 1
+            if self.stats['checked'] % self.PRUNE_EVERY == 0:
+                cutoff = now - self.window_seconds
+                self.history = {k: v for k, v in self.history.items() if v and v[-1][0] >= cutoff}
             
-            # wallets.json 업데이트
-            files['wallets.json'] = {'content': json.dumps(self.wallets, indent=2, ensure_ascii=False)}
+            window = self.history.get(user_id)
+            if window is None:
+                window = self.history[user_id] = deque(maxlen=self.window_size)
             
-            # Gist 업데이트
-            update_response = requests.patch(
-                f'https://api.github.com/gists/{self.gist_id}',
-                headers=headers,
-                json={'files': files}
-            )
+            reason = None
+            cutoff = now - self.window_seconds
+            recent = [(h, t) for ts, h, t in window if ts >= cutoff]
+            if len(recent) >= self.max_messages:
+                reason = 'flood'
+            elif any(self._similar(fingerprint, short, grams, h, t) for h, t in recent):
+                reason = 'duplicate'
             
-            if update_response.status_code == 200:
-                logging.info("Gist에 지갑 데이터 저장 성공")
+            window.append((now, fingerprint, short))
+            self.stats[reason or 'passed'] += 1
+            return reason
+    
+    def _similar(self, fingerprint: Optional[int], short: Optional[str], grams: Optional[set],
+                 other_fingerprint: Optional[int], other_short: Optional[str]) -> bool:
+        """두 메시지 유사 여부 - 둘 다 짧으면 2-gram Jaccard, 둘 다 길면 simhash 거리"""
+        if short is not None and other_short is not None:
+            if short == other_short:
                 return True
-            else:
-                logging.error(f"Gist 저장 실패: {update_response.status_code}")
-                return False
-        except Exception as e:
-            logging.error(f"Gist 데이터 저장 실패: {e}")
-            return False
+            other_grams = self.bigrams(other_short)
+            return len(grams & other_grams) / len(grams | other_grams) >= self.min_similarity
+        if fingerprint is not None and other_fingerprint is not None:
+            return bin(fingerprint ^ other_fingerprint).count('1') <= self.max_distance
+        return False
+
+class UserRecord:
+    """사용자 한 명의 드랍 관련 정보 (슬롯 기반으로 사용자당 메모리 최소화)"""
     
-    """지갑 주소 유효성 검사"""
-    def is_valid_address(self, address: str) -> bool:
-        
+    __slots__ = ('user_id', 'wallet', 'blacklisted')
+    
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.wallet = None        # WalletAddress
+        self.blacklisted = False
+
+class UserRegistry:
+    """정수 user_id 기반 사용자 레지스트리 - 지갑/블랙리스트의 유일한 저장소
+
+    WalletManager가 소유하고, wallets.json과 blacklist.json은 저장할 때 여기서 만든다.
+    지갑과 블랙리스트 상태를 레코드 하나에 모아 드랍 자격 확인을 딕셔너리 조회 한 번으로
+    끝내고, 둘 다 없는 사용자는 레코드를 두지 않는다.
+    (쿨타임은 TokenBucketLimiter, 당첨 통계는 드랍 이력 인덱스/컬럼이 담당)
+    """
+    
+    def __init__(self):
+        self.records = {}  # {user_id(int): UserRecord}
+        self.wallet_total = 0  # 지갑 등록 사용자 수
+        self.lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return len(self.records)
+    
+    def get(self, user_id) -> Optional[UserRecord]:
+        """사용자 레코드 조회 (없으면 None)"""
         try:
-            # 이더리움 주소 형식 검사 (0x + 40자리 hex)
-            pattern = r'^0x[a-fA-F0-9]{40}$'
-            if not re.match(pattern, address):
-                return False
-            
-            # Web3를 통한 체크섬 검증
-            return Web3.is_address(address)
-        except Exception:
-            return False
-    """지갑 주소 등록"""
-    def set_wallet(self, user_id: str, wallet_address: str) -> bool:
-       
-        if not self.is_valid_address(wallet_address):
-            return False
-        
-        # 체크섬 주소로 변환
-        checksum_address = Web3.to_checksum_address(wallet_address)
-        self.wallets[user_id] = checksum_address
-        
-        return self._save_wallets()
-    """지갑 주소 조회"""
-    def get_wallet(self, user_id: str) -> Optional[str]:
-        
-        return self.wallets.get(user_id)
-    """지갑 주소 삭제"""
-    def remove_wallet(self, user_id: str) -> bool:
-        
-        if user_id in self.wallets:
-            del self.wallets[user_id]
-            return self._save_wallets()
-        return False
-    """모든 지갑 주소 조회"""
-    def get_all_wallets(self) -> Dict[str, str]:
-        return self.wallets.copy()
+            return self.records.get(int(user_id))
+        except (TypeError, ValueError):
+            return None
     
-    def load_daily_sent(self) -> Dict[str, float]:
-        """Gist에서 일일 전송량 로드"""
-        if self.use_local:
-            try:
-                if os.path.exists('daily_sent.json'):
-                    with open('daily_sent.json', 'r') as f:
+    def _ensure(self, user_id: int) -> UserRecord:
+        """레코드 조회 또는 생성 (lock 안에서 호출)"""
+        record = self.records.get(user_id)
+        if record is None:
+            record = self.records[user_id] = UserRecord(user_id)
+        return record
+    
+    def _discard_if_empty(self, record: UserRecord):
+        """지갑도 블랙리스트도 없는 레코드 제거 (lock 안에서 호출)"""
+        if not record.wallet and not record.blacklisted:
+            self.records.pop(record.user_id, None)
+    
+    @staticmethod
+    def _parse_id(user_id, source: str) -> Optional[int]:
+        """저장된 키를 정수 user_id로 변환 (숫자가 아니면 경고 후 None)"""
+        try:
+            return int(user_id)
+        except (TypeError, ValueError):
+            logging.warning(f"숫자가 아닌 사용자 ID 건너뜀 ({source}): {user_id!r}")
+            return None
+    
+    def load_wallets(self, wallets: Dict[str, str]):
+        """저장된 지갑으로 교체 (블랙리스트 상태는 유지)"""
+        with self.lock:
+            for record in list(self.records.values()):
+                record.wallet = None
+                self._discard_if_empty(record)
+            self.wallet_total = 0
+            for user_id, wallet in wallets.items():
+                uid = self._parse_id(user_id, 'wallets')
+                if uid is None or not wallet:
+                    continue
+                record = self._ensure(uid)
+                if not record.wallet:
+                    self.wallet_total += 1
+                record.wallet = wallet
+    
+    def load_blacklist(self, blacklist: List[str]):
+        """저장된 블랙리스트로 교체 (지갑은 유지)"""
+        with self.lock:
+            for record in list(self.records.values()):
+                record.blacklisted = False
+                self._discard_if_empty(record)
+            for user_id in blacklist:
+                uid = self._parse_id(user_id, 'blacklist')
+                if uid is not None:
+                    self._ensure(uid).blacklisted = True
+    
+    def set_wallet(self, user_id, wallet: Optional[str]) -> Optional[str]:
+        """지갑 등록/삭제 반영
+        Returns: 이전 지갑 주소
+        """
+        with self.lock:
+            record = self._ensure(int(user_id))
+            previous = record.wallet
+            record.wallet = wallet
+            self.wallet_total += bool(wallet) - bool(previous)
+            self._discard_if_empty(record)
+            return previous
+    
+    def set_blacklisted(self, user_id, blacklisted: bool):
+        """블랙리스트 상태 반영"""
+        with self.lock:
+            record = self._ensure(int(user_id))
+            record.blacklisted = blacklisted
+            self._discard_if_empty(record)
+    
+    def wallet_count(self) -> int:
+        return self.wallet_total
+    
+    def wallets(self) -> Dict[str, str]:
+        """wallets.json 저장 형식 {user_id(str): 주소}"""
+        with self.lock:
+            return {str(uid): record.wallet for uid, record in self.records.items() if record.wallet}
+    
+    def blacklisted_ids(self) -> List[str]:
+        """blacklist.json 저장 형식 [user_id(str)]"""
+        with self.lock:
+            return [str(uid) for uid, record in self.records.items() if record.blacklisted]
+
+class DropHistoryColumns:
+    """컬럼형 드랍 이력 (epoch 타임스탬프 + 정수 wei 금액)
+
+    JSON 이력의 문자열 타임스탬프는 로드할 때 한 번만 파싱하고 이후에는
+    배열 컬럼으로 유지해 일별/채팅방별/사용자별 집계를 빠르게 계산한다.
+    numpy가 설치되어 있으면 벡터 연산으로 집계한다.
+    """
+    
+    MAGIC = b'RBTCCOL1'
+    COLUMNS = (('timestamp', 'd'), ('amount_wei', 'q'), ('user_id', 'q'), ('chat_id', 'q'))
+    GROUP_KEYS = ('day', 'chat', 'user')
+    
+    def __init__(self):
+        from array import array
+        self.columns = {name: array(typecode) for name, typecode in self.COLUMNS}
+        self.lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return len(self.columns['timestamp'])
+    
+    @staticmethod
+    def parse_timestamp(record: Dict) -> float:
+        """드랍 이력 타임스탬프 문자열을 epoch 초로 변환 (실패시 0)"""
+        try:
+            return datetime.strptime(record['timestamp'], '%Y-%m-%d %H:%M:%S KST').timestamp()
+        except (KeyError, TypeError, ValueError):
+            return 0.0
+    
+    @staticmethod
+    def amount_wei(record: Dict) -> int:
+        """드랍 이력 금액을 정수 wei로 변환 (이전 amount_rbtc 기록 포함)"""
+        if 'amount_wei' in record:
+            return int(record['amount_wei'])
+        return rbtc_to_wei(record.get('amount_rbtc', 0))
+    
+    @classmethod
+    def from_records(cls, records: List[Dict]) -> 'DropHistoryColumns':
+        """JSON 드랍 이력으로 컬럼 생성"""
+        columns = cls()
+        for record in records:
+            columns.append(record)
+        return columns
+    
+    def append(self, record: Dict):
+        """드랍 이력 레코드 한 건 추가"""
+        with self.lock:
+            self.columns['timestamp'].append(self.parse_timestamp(record))
+            self.columns['amount_wei'].append(self.amount_wei(record))
+            self.columns['user_id'].append(int(record.get('telegram_id') or 0))
+            self.columns['chat_id'].append(int(record.get('chat_id') or 0))
+    
+    def to_bytes(self) -> bytes:
+        """내보내기용 바이너리 (MAGIC + 헤더 길이 + JSON 헤더 + 컬럼 원시 바이트)"""
+        with self.lock:
+            header = {
+                'byteorder': sys.byteorder,
+                'rows': len(self),
+                'columns': [[name, typecode] for name, typecode in self.COLUMNS]
+            }
+            body = b''.join(self.columns[name].tobytes() for name, _ in self.COLUMNS)
+        header_bytes = json.dumps(header).encode()
+        return self.MAGIC + len(header_bytes).to_bytes(4, 'little') + header_bytes + body
+    
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'DropHistoryColumns':
+        """to_bytes()로 내보낸 바이너리 읽기"""
+        if not data.startswith(cls.MAGIC):
+            raise ValueError("컬럼 파일 형식이 아닙니다")
+        offset = len(cls.MAGIC)
+        header_len = int.from_bytes(data[offset:offset + 4], 'little')
+        offset += 4
+        header = json.loads(data[offset:offset + header_len])
+        offset += header_len
+        columns = cls()
+        for name, typecode in header['columns']:
+            column = columns.columns[name]
+            size = column.itemsize * header['rows']
+            column.frombytes(data[offset:offset + size])
+            if header['byteorder'] != sys.byteorder:
+                column.byteswap()
+            offset += size
+        return columns
+    
+    def export(self, path: str) -> int:
+        """컬럼 파일로 내보내기 (기록한 바이트 수 반환)"""
+        data = self.to_bytes()
+        with open(path, 'wb') as f:
+            f.write(data)
+        return len(data)
+    
+    def aggregate(self, group_by: str, day_offset: float = 0.0) -> List[tuple]:
+        """그룹별 (키, 드랍 횟수, 합계 wei) 목록 - 합계 내림차순 (day는 날짜순)
+
+        day_offset: 일 경계 계산용 보정 초 (UTC 오프셋 - 리셋 시각)
+        """
+        if group_by not in self.GROUP_KEYS:
+            raise ValueError(f"지원하지 않는 집계 기준: {group_by}")
+        with self.lock:
+            amounts = self.columns['amount_wei']
+            if group_by == 'day':
+                keys = self.columns['timestamp']
+            else:
+                keys = self.columns['chat_id' if group_by == 'chat' else 'user_id']
+            try:
+                rows = self._aggregate_numpy(keys, amounts, group_by == 'day', day_offset)
+            except ImportError:
+                rows = self._aggregate_python(keys, amounts, group_by == 'day', day_offset)
+        if group_by == 'day':
+            rows = [((datetime(1970, 1, 1) + timedelta(days=day)).date().isoformat(), count, total)
+                    for day, count, total in sorted(rows)]
+        else:
+            rows.sort(key=lambda row: row[2], reverse=True)
+        return rows
+    
+    def report(self, group_by: str, day_offset: float = 0.0, limit: int = 20) -> str:
+        """집계 결과 텍스트"""
+        started = time.perf_counter()
+        rows = self.aggregate(group_by, day_offset)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if group_by == 'day':
+            rows = rows[-limit:]
+        else:
+            rows = rows[:limit]
+        labels = {'day': '일별', 'chat': '채팅방별', 'user': '사용자별'}
+        text = f"📈 {labels[group_by]} 드랍 집계 ({len(self)}건, {elapsed_ms:.1f}ms)\n\n"
+        for key, count, total in rows:
+            text += f"{key}: {count}회, {format_rbtc(total)} RBTC\n"
+        return text
+    
+    @staticmethod
+    def _aggregate_numpy(keys, amounts, by_day: bool, day_offset: float) -> List[tuple]:
+        import numpy as np
+        key_values = np.frombuffer(keys, dtype=keys.typecode)
+        if by_day:
+            key_values = ((key_values + day_offset) // 86400).astype(np.int64)
+        unique, inverse = np.unique(key_values, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(unique))
+        totals = np.zeros(len(unique), dtype=np.int64)
+        np.add.at(totals, inverse, np.frombuffer(amounts, dtype=np.int64))
+        return [(int(k), int(c), int(t)) for k, c, t in zip(unique, counts, totals)]
+    
+    @staticmethod
+    def _aggregate_python(keys, amounts, by_day: bool, day_offset: float) -> List[tuple]:
+        groups = {}
+        for key, amount in zip(keys, amounts):
+            if by_day:
+                key = int((key + day_offset) // 86400)
+            entry = groups.get(key)
+            if entry is None:
+                groups[key] = [1, amount]
+            else:
+                entry[0] += 1
+                entry[1] += amount
+        return [(key, count, total) for key, (count, total) in groups.items()]
+
+class DropHistoryIndex:
+    """사용자별/지갑별 드랍 이력 위치(offset) 색인
+
+    drop_history는 추가만 되므로 레코드 위치가 바뀌지 않는다. 키마다 offset 배열과
+    (횟수, 합계 wei)를 유지해 개인 이력 조회가 전체 이력 크기와 무관하게
+    페이지 크기만큼만 읽도록 한다.
+    """
+    
+    def __init__(self):
+        self.offsets = {}  # {('user', user_id) | ('wallet', 소문자 주소): array('q')}
+        self.totals = {}   # {같은 키: [횟수, 합계 wei]}
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def _keys(record: Dict) -> List[tuple]:
+        keys = []
+        try:
+            keys.append(('user', int(record.get('telegram_id'))))
+        except (TypeError, ValueError):
+            pass
+        if record.get('wallet_address'):
+            keys.append(('wallet', record['wallet_address'].lower()))
+        return keys
+    
+    def _add(self, offset: int, record: Dict):
+        """offset 등록 (lock 안에서 호출)"""
+        from array import array
+        amount = DropHistoryColumns.amount_wei(record)
+        for key in self._keys(record):
+            self.offsets.setdefault(key, array('q')).append(offset)
+            total = self.totals.setdefault(key, [0, 0])
+            total[0] += 1
+            total[1] += amount
+    
+    @classmethod
+    def from_records(cls, records: List[Dict]) -> 'DropHistoryIndex':
+        """로드한 드랍 이력으로 색인 생성"""
+        index = cls()
+        with index.lock:
+            for offset, record in enumerate(records):
+                index._add(offset, record)
+        return index
+    
+    def append(self, history: List[Dict], record: Dict):
+        """이력 추가와 색인 갱신을 함께 (동시 정산에서도 offset이 어긋나지 않음)"""
+        with self.lock:
+            history.append(record)
+            self._add(len(history) - 1, record)
+    
+    @staticmethod
+    def key(user_id=None, wallet: Optional[str] = None) -> tuple:
+        return ('wallet', wallet.lower()) if wallet else ('user', int(user_id))
+    
+    def summary(self, key: tuple) -> tuple[int, int]:
+        """(드랍 횟수, 합계 wei)"""
+        count, total = self.totals.get(key, (0, 0))
+        return count, total
+    
+    def page(self, history: List[Dict], key: tuple, page: int = 1, page_size: int = 5) -> tuple[List[Dict], int]:
+        """최신순 페이지 조회
+        Returns: (해당 페이지 레코드, 전체 페이지 수)
+        """
+        with self.lock:
+            offsets = self.offsets.get(key)
+            if not offsets:
+                return [], 0
+            pages = (len(offsets) + page_size - 1) // page_size
+            end = len(offsets) - (page - 1) * page_size
+            selected = offsets[max(0, end - page_size):max(0, end)]
+            return [history[offset] for offset in reversed(selected)], pages
+
+class DropLedger:
+    """드랍 선기록(write-ahead) 원장
+
+    드랍 의도를 브로드캐스트 전에 서명된 raw 트랜잭션/nonce와 함께 저장하고,
+    재시도와 재시작 시에는 같은 서명 바이트만 다시 브로드캐스트하여 중복 지급을 막는다.
+    상태: created -> signed -> (broadcast) -> completed (또는 failed)
+    완료(complete)는 메모리에만 반영해 두고, 일일 전송량/이력이 저장된 뒤 commit에서 기록한다.
+    그 전까지 저장소에는 완료 전 상태가 남으므로 재시작하면 체인 상태로 다시 정산한다.
+    raw_tx는 열린 의도에만 저장한다.
+    """
+    
+    OPEN_STATUSES = ('created', 'signed', 'broadcast')
+    RETENTION_SECONDS = 24 * 60 * 60  # 종료된 의도 보관 기간
+    
+    def __init__(self, wallet_manager: 'WalletManager'):
+        self.wallet_manager = wallet_manager
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()  # 오래된 스냅샷이 최신 저장을 덮어쓰지 않도록 직렬화
+        self.intents = wallet_manager.load_drop_ledger()  # {intent_id: intent}
+        self.deferred = {}  # {intent_id: 완료 전 마지막 저장 형태} - commit 전까지 이 형태로 저장
+    
+    def reload(self):
+        """저장소에서 원장 다시 로드"""
+        intents = self.wallet_manager.load_drop_ledger()
+        with self.lock:
+            self.intents = intents
+            self.deferred = {}
+    
+    @staticmethod
+    def make_intent_id(chat_id: int, message_id: int) -> str:
+        """텔레그램 메시지 하나당 드랍 의도 하나 (멱등 키)"""
+        return f"{chat_id}:{message_id}"
+    
+    def exists(self, intent_id: str) -> bool:
+        """이미 처리된(또는 처리 중인) 의도인지 확인"""
+        with self.lock:
+            return intent_id in self.intents
+    
+    def create(self, intent_id: str, **fields) -> Optional[Dict]:
+        """새 드랍 의도 기록
+        Returns: intent dict, 저장 실패시 None
+        """
+        now = time.time()
+        with self.lock:
+            if intent_id in self.intents:
+                return None
+            intent = {
+                'id': intent_id,
+                'status': 'created',
+                'created_at': now,
+                'updated_at': now,
+                'accounted': False,
+                **fields
+            }
+            self.intents[intent_id] = intent
+        
+        if not self._persist():
+            logging.error(f"드랍 원장 기록 실패: {intent_id}")
+            return None
+        return intent
+    
+    def update(self, intent_id: str, **fields) -> bool:
+        """의도 상태 갱신 후 즉시 저장"""
+        with self.lock:
+            intent = self.intents.get(intent_id)
+            if intent is None:
+                return False
+            intent.update(fields)
+            intent['updated_at'] = time.time()
+        return self._persist()
+    
+    def complete(self, intent_id: str, **fields) -> bool:
+        """정산 완료 표시 - 메모리에만 반영 (저장은 commit)"""
+        with self.lock:
+            intent = self.intents.get(intent_id)
+            if intent is None:
+                return False
+            self.deferred.setdefault(intent_id, dict(intent))
+            intent.update(fields, status='completed', accounted=True, updated_at=time.time())
+            intent.pop('raw_tx', None)
+            return True
+    
+    def deferred_ids(self) -> set:
+        """저장 대기 중인 완료 의도 (flush 시작 시점 - 이후 저장되는 이력/전송량에 포함됨)"""
+        with self.lock:
+            return set(self.deferred)
+    
+    def commit(self, intent_ids: set) -> bool:
+        """완료 의도 저장 (일일 전송량/이력 저장 뒤 호출, 실패하면 다음 commit에서 재시도)"""
+        with self.lock:
+            taken = {k: self.deferred.pop(k) for k in intent_ids if k in self.deferred}
+        if self._persist():
+            return True
+        with self.lock:
+            for intent_id, durable in taken.items():
+                self.deferred.setdefault(intent_id, durable)
+        return False
+    
+    def get(self, intent_id: str) -> Optional[Dict]:
+        """의도 조회 (복사본)"""
+        with self.lock:
+            intent = self.intents.get(intent_id)
+            return dict(intent) if intent else None
+    
+    def open_intents(self) -> List[Dict]:
+        """아직 완료되지 않은 의도 목록 (생성 순)"""
+        with self.lock:
+            pending = [dict(i) for i in self.intents.values() if i['status'] in self.OPEN_STATUSES]
+        return sorted(pending, key=lambda i: i['created_at'])
+    
+    def _persist(self) -> bool:
+        """오래된 종료 의도 정리 후 저장 (commit 전 완료 의도는 완료 전 형태로, 종료 의도는 raw_tx 제외)"""
+        cutoff = time.time() - self.RETENTION_SECONDS
+        with self.save_lock:
+            with self.lock:
+                self.intents = {
+                    k: v for k, v in self.intents.items()
+                    if v['status'] in self.OPEN_STATUSES or v['updated_at'] >= cutoff
+                }
+                snapshot = {}
+                for k, v in self.intents.items():
+                    intent = dict(self.deferred.get(k, v))
+                    if intent['status'] not in self.OPEN_STATUSES:
+                        intent.pop('raw_tx', None)
+                    snapshot[k] = intent
+            return self.wallet_manager.save_drop_ledger(snapshot)
+
+class WalletManager:
+    """GitHub Gist를 사용한 지갑 주소 관리 클래스"""
+    
+    CHUNK_RECORDS = 1000  # 청크 파일당 최대 레코드 수
+    FETCH_FAILED = object()  # 조회 실패 표시 (문서 없음과 구분)
+    
+    def __init__(self, gist_token: str = None, gist_id: str = None, api_url: str = None):
+        self.gist_token = gist_token or os.getenv('GITHUB_GIST_TOKEN')
+        self.gist_id = gist_id or os.getenv('GITHUB_GIST_ID')
+        self.api_url = (api_url or os.getenv('GITHUB_API_URL') or 'https://api.github.com').rstrip('/')  # 테스트용 Gist API 대체 서버 지정 가능
+        self.write_fence = None  # 상태 저장 허용 여부 (리더 임대 보유시에만 - run에서 연결)
+        
+        # Gist 사용 불가시 로컬 파일 백업
+        self.use_local = not (self.gist_token and self.gist_id)
+        self.wallet_file = "wallets.json"
+        # 리더 임대 전용 Gist (임대 확인마다 드랍 이력 청크까지 받지 않도록, 미설정시 상태 Gist 사용)
+        self.lease_gist_id = os.getenv('LEADER_LEASE_GIST_ID') or self.gist_id
+        
+        # 청크 저장 문서의 마지막 manifest (변경된 청크만 업로드) / 청크 전환 전 단일 파일
+        self._chunk_manifests = {}
+        self._legacy_files = set()
+        self._unreadable = set()  # 로드에 실패한 청크 문서 - 다시 읽기 전까지 저장 차단 (빈 목록으로 덮어쓰지 않도록)
+        
+        # 시작 시 Gist를 한 번만 받아 모든 로더가 공유 (release_snapshot 전까지)
+        self._gist_snapshot = None
+        self.take_snapshot()
+        
+        # 지갑 데이터 로드 (사용자 레지스트리가 유일한 저장소 - 봇도 같은 객체를 사용)
+        self.users = UserRegistry()
+        self.address_index = {}
+        self.reload_wallets()
+    
+    def take_snapshot(self):
+        """Gist를 한 번 받아 이후 로더들이 공유하도록 보관"""
+        if not self.use_local:
+            self._gist_snapshot = None
+            self._gist_snapshot = self._fetch_gist_files()
+    
+    def reload_wallets(self):
+        """지갑 데이터 로드 (검증된 주소 타입으로 변환) 및 역방향 인덱스 재구성"""
+        self.users.load_wallets({
+            user_id: WalletAddress.parse(address) or address
+            for user_id, address in self._load_wallets().items()
+        })
+        
+        # 역방향 인덱스 {주소(소문자): {user_id}} - 주소 공유(다중 계정) 확인용
+        self.address_index = {}
+        for user_id, address in self.users.wallets().items():
+            self._index_add(user_id, address)
+    
+    def _index_add(self, user_id: str, address: str):
+        """역방향 인덱스에 추가"""
+        self.address_index.setdefault(address.lower(), set()).add(user_id)
+    
+    def _index_remove(self, user_id: str, address: str):
+        """역방향 인덱스에서 제거"""
+        key = address.lower()
+        users = self.address_index.get(key)
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                del self.address_index[key]
+    
+    def _load_wallets(self) -> Dict[str, str]:
+        """지갑 데이터 로드 (Gist 또는 로컬)"""
+        if self.use_local:
+            try:
+                if os.path.exists(self.wallet_file):
+                    with open(self.wallet_file, 'r', encoding='utf-8') as f:
+                        return json.load(f)
+            except Exception as e:
+                logging.error(f"로컬 지갑 데이터 로드 실패: {e}")
+            return {}
+        
+        # GitHub Gist에서 로드
+        try:
+            files = self._fetch_gist_files()
+            if files and 'wallets.json' in files:
+                content = self._file_content(files, 'wallets.json')
+                return json.loads(content)
+        except Exception as e:
+            logging.error(f"Gist 데이터 로드 실패: {e}")
+        
+        return {}
+    
+    def _fetch_gist_files(self, gist_id: Optional[str] = None) -> Optional[Dict[str, Dict]]:
+        """Gist 파일 목록 조회 (상태 Gist는 시작 스냅샷이 있으면 재사용)"""
+        gist_id = gist_id or self.gist_id
+        if self._gist_snapshot is not None and gist_id == self.gist_id:
+            return self._gist_snapshot
+        
+        headers = {
+            'Authorization': f'token {self.gist_token}',
+            'Accept': 'application/vnd.github.v3+json'
+        }
+        response = requests.get(
+            f'{self.api_url}/gists/{gist_id}',
+            headers=headers
+        )
+        
+        if response.status_code == 200:
+            return response.json()['files']
+        logging.error(f"Gist 로드 실패: {response.status_code}")
+        return None
+    
+    def ping(self) -> bool:
+        """저장소 연결 확인 (Gist는 호출 한도에 포함되지 않는 /rate_limit 조회)"""
+        if self.use_local:
+            return os.access('.', os.W_OK)
+        response = requests.get(f'{self.api_url}/rate_limit', headers={'Authorization': f'token {self.gist_token}'}, timeout=5)
+        return response.status_code == 200  # 401(토큰 오류)/403(한도 소진)도 저장 불가로 판단
+    
+    def _file_content(self, files: Dict[str, Dict], filename: str) -> Optional[str]:
+        """Gist 파일 내용 - API 응답에서 잘린(truncated) 큰 파일은 raw_url에서 스트리밍으로 받음"""
+        entry = files.get(filename)
+        if not entry:
+            return None
+        if entry.get('truncated') and entry.get('raw_url'):
+            response = requests.get(
+                entry['raw_url'],
+                headers={'Authorization': f'token {self.gist_token}'},
+                stream=True,
+                timeout=30
+            )
+            response.raise_for_status()
+            return b''.join(response.iter_content(chunk_size=64 * 1024)).decode('utf-8')
+        return entry.get('content')
+    
+    def release_snapshot(self):
+        """시작 스냅샷 해제 - 이후 로드는 Gist에서 새로 조회"""
+        self._gist_snapshot = None
+    
+    def _fenced(self, name: str) -> bool:
+        """리더 임대를 잃은 인스턴스의 상태 저장 차단 (새 리더의 상태를 덮어쓰지 않도록)"""
+        if self.write_fence and not self.write_fence():
+            logging.error(f"리더 임대 없음 - {name} 저장 거부")
+            return True
+        return False
+    
+    def _save_wallets(self) -> bool:
+        """지갑 데이터 저장 (Gist 또는 로컬)"""
+        if self._fenced('wallets'):
+            return False
+        if self.use_local:
+            try:
+                with open(self.wallet_file, 'w', encoding='utf-8') as f:
+                    json.dump(self.users.wallets(), f, indent=2, ensure_ascii=False)
+                return True
+            except Exception as e:
+                logging.error(f"로컬 지갑 데이터 저장 실패: {e}")
+                return False
+        
+        # GitHub Gist에 저장 (wallets.json만 PATCH)
+        if self._save_gist_json('wallets.json', self.users.wallets()):
+            logging.info("Gist에 지갑 데이터 저장 성공")
+            return True
+        return False
+    
+    """지갑 주소 유효성 검사"""
+    def is_valid_address(self, address: str) -> bool:
+        
+        # 이더리움 주소 형식 (0x + 40자리 hex) 및 EIP-55/EIP-1191 체크섬 검증
+        return WalletAddress.parse(address) is not None
+    """지갑 주소 등록"""
+    def set_wallet(self, user_id: str, wallet_address: str) -> bool:
+       
+        # 등록 시 한 번만 검증하고 체크섬 주소로 변환
+        checksum_address = WalletAddress.parse(wallet_address)
+        if checksum_address is None:
+            return False
+        
+        previous = self.users.set_wallet(user_id, checksum_address)
+        if previous:
+            self._index_remove(user_id, previous)
+        self._index_add(user_id, checksum_address)
+        
+        return self._save_wallets()
+    """지갑 주소 조회"""
+    def get_wallet(self, user_id: str) -> Optional[str]:
+        
+        user = self.users.get(user_id)
+        return user.wallet if user else None
+    """지갑 주소 삭제"""
+    def remove_wallet(self, user_id: str) -> bool:
+        
+        if self.get_wallet(user_id):
+            self._index_remove(user_id, self.users.set_wallet(user_id, None))
+            return self._save_wallets()
+        return False
+    """모든 지갑 주소 조회"""
+    def get_all_wallets(self) -> Dict[str, str]:
+        return self.users.wallets()
+    
+    def wallet_count(self) -> int:
+        """등록 지갑 수 (딕셔너리 복사 없이)"""
+        return self.users.wallet_count()
+    
+    def get_users_by_address(self, address: str) -> List[str]:
+        """주소를 등록한 사용자 ID 목록 (O(1) 조회)"""
+        return sorted(self.address_index.get(address.lower(), ()))
+    
+    def is_shared_address(self, address: str) -> bool:
+        """여러 계정이 같은 주소를 등록했는지 확인"""
+        return len(self.address_index.get(address.lower(), ())) > 1
+    
+    def get_shared_addresses(self) -> Dict[str, List[str]]:
+        """여러 계정이 공유하는 주소 목록"""
+        return {
+            self.get_wallet(next(iter(users))): sorted(users)
+            for users in self.address_index.values() if len(users) > 1
+        }
+    
+    def load_daily_sent(self) -> Dict[str, Any]:
+        """Gist에서 일일 전송량 로드"""
+        if self.use_local:
+            try:
+                if os.path.exists('daily_sent.json'):
+                    with open('daily_sent.json', 'r') as f:
                         return json.load(f)
             except:
                 pass
@@ -245,27 +1533,19 @@ class WalletManager:
         
         # Gist에서 로드
         try:
-            headers = {
-                'Authorization': f'token {self.gist_token}',
-                'Accept': 'application/vnd.github.v3+json'
-            }
-            response = requests.get(
-                f'https://api.github.com/gists/{self.gist_id}',
-                headers=headers
-            )
-            
-            if response.status_code == 200:
-                gist_data = response.json()
-                if 'daily_sent.json' in gist_data['files']:
-                    content = gist_data['files']['daily_sent.json']['content']
-                    return json.loads(content)
+            files = self._fetch_gist_files()
+            if files and 'daily_sent.json' in files:
+                content = self._file_content(files, 'daily_sent.json')
+                return json.loads(content)
         except:
             pass
         
         return {}
     
-    def save_daily_sent(self, daily_sent: Dict[str, float]) -> bool:
+    def save_daily_sent(self, daily_sent: Dict[str, Any]) -> bool:
         """Gist에 일일 전송량 저장"""
+        if self._fenced('daily_sent'):
+            return False
         if self.use_local:
             try:
                 with open('daily_sent.json', 'w') as f:
@@ -274,41 +1554,8 @@ class WalletManager:
             except:
                 return False
         
-        # Gist에 저장
-        try:
-            headers = {
-                'Authorization': f'token {self.gist_token}',
-                'Accept': 'application/vnd.github.v3+json'
-            }
-            
-            # 기존 Gist 내용 가져오기
-            response = requests.get(
-                f'https://api.github.com/gists/{self.gist_id}',
-                headers=headers
-            )
-            
-            if response.status_code == 200:
-                gist_data = response.json()
-                files = gist_data['files']
-                
-                # daily_sent.json 추가/업데이트
-                files['daily_sent.json'] = {
-                    'content': json.dumps(daily_sent, indent=2)
-                }
-                
-                # Gist 업데이트
-                update_data = {'files': files}
-                update_response = requests.patch(
-                    f'https://api.github.com/gists/{self.gist_id}',
-                    headers=headers,
-                    json=update_data
-                )
-                
-                return update_response.status_code == 200
-        except:
-            pass
-        
-        return False
+        # Gist에 저장 (해당 파일만 PATCH - 다른 파일 내용을 다시 보내지 않음)
+        return self._save_gist_json('daily_sent.json', daily_sent)
     
     def load_limit_notifications(self) -> Dict[str, List[int]]:
         """한도 도달 알림 기록 로드"""
@@ -323,20 +1570,10 @@ class WalletManager:
         
         # Gist에서 로드
         try:
-            headers = {
-                'Authorization': f'token {self.gist_token}',
-                'Accept': 'application/vnd.github.v3+json'
-            }
-            response = requests.get(
-                f'https://api.github.com/gists/{self.gist_id}',
-                headers=headers
-            )
-            
-            if response.status_code == 200:
-                gist_data = response.json()
-                if 'limit_notifications.json' in gist_data['files']:
-                    content = gist_data['files']['limit_notifications.json']['content']
-                    return json.loads(content)
+            files = self._fetch_gist_files()
+            if files and 'limit_notifications.json' in files:
+                content = self._file_content(files, 'limit_notifications.json')
+                return json.loads(content)
         except:
             pass
         
@@ -344,6 +1581,8 @@ class WalletManager:
     
     def save_limit_notifications(self, notifications: Dict[str, List[int]]) -> bool:
         """한도 도달 알림 기록 저장"""
+        if self._fenced('limit_notifications'):
+            return False
         if self.use_local:
             try:
                 with open('limit_notifications.json', 'w') as f:
@@ -352,73 +1591,30 @@ class WalletManager:
             except:
                 return False
         
-        # Gist에 저장
+        # Gist에 저장 (해당 파일만 PATCH - 다른 파일 내용을 다시 보내지 않음)
+        return self._save_gist_json('limit_notifications.json', notifications)
+    
+    def load_last_winners(self) -> Dict[int, str]:
+        """Gist에서 마지막 당첨자 정보 로드"""
+        if self.use_local:
+            try:
+                if os.path.exists('last_winners.json'):
+                    with open('last_winners.json', 'r') as f:
+                        data = json.load(f)
+                        # 키를 int로 변환
+                        return {int(k): v for k, v in data.items()}
+            except:
+                pass
+            return {}
+        
+        # Gist에서 로드
         try:
-            headers = {
-                'Authorization': f'token {self.gist_token}',
-                'Accept': 'application/vnd.github.v3+json'
-            }
-            
-            # 기존 Gist 내용 가져오기
-            response = requests.get(
-                f'https://api.github.com/gists/{self.gist_id}',
-                headers=headers
-            )
-            
-            if response.status_code == 200:
-                gist_data = response.json()
-                files = gist_data['files']
-                
-                # limit_notifications.json 추가/업데이트
-                files['limit_notifications.json'] = {
-                    'content': json.dumps(notifications, indent=2)
-                }
-                
-                # Gist 업데이트
-                update_data = {'files': files}
-                update_response = requests.patch(
-                    f'https://api.github.com/gists/{self.gist_id}',
-                    headers=headers,
-                    json=update_data
-                )
-                
-                return update_response.status_code == 200
-        except:
-            pass
-        
-        return False
-    
-    def load_last_winners(self) -> Dict[int, str]:
-        """Gist에서 마지막 당첨자 정보 로드"""
-        if self.use_local:
-            try:
-                if os.path.exists('last_winners.json'):
-                    with open('last_winners.json', 'r') as f:
-                        data = json.load(f)
-                        # 키를 int로 변환
-                        return {int(k): v for k, v in data.items()}
-            except:
-                pass
-            return {}
-        
-        # Gist에서 로드
-        try:
-            headers = {
-                'Authorization': f'token {self.gist_token}',
-                'Accept': 'application/vnd.github.v3+json'
-            }
-            response = requests.get(
-                f'https://api.github.com/gists/{self.gist_id}',
-                headers=headers
-            )
-            
-            if response.status_code == 200:
-                gist_data = response.json()
-                if 'last_winners.json' in gist_data['files']:
-                    content = gist_data['files']['last_winners.json']['content']
-                    data = json.loads(content) if content else {}
-                    # 키를 int로 변환
-                    return {int(k): v for k, v in data.items()}
+            files = self._fetch_gist_files()
+            if files and 'last_winners.json' in files:
+                content = self._file_content(files, 'last_winners.json')
+                data = json.loads(content) if content else {}
+                # 키를 int로 변환
+                return {int(k): v for k, v in data.items()}
         except:
             pass
         
@@ -437,24 +1633,14 @@ class WalletManager:
         
         # Gist에서 로드
         try:
-            headers = {
-                'Authorization': f'token {self.gist_token}',
-                'Accept': 'application/vnd.github.v3+json'
-            }
-            response = requests.get(
-                f'https://api.github.com/gists/{self.gist_id}',
-                headers=headers
-            )
-            
-            if response.status_code == 200:
-                gist_data = response.json()
-                if 'blacklist.json' in gist_data['files']:
-                    content = gist_data['files']['blacklist.json']['content']
-                    if content:
-                        loaded = json.loads(content)
-                        # None이거나 리스트가 아닌 경우 빈 리스트 반환
-                        return loaded if isinstance(loaded, list) else []
-                    return []
+            files = self._fetch_gist_files()
+            if files and 'blacklist.json' in files:
+                content = self._file_content(files, 'blacklist.json')
+                if content:
+                    loaded = json.loads(content)
+                    # None이거나 리스트가 아닌 경우 빈 리스트 반환
+                    return loaded if isinstance(loaded, list) else []
+                return []
         except:
             pass
         
@@ -471,29 +1657,18 @@ class WalletManager:
                 pass
             return []
         
-        # Gist에서 로드
+        # Gist에서 로드 (청크 manifest 우선, 없으면 이전 단일 파일)
         try:
-            headers = {
-                'Authorization': f'token {self.gist_token}',
-                'Accept': 'application/vnd.github.v3+json'
-            }
-            response = requests.get(
-                f'https://api.github.com/gists/{self.gist_id}',
-                headers=headers
-            )
-            
-            if response.status_code == 200:
-                gist_data = response.json()
-                if 'drop_history.json' in gist_data['files']:
-                    content = gist_data['files']['drop_history.json']['content']
-                    return json.loads(content) if content else []
-        except:
-            pass
+            return self._load_chunked('drop_history')
+        except Exception as e:
+            logging.error(f"Gist 드랍 이력 로드 실패 (다시 로드할 때까지 이력 저장 안 함): {e}")
         
         return []
     
     def save_drop_history(self, history: List[Dict]) -> bool:
         """드랍 이력 저장"""
+        if self._fenced('drop_history'):
+            return False
         if self.use_local:
             try:
                 with open('drop_history.json', 'w') as f:
@@ -502,43 +1677,17 @@ class WalletManager:
             except:
                 return False
         
-        # Gist에 저장
+        # Gist에 저장 (변경된 청크만)
         try:
-            headers = {
-                'Authorization': f'token {self.gist_token}',
-                'Accept': 'application/vnd.github.v3+json'
-            }
-            
-            # 기존 Gist 내용 가져오기
-            response = requests.get(
-                f'https://api.github.com/gists/{self.gist_id}',
-                headers=headers
-            )
-            
-            files = {}
-            if response.status_code == 200:
-                gist_data = response.json()
-                # 기존 파일들 유지
-                for filename in ['wallets.json', 'daily_sent.json', 'limit_notifications.json', 'last_winners.json', 'blacklist.json', 'drop_history.json']:
-                    if filename in gist_data['files']:
-                        files[filename] = {'content': gist_data['files'][filename]['content']}
-            
-            # 드랍 이력 업데이트
-            files['drop_history.json'] = {'content': json.dumps(history, indent=2, ensure_ascii=False)}
-            
-            # Gist 업데이트
-            update_response = requests.patch(
-                f'https://api.github.com/gists/{self.gist_id}',
-                headers=headers,
-                json={'files': files}
-            )
-            
-            return update_response.status_code == 200
-        except:
+            return self._save_chunked('drop_history', history)
+        except Exception as e:
+            logging.error(f"Gist 드랍 이력 저장 실패: {e}")
             return False
     
     def save_blacklist(self, blacklist: List[str]) -> bool:
         """블랙리스트 저장"""
+        if self._fenced('blacklist'):
+            return False
         if self.use_local:
             try:
                 with open('blacklist.json', 'w') as f:
@@ -547,43 +1696,13 @@ class WalletManager:
             except:
                 return False
         
-        # Gist에 저장
-        try:
-            headers = {
-                'Authorization': f'token {self.gist_token}',
-                'Accept': 'application/vnd.github.v3+json'
-            }
-            
-            # 기존 Gist 내용 가져오기
-            response = requests.get(
-                f'https://api.github.com/gists/{self.gist_id}',
-                headers=headers
-            )
-            
-            files = {}
-            if response.status_code == 200:
-                gist_data = response.json()
-                # 기존 파일들 유지
-                for filename in ['wallets.json', 'daily_sent.json', 'limit_notifications.json', 'last_winners.json', 'blacklist.json']:
-                    if filename in gist_data['files']:
-                        files[filename] = {'content': gist_data['files'][filename]['content']}
-            
-            # 블랙리스트 업데이트
-            files['blacklist.json'] = {'content': json.dumps(blacklist, indent=2)}
-            
-            # Gist 업데이트
-            update_response = requests.patch(
-                f'https://api.github.com/gists/{self.gist_id}',
-                headers=headers,
-                json={'files': files}
-            )
-            
-            return update_response.status_code == 200
-        except:
-            return False
+        # Gist에 저장 (해당 파일만 PATCH - 다른 파일 내용을 다시 보내지 않음)
+        return self._save_gist_json('blacklist.json', blacklist)
     
     def save_last_winners(self, last_winners: Dict[int, str]) -> bool:
         """마지막 당첨자 정보 저장"""
+        if self._fenced('last_winners'):
+            return False
         if self.use_local:
             try:
                 with open('last_winners.json', 'w') as f:
@@ -592,52 +1711,264 @@ class WalletManager:
             except:
                 return False
         
-        # Gist에 저장
+        # Gist에 저장 (해당 파일만 PATCH - 다른 파일 내용을 다시 보내지 않음)
+        return self._save_gist_json('last_winners.json', last_winners)
+    
+    def _load_gist_json(self, filename: str, default: Any, on_error: Any = None, gist_id: Optional[str] = None) -> Any:
+        """단일 JSON 문서 로드 (Gist 또는 로컬)
+        문서가 없으면 default, 조회 자체가 실패하면 on_error (지정하지 않으면 default)
+        """
+        on_error = default if on_error is None else on_error
+        if self.use_local:
+            try:
+                if os.path.exists(filename):
+                    with open(filename, 'r', encoding='utf-8') as f:
+                        return json.load(f)
+            except Exception as e:
+                logging.error(f"로컬 {filename} 로드 실패: {e}")
+                return on_error
+            return default
+        
+        try:
+            files = self._fetch_gist_files(gist_id)
+            if files is None:
+                return on_error
+            if filename in files:
+                content = self._file_content(files, filename)
+                return json.loads(content) if content else default
+        except Exception as e:
+            logging.error(f"Gist {filename} 로드 실패: {e}")
+            return on_error
+        
+        return default
+    
+    def _save_gist_json(self, filename: str, data: Any, gist_id: Optional[str] = None) -> bool:
+        """단일 JSON 문서 저장 (Gist 또는 로컬)
+        Gist PATCH는 지정한 파일만 갱신하므로 다른 파일을 다시 보낼 필요 없음
+        """
+        if self.use_local:
+            try:
+                with open(filename, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, indent=2, ensure_ascii=False)
+                return True
+            except Exception as e:
+                logging.error(f"로컬 {filename} 저장 실패: {e}")
+                return False
+        
         try:
             headers = {
                 'Authorization': f'token {self.gist_token}',
                 'Accept': 'application/vnd.github.v3+json'
             }
-            
-            # 기존 Gist 내용 가져오기
-            response = requests.get(
-                f'https://api.github.com/gists/{self.gist_id}',
-                headers=headers
-            )
-            
-            files = {}
-            if response.status_code == 200:
-                gist_data = response.json()
-                # 기존 파일들 유지
-                for filename in ['wallets.json', 'daily_sent.json', 'limit_notifications.json', 'last_winners.json']:
-                    if filename in gist_data['files']:
-                        files[filename] = {'content': gist_data['files'][filename]['content']}
-            
-            # 마지막 당첨자 정보 업데이트
-            files['last_winners.json'] = {'content': json.dumps(last_winners, indent=2)}
-            
-            # Gist 업데이트
             update_response = requests.patch(
-                f'https://api.github.com/gists/{self.gist_id}',
+                f'{self.api_url}/gists/{gist_id or self.gist_id}',
                 headers=headers,
-                json={'files': files}
+                json={'files': {filename: {'content': json.dumps(data, indent=2, ensure_ascii=False)}}}
             )
             
-            return update_response.status_code == 200
-        except:
+            if update_response.status_code == 200:
+                return True
+            logging.error(f"Gist {filename} 저장 실패: {update_response.status_code}")
+        except Exception as e:
+            logging.error(f"Gist {filename} 저장 실패: {e}")
+        
+        return False
+    
+    def _chunk_file(self, name: str, index: int) -> str:
+        return f"{name}.{index:05d}.json.gz.b64"
+    
+    def _load_chunked(self, name: str) -> List:
+        """청크 문서 로드 - {name}.manifest.json의 청크를 순서대로 읽어 이어붙임
+        manifest가 없으면 이전 단일 파일 {name}.json 로드 (다음 저장 때 청크로 전환)
+        조회 실패나 누락/손상된 청크는 예외 - 해당 문서는 다시 읽을 때까지 저장하지 않음
+        """
+        self._unreadable.add(name)
+        files = self._fetch_gist_files()
+        if files is None:
+            raise RuntimeError(f"{name} 로드 실패: Gist 조회 실패")
+        
+        manifest_content = self._file_content(files, f"{name}.manifest.json")
+        if not manifest_content:
+            content = self._file_content(files, f"{name}.json")
+            records = json.loads(content) if content else []
+            if content is not None:
+                self._legacy_files.add(name)
+            self._unreadable.discard(name)
+            return records
+        
+        manifest = json.loads(manifest_content)
+        records = []
+        for chunk in manifest['chunks']:
+            content = self._file_content(files, chunk['file'])
+            if content is None:
+                raise RuntimeError(f"{name} 청크 누락: {chunk['file']}")
+            raw = gzip.decompress(base64.b64decode(content))
+            if hashlib.sha256(raw).hexdigest() != chunk['sha256']:
+                raise RuntimeError(f"{name} 청크 손상 (해시 불일치): {chunk['file']}")
+            records.extend(json.loads(raw))
+        self._chunk_manifests[name] = manifest
+        self._unreadable.discard(name)
+        return records
+    
+    def _save_chunked(self, name: str, records: List) -> bool:
+        """청크 문서 저장 - CHUNK_RECORDS개씩 gzip+base64 청크로 나누고
+        이전 manifest와 해시가 다른 청크와 manifest만 PATCH
+        """
+        if name in self._unreadable:
+            logging.error(f"Gist {name} 저장 차단 - 마지막 로드가 불완전해 기존 청크를 덮어쓸 수 있음")
+            return False
+        previous = {chunk['file']: chunk['sha256'] for chunk in self._chunk_manifests.get(name, {}).get('chunks', [])}
+        chunks = []
+        files = {}
+        for index, start in enumerate(range(0, len(records), self.CHUNK_RECORDS)):
+            raw = json.dumps(records[start:start + self.CHUNK_RECORDS], ensure_ascii=False,
+                             separators=(',', ':')).encode('utf-8')
+            filename = self._chunk_file(name, index)
+            digest = hashlib.sha256(raw).hexdigest()
+            chunks.append({'file': filename, 'sha256': digest, 'records': min(self.CHUNK_RECORDS, len(records) - start)})
+            if previous.get(filename) != digest:
+                files[filename] = {'content': base64.b64encode(gzip.compress(raw, mtime=0)).decode('ascii')}
+        uploaded = len(files)
+        
+        # 줄어든 청크, 청크 전환 전 단일 파일 삭제 (Gist PATCH에서 null은 파일 삭제)
+        for filename in set(previous) - {chunk['file'] for chunk in chunks}:
+            files[filename] = None
+        if name in self._legacy_files:
+            files[f"{name}.json"] = None
+        
+        manifest = {'version': 1, 'encoding': 'gzip+base64', 'records': len(records), 'chunks': chunks}
+        files[f"{name}.manifest.json"] = {'content': json.dumps(manifest, indent=2)}
+        
+        headers = {
+            'Authorization': f'token {self.gist_token}',
+            'Accept': 'application/vnd.github.v3+json'
+        }
+        update_response = requests.patch(
+            f'{self.api_url}/gists/{self.gist_id}',
+            headers=headers,
+            json={'files': files}
+        )
+        if update_response.status_code != 200:
+            logging.error(f"Gist {name} 청크 저장 실패: {update_response.status_code}")
+            return False
+        
+        self._chunk_manifests[name] = manifest
+        self._legacy_files.discard(name)
+        logging.info(f"Gist {name} 저장: 청크 {len(chunks)}개 중 {uploaded}개 업로드")
+        return True
+    
+    def load_rate_limits(self) -> Dict[str, List[float]]:
+        """속도 제한 버킷 상태 로드"""
+        buckets = self._load_gist_json('rate_limits.json', {})
+        return buckets if isinstance(buckets, dict) else {}
+    
+    def save_rate_limits(self, buckets: Dict[str, List[float]]) -> bool:
+        """속도 제한 버킷 상태 저장"""
+        if self._fenced('rate_limits'):
             return False
+        return self._save_gist_json('rate_limits.json', buckets)
+    
+    def load_config(self) -> Dict[str, Any]:
+        """설정 변경값/감사 기록 로드 ({'overrides': {...}, 'audit': [...]})"""
+        config = self._load_gist_json('config.json', {})
+        return config if isinstance(config, dict) else {}
+    
+    def save_config(self, config: Dict[str, Any]) -> bool:
+        """설정 변경값/감사 기록 저장"""
+        if self._fenced('config'):
+            return False
+        return self._save_gist_json('config.json', config)
+    
+    def load_leader_lease(self) -> Any:
+        """리더 임대 문서 로드
+        Returns: 임대 dict, 문서 없음이면 None, 조회 실패면 FETCH_FAILED
+        """
+        lease = self._load_gist_json('leader_lease.json', None, on_error=self.FETCH_FAILED, gist_id=self.lease_gist_id)
+        if lease is self.FETCH_FAILED:
+            return lease
+        return lease if isinstance(lease, dict) else None
+    
+    def save_leader_lease(self, lease: Dict) -> bool:
+        """리더 임대 문서 저장"""
+        return self._save_gist_json('leader_lease.json', lease, gist_id=self.lease_gist_id)
+    
+    def load_drop_ledger(self) -> Dict[str, Dict]:
+        """드랍 원장 로드"""
+        ledger = self._load_gist_json('drop_ledger.json', {})
+        return ledger if isinstance(ledger, dict) else {}
+    
+    def save_drop_ledger(self, ledger: Dict[str, Dict]) -> bool:
+        """드랍 원장 저장"""
+        if self._fenced('drop_ledger'):
+            return False
+        return self._save_gist_json('drop_ledger.json', ledger)
+
+class SenderAccount:
+    """송금 계정 하나의 nonce/잔고/적체 상태"""
+    
+    __slots__ = ('account', 'private_key', 'address', 'lock', 'next_nonce', 'confirmed_nonce',
+                 'balance_wei', 'progress_at')
+    
+    def __init__(self, account, private_key: str):
+        self.account = account
+        self.private_key = private_key
+        self.address = account.address
+        self.lock = threading.Lock()
+        self.next_nonce = None       # 다음에 쓸 nonce (None이면 체인에서 다시 조회)
+        self.confirmed_nonce = None  # 체인에서 확인된 체결 nonce 수 ('latest')
+        self.balance_wei = None
+        self.progress_at = time.time()  # confirmed_nonce가 마지막으로 증가한 시각
+    
+    def pending(self) -> int:
+        """아직 체결되지 않은 발행 nonce 수"""
+        if self.next_nonce is None or self.confirmed_nonce is None:
+            return 0
+        return max(0, self.next_nonce - self.confirmed_nonce)
 
 class TransactionManager:
-    """RSK 체인 트랜잭션 관리 클래스"""
+    """RSK 체인 트랜잭션 관리 클래스
+
+    송금 계정 풀(hot wallet)을 지원한다. 계정마다 nonce를 따로 관리하므로
+    한 계정의 트랜잭션이 막혀도 다른 계정으로 계속 지급한다.
+    """
+    
+    GAS_RESERVE_WEI = 50000 * 40_000_000  # 선택시 잔고에서 남겨 둘 가스비 (최대 가스 x 여유 가스 가격)
+    STUCK_SECONDS = 180                   # 미체결 nonce가 이 시간 동안 진척 없으면 적체로 보고 선택 제외
     
-    def __init__(self, rpc_url: str, private_key: str):
+    def __init__(self, rpc_url: str, private_key: str, extra_keys: Optional[List[str]] = None,
+                 treasury_key: Optional[str] = None, selection: str = 'least_loaded'):
+        from web3 import Web3
+        from eth_account import Account
+        
         self.rpc_url = rpc_url
         self.private_key = private_key
         self.w3 = Web3(Web3.HTTPProvider(rpc_url))
         
-        # 지갑 계정 설정
+        # 지갑 계정 설정 (첫 번째 계정이 기본 계정)
         self.account = Account.from_key(private_key)
         
+        # 송금 계정 풀 (PRIVATE_KEY + PRIVATE_KEYS, 중복 제거)
+        self.senders = []
+        seen = set()
+        for key in [private_key] + list(extra_keys or []):
+            account = Account.from_key(key)
+            if account.address not in seen:
+                seen.add(account.address)
+                self.senders.append(SenderAccount(account, key))
+        self.treasury = SenderAccount(Account.from_key(treasury_key), treasury_key) if treasury_key else None
+        self._by_address = {sender.address: sender for sender in self.senders}
+        if self.treasury:
+            self._by_address.setdefault(self.treasury.address, self.treasury)
+        self.selection = selection
+        self._round_robin = itertools.cycle(self.senders)
+        self._select_lock = threading.Lock()
+        
+    def set_rpc_url(self, rpc_url: str):
+        """RPC 엔드포인트 교체 (계정/nonce 상태는 유지)"""
+        from web3 import Web3
+        self.w3 = Web3(Web3.HTTPProvider(rpc_url))
+        self.rpc_url = rpc_url
+    
     def is_connected(self) -> bool:
         """RSK 체인 연결 상태 확인"""
         try:
@@ -646,31 +1977,32 @@ class TransactionManager:
             logging.error(f"RSK 체인 연결 실패: {e}")
             return False
     
-    def should_drop(self, drop_rate: float) -> bool:
-        """랜덤 드랍 여부 결정"""
-        return random.random() < drop_rate
+    @staticmethod
+    def to_checksum(address: str) -> str:
+        """체크섬 주소 (등록된 WalletAddress면 그대로 사용)"""
+        checksum_address = WalletAddress.parse(address)
+        if checksum_address is None:
+            raise ValueError(f"유효하지 않은 주소: {address}")
+        return checksum_address
     
-    def get_rbtc_balance(self, address: str) -> float:
-        """RBTC 잔고 조회"""
+    def get_balance_wei(self, address: str) -> int:
+        """RBTC 잔고 조회 (wei)"""
         try:
-            balance_wei = self.w3.eth.get_balance(
-                Web3.to_checksum_address(address)
+            return self.w3.eth.get_balance(
+                self.to_checksum(address)
             )
-            # RBTC는 18자리 소수점 (ETH와 동일)
-            return balance_wei / (10 ** 18)
         except Exception as e:
             logging.error(f"RBTC 잔고 조회 실패: {e}")
-            return 0.0
+            return 0
     
-    def get_optimal_gas_estimate(self, to_address: str, amount: float) -> dict:
+    def get_optimal_gas_estimate(self, to_address: str, amount_wei: int, from_address: Optional[str] = None) -> dict:
         """실제 전송 전 동적 가스 추정"""
         try:
-            to_checksum = Web3.to_checksum_address(to_address)
-            amount_wei = int(amount * (10 ** 18))  # RBTC 18자리 소수점
+            to_checksum = self.to_checksum(to_address)
             
             # 현재 네트워크 상황으로 가스 추정 (RBTC 전송)
             estimated_gas = self.w3.eth.estimate_gas({
-                'from': self.account.address,
+                'from': from_address or self.account.address,
                 'to': to_checksum,
                 'value': amount_wei
             })
@@ -704,134 +2036,1591 @@ class TransactionManager:
                 'final': 25200,  # 21000 * 1.2
                 'margin': '20.0%'
             }
-
-    def send_rbtc(self, to_address: str, amount: float, retry_count: int = 0) -> Optional[str]:
-        """RBTC 전송 (동적 가스 추정)"""
+    
+    def select_sender(self, amount_wei: int) -> SenderAccount:
+        """이번 드랍에 쓸 송금 계정 선택
+        잔고가 부족하거나 nonce가 적체된 계정은 제외하고, least_loaded는 미체결 nonce가
+        가장 적은(같으면 잔고가 많은) 계정, round_robin은 순서대로 선택
+        """
+        if len(self.senders) == 1:
+            return self.senders[0]
+        
+        now = time.time()
+        
+        def usable(sender: SenderAccount) -> bool:
+            if sender.balance_wei is not None and sender.balance_wei < amount_wei + self.GAS_RESERVE_WEI:
+                return False
+            return not (sender.pending() and now - sender.progress_at > self.STUCK_SECONDS)
+        
+        with self._select_lock:
+            if self.selection == 'round_robin':
+                for _ in range(len(self.senders)):
+                    sender = next(self._round_robin)
+                    if usable(sender):
+                        return sender
+            else:
+                candidates = [sender for sender in self.senders if usable(sender)]
+                if candidates:
+                    return min(candidates, key=lambda sender: (sender.pending(), -(sender.balance_wei or 0)))
+        
+        logging.warning("사용 가능한 송금 계정 없음 - 기본 계정 사용")
+        return self.senders[0]
+    
+    def _reserve_nonce(self, sender: SenderAccount) -> int:
+        """송금 계정의 다음 nonce 예약 (계정별 로컬 카운터, 처음/재동기화시에만 체인 조회)"""
+        with sender.lock:
+            if sender.next_nonce is None:
+                sender.next_nonce = self.w3.eth.get_transaction_count(sender.address, 'pending')
+            if not sender.pending():
+                sender.progress_at = time.time()  # 대기 중이던 계정은 이번 nonce부터 적체 시간 계산
+            nonce = sender.next_nonce
+            sender.next_nonce += 1
+            return nonce
+    
+    def resync_nonce(self, sender_address: str):
+        """브로드캐스트 실패로 nonce가 비었을 수 있으면 다음 예약 때 체인에서 다시 조회"""
+        sender = self._by_address.get(sender_address)
+        if sender:
+            with sender.lock:
+                sender.next_nonce = None
+    
+    def refresh_senders(self):
+        """송금 계정별 잔고/체결 nonce 갱신 (적체 판단용)"""
+        for sender in self.senders + ([self.treasury] if self.treasury else []):
+            try:
+                balance = self.w3.eth.get_balance(sender.address)
+                confirmed = self.w3.eth.get_transaction_count(sender.address, 'latest')
+            except Exception as e:
+                logging.warning(f"송금 계정 상태 조회 실패 ({sender.address}): {e}")
+                continue
+            with sender.lock:
+                if sender.confirmed_nonce is None or confirmed > sender.confirmed_nonce:
+                    sender.progress_at = time.time()
+                sender.confirmed_nonce = confirmed
+                sender.balance_wei = balance
+                if sender.next_nonce is not None and sender.next_nonce < confirmed:
+                    sender.next_nonce = confirmed
+            if sender.pending() and time.time() - sender.progress_at > self.STUCK_SECONDS:
+                logging.warning(f"송금 계정 nonce 적체: {sender.address} (미체결 {sender.pending()}개)")
+    
+    def top_up_senders(self, min_balance_wei: int, top_up_wei: int) -> int:
+        """잔고가 min_balance_wei 아래인 송금 계정에 treasury 계정에서 top_up_wei 충전
+        Returns: 충전 트랜잭션 수
+        """
+        if not self.treasury:
+            return 0
+        count = 0
+        for sender in self.senders:
+            if sender.address == self.treasury.address or sender.balance_wei is None or sender.balance_wei >= min_balance_wei:
+                continue
+            if self.treasury.balance_wei is not None and self.treasury.balance_wei < top_up_wei + self.GAS_RESERVE_WEI:
+                logging.error(f"treasury 잔고 부족 - 충전 중단: {format_rbtc(self.treasury.balance_wei)} RBTC")
+                break
+            try:
+                signed = self.build_signed_transfer(sender.address, top_up_wei, sender=self.treasury.address)
+                if self.broadcast_signed(signed['raw_tx'], signed['tx_hash']) != 'sent':
+                    self.resync_nonce(self.treasury.address)
+                    continue
+            except Exception as e:
+                logging.error(f"송금 계정 충전 실패 ({sender.address}): {e}")
+                continue
+            logging.info(f"송금 계정 충전: {sender.address} <- {format_rbtc(top_up_wei)} RBTC ({signed['tx_hash']})")
+            # 다음 갱신 전까지 중복 충전하지 않도록 예상 잔고 반영
+            sender.balance_wei += top_up_wei
+            self.treasury.balance_wei = (self.treasury.balance_wei or 0) - top_up_wei
+            count += 1
+        return count
+    
+    def build_signed_transfer(self, to_address: str, amount_wei: int, nonce: Optional[int] = None,
+                              retry_count: int = 0, sender: Optional[str] = None) -> Dict[str, Any]:
+        """RBTC 전송 트랜잭션 서명 (브로드캐스트하지 않음, 동적 가스 추정)
+        sender를 지정하지 않으면 송금 계정 풀에서 선택
+        nonce를 지정하면 같은 계정/nonce로 재서명 (가스 가격만 올린 교체 트랜잭션)
+        Returns: {'sender', 'nonce', 'raw_tx', 'tx_hash', 'gas', 'retry_count'}
+        """
+        to_checksum = self.to_checksum(to_address)
+        account = self._by_address[sender] if sender else self.select_sender(amount_wei)
+        
+        # 1단계: 현재 상황에 최적화된 가스 추정
+        gas_info = self.get_optimal_gas_estimate(to_address, amount_wei, account.address)
+        optimal_gas = gas_info['final']
+        
+        # 2단계: 가스 가격 동적 조정 (재시도시 증가, wei 단위 정수)
+        # RSK 메인넷 최소 가스 가격 (로벨 업그레이드 이후)
+        min_gas_price = 23_700_000  # 0.0237 Gwei (로벨 업그레이드 이후 최소값)
+        base_gas_price = min_gas_price * 11 // 10  # 최소값보다 10% 높게 설정
+        gas_price = base_gas_price + retry_count * 10_000_000  # 재시도시 0.01 Gwei씩 증가
+        
+        reserved = nonce is None
+        if reserved:
+            nonce = self._reserve_nonce(account)
+        
+        # 3단계: 트랜잭션 구성 (가스 한도 명시적 설정)
+        transaction = {
+            'from': account.address,
+            'to': to_checksum,
+            'value': amount_wei,
+            'gasPrice': gas_price,
+            'gas': optimal_gas,  # 동적으로 계산된 최적 가스
+            'nonce': nonce,
+            'chainId': 30  # RSK Mainnet (Testnet은 31)
+        }
+        
         try:
-            to_checksum = Web3.to_checksum_address(to_address)
-            amount_wei = int(amount * (10 ** 18))  # RBTC 18자리 소수점
-            
-            # 1단계: 현재 상황에 최적화된 가스 추정
-            gas_info = self.get_optimal_gas_estimate(to_address, amount)
-            optimal_gas = gas_info['final']
-            
-            # 2단계: 가스 가격 동적 조정 (재시도시 증가)
-            # RSK 메인넷 최소 가스 가격 (로벨 업그레이드 이후)
-            min_gas_price = 0.0237  # 0.0237 Gwei (로벨 업그레이드 이후 최소값)
-            base_gas_price = min_gas_price * 1.1  # 최소값보다 10% 높게 설정
-            gas_price = base_gas_price + (retry_count * 0.01)  # 재시도시 0.01 Gwei씩 증가
-            
-            # 3단계: 트랜잭션 구성 (가스 한도 명시적 설정)
-            transaction = {
-                'from': self.account.address,
-                'to': to_checksum,
-                'value': amount_wei,
-                'gasPrice': self.w3.to_wei(str(gas_price), 'gwei'),
-                'gas': optimal_gas,  # 동적으로 계산된 최적 가스
-                'nonce': self.w3.eth.get_transaction_count(self.account.address, 'pending'),
-                'chainId': 30  # RSK Mainnet (Testnet은 31)
-            }
+            signed_txn = self.w3.eth.account.sign_transaction(transaction, account.private_key)
+        except Exception:
+            # 예약한 nonce를 쓰지 못했으므로 다음 예약 때 체인 기준으로 다시 맞춤 (nonce 공백 방지)
+            if reserved:
+                self.resync_nonce(account.address)
+            raise
+        logging.info(f"가스 정보: {gas_info['margin']} 마진, 한도 {optimal_gas:,}, 송금 계정 {account.address[:10]}..., nonce {nonce}")
+        return {
+            'sender': account.address,
+            'nonce': nonce,
+            'raw_tx': signed_txn.rawTransaction.hex(),
+            'tx_hash': signed_txn.hash.hex(),
+            'gas': optimal_gas,
+            'retry_count': retry_count
+        }
+    
+    def broadcast_signed(self, raw_tx: str, tx_hash: str) -> str:
+        """서명된 트랜잭션 (재)브로드캐스트 - 같은 바이트는 몇 번 보내도 한 번만 체결됨
+        Returns: 'sent', 'underpriced', 'failed'
+        """
+        try:
+            self.w3.eth.send_raw_transaction(raw_tx)
+            logging.info(f"트랜잭션 브로드캐스트 성공: {tx_hash}")
+            return 'sent'
+        except Exception as e:
+            error_msg = str(e).lower()
             
-            # 트랜잭션 서명 및 전송
-            signed_txn = self.w3.eth.account.sign_transaction(transaction, self.private_key)
-            tx_hash = self.w3.eth.send_raw_transaction(signed_txn.rawTransaction)
+            # 이전 시도가 이미 노드에 도달한 경우 (타임아웃 후 재전송 등)
+            if 'already known' in error_msg or 'known transaction' in error_msg or 'already imported' in error_msg:
+                logging.info(f"이미 전파된 트랜잭션: {tx_hash}")
+                return 'sent'
             
-            logging.info(f"RBTC 전송 성공: {amount} RBTC를 {to_address}로")
-            logging.info(f"가스 정보: {gas_info['margin']} 마진, 한도 {optimal_gas:,}, 해시: {tx_hash.hex()}")
-            return tx_hash.hex()
+            if 'nonce too low' in error_msg and self.get_tx_state(tx_hash) in ('pending', 'mined'):
+                return 'sent'
             
-        except Exception as e:
-            error_msg = str(e)
+            if 'underpriced' in error_msg:
+                logging.warning(f"Underpriced 오류: {tx_hash}")
+                return 'underpriced'
             
-            # underpriced 오류 처리
-            if "underpriced" in error_msg.lower() and retry_count < 3:
-                logging.warning(f"Underpriced 오류, 재시도 {retry_count + 1}/3")
-                import time
-                time.sleep(2)
-                return self.send_rbtc(to_address, amount, retry_count + 1)
+            logging.error(f"트랜잭션 브로드캐스트 실패: {tx_hash} - {e}")
+            return 'failed'
+    
+    def get_tx_state(self, tx_hash: str, nonce: Optional[int] = None, sender: Optional[str] = None) -> str:
+        """트랜잭션 상태 조회
+        Returns: 'mined', 'pending', 'replaced' (nonce가 다른 트랜잭션에 사용됨), 'unknown'
+        """
+        try:
+            self.w3.eth.get_transaction_receipt(tx_hash)
+            return 'mined'
+        except Exception:
+            pass
+        
+        try:
+            self.w3.eth.get_transaction(tx_hash)
+            return 'pending'
+        except Exception:
+            pass
+        
+        if nonce is not None:
+            try:
+                if self.w3.eth.get_transaction_count(sender or self.account.address, 'latest') > nonce:
+                    return 'replaced'
+            except Exception as e:
+                logging.warning(f"nonce 조회 실패: {e}")
+        
+        return 'unknown'
+    
+    def send_rbtc(self, to_address: str, amount_wei: int, retry_count: int = 0) -> Optional[str]:
+        """RBTC 전송 (서명 후 즉시 브로드캐스트, underpriced시 같은 nonce로 재서명)"""
+        try:
+            signed = self.build_signed_transfer(to_address, amount_wei, retry_count=retry_count)
             
+            while True:
+                result = self.broadcast_signed(signed['raw_tx'], signed['tx_hash'])
+                if result == 'sent':
+                    logging.info(f"RBTC 전송 성공: {format_rbtc(amount_wei)} RBTC를 {to_address}로, 해시: {signed['tx_hash']}")
+                    return signed['tx_hash']
+                
+                if result == 'underpriced' and signed['retry_count'] < 3:
+                    logging.warning(f"Underpriced 오류, 재시도 {signed['retry_count'] + 1}/3")
+                    time.sleep(2)
+                    signed = self.build_signed_transfer(
+                        to_address, amount_wei, nonce=signed['nonce'], retry_count=signed['retry_count'] + 1,
+                        sender=signed['sender']
+                    )
+                    continue
+                
+                self.resync_nonce(signed['sender'])
+                return None
+            
+        except Exception as e:
             logging.error(f"RBTC 전송 실패 (재시도 {retry_count}회): {e}")
             return None
 
-class RBTCDropBot:
+class OutboundQueue:
+    """텔레그램 발신 메시지 큐
+
+    - 채팅방별/전체 전송 간격 조절 (텔레그램 flood 제한)
+    - 429 응답의 retry_after 만큼 해당 채팅방 전송 보류 후 재시도
+    - 우선순위 (드랍 확인 > 일반 > 안내/알림), 같은 우선순위는 FIFO
+    - dedupe_key가 같은 메시지가 대기 중이면 새 메시지는 병합(무시)
+    """
+    
+    PRIORITY_HIGH = 0    # 드랍 확인
+    PRIORITY_NORMAL = 1  # 명령어 응답
+    PRIORITY_LOW = 2     # 한도 안내, 관리자 알림, 환영 메시지
+    
+    MAX_ATTEMPTS = 5
+    
+    def __init__(self, bot, global_per_second: float = 25.0, private_interval: float = 1.0,
+                 group_interval: float = 3.0):
+        self.bot = bot
+        self.global_interval = 1.0 / global_per_second
+        self.private_interval = private_interval
+        self.group_interval = group_interval  # 그룹은 분당 20개 제한
+        
+        self.heap = []  # [(priority, seq, item)]
+        self.seq = itertools.count()
+        self.pending_keys = set()
+        self.chat_ready_at = {}  # {chat_id: 다음 전송 가능 시각}
+        self.global_ready_at = 0.0
+        self.stats = {'sent': 0, 'coalesced': 0, 'rate_limited': 0, 'failed': 0}
+        
+        self.cond = threading.Condition()
+        self.running = True
+        self.worker = threading.Thread(target=self._run, name='outbound-queue', daemon=True)
+        self.worker.start()
+    
+    def send(self, chat_id, text: str, priority: int = PRIORITY_NORMAL, dedupe_key: Optional[tuple] = None,
+             reply_to_message_id: Optional[int] = None, on_sent=None, **kwargs) -> bool:
+        """메시지 전송 예약
+        Returns: True if queued, False if coalesced with a pending message
+        """
+        with self.cond:
+            if dedupe_key is not None:
+                if dedupe_key in self.pending_keys:
+                    self.stats['coalesced'] += 1
+                    return False
+                self.pending_keys.add(dedupe_key)
+            
+            if reply_to_message_id is not None:
+                kwargs['reply_to_message_id'] = reply_to_message_id
+                kwargs.setdefault('allow_sending_without_reply', True)
+            
+            item = {
+                'chat_id': chat_id,
+                'text': text,
+                'kwargs': kwargs,
+                'dedupe_key': dedupe_key,
+                'on_sent': on_sent,
+                'attempts': 0
+            }
+            heapq.heappush(self.heap, (priority, next(self.seq), item))
+            self.cond.notify()
+        return True
+    
+    def reply_to(self, message, text: str, priority: int = PRIORITY_NORMAL, **kwargs) -> bool:
+        """bot.reply_to 대응 - 원본 메시지에 답장으로 전송 예약"""
+        return self.send(message.chat.id, text, priority=priority, reply_to_message_id=message.message_id, **kwargs)
+    
+    def depth(self) -> int:
+        """대기 중인 메시지 수"""
+        with self.cond:
+            return len(self.heap)
+    
+    def stop(self, timeout: float = 5.0):
+        """남은 메시지를 최대 timeout초 동안 전송 후 종료"""
+        deadline = time.time() + timeout
+        while self.depth() and time.time() < deadline:
+            time.sleep(0.1)
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.worker.join(timeout=1.0)
+    
+    def _chat_interval(self, chat_id) -> float:
+        """채팅방 종류별 최소 전송 간격 (그룹 ID는 음수)"""
+        try:
+            return self.group_interval if int(chat_id) < 0 else self.private_interval
+        except (TypeError, ValueError):
+            return self.private_interval
+    
+    def _next_ready(self, now: float) -> tuple:
+        """전송 가능한 가장 높은 우선순위 항목 선택 (lock 안에서 호출)
+        Returns: (entry or None, 가장 빠른 대기 해제 시각)
+        """
+        deferred = []
+        chosen = None
+        wake_at = now + 1.0
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            ready_at = self.chat_ready_at.get(entry[2]['chat_id'], 0.0)
+            if ready_at <= now:
+                chosen = entry
+                break
+            wake_at = min(wake_at, ready_at)
+            deferred.append(entry)
+        for entry in deferred:
+            heapq.heappush(self.heap, entry)
+        return chosen, wake_at
+    
+    def _run(self):
+        """전송 워커 루프"""
+        while True:
+            with self.cond:
+                while self.running:
+                    now = time.time()
+                    if now < self.global_ready_at:
+                        self.cond.wait(self.global_ready_at - now)
+                        continue
+                    entry, wake_at = self._next_ready(now)
+                    if entry:
+                        break
+                    self.cond.wait(max(0.01, wake_at - now) if self.heap else None)
+                if not self.running:
+                    return
+                
+                priority, seq, item = entry
+                now = time.time()
+                self.global_ready_at = now + self.global_interval
+                self.chat_ready_at[item['chat_id']] = now + self._chat_interval(item['chat_id'])
+                if len(self.chat_ready_at) > 1000:
+                    self.chat_ready_at = {k: v for k, v in self.chat_ready_at.items() if v > now}
+            
+            self._deliver(priority, seq, item)
+    
+    def _deliver(self, priority: int, seq: int, item: Dict):
+        """실제 전송 - 429면 retry_after 후 재시도하도록 다시 넣음"""
+        item['attempts'] += 1
+        try:
+            sent_msg = self.bot.send_message(item['chat_id'], item['text'], **item['kwargs'])
+        except telebot.apihelper.ApiTelegramException as e:
+            if e.error_code == 429 and item['attempts'] < self.MAX_ATTEMPTS:
+                retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after', 5)
+                logging.warning(f"텔레그램 전송 제한 (429): {item['chat_id']} - {retry_after}초 후 재시도")
+                with self.cond:
+                    self.stats['rate_limited'] += 1
+                    self.chat_ready_at[item['chat_id']] = time.time() + retry_after
+                    heapq.heappush(self.heap, (priority, seq, item))
+                    self.cond.notify()
+                return
+            logging.error(f"메시지 전송 실패: {item['chat_id']} - {e}")
+            self._finish(item, None)
+            return
+        except Exception as e:
+            logging.error(f"메시지 전송 실패: {item['chat_id']} - {e}")
+            self._finish(item, None)
+            return
+        
+        self._finish(item, sent_msg)
+    
+    def _finish(self, item: Dict, sent_msg):
+        """전송 완료 처리 (병합 키 해제, 콜백 호출)"""
+        with self.cond:
+            self.stats['sent' if sent_msg else 'failed'] += 1
+            if item['dedupe_key'] is not None:
+                self.pending_keys.discard(item['dedupe_key'])
+        if sent_msg and item['on_sent']:
+            try:
+                item['on_sent'](sent_msg)
+            except Exception as e:
+                logging.error(f"전송 후 콜백 실패: {e}")
+
+class UpdateGate:
+    """핸들러 매칭 전에 수신 메시지 배치를 거르는 관문 (bot.process_new_messages를 감쌈)
+
+    RPC/Gist 지연이나 재시작으로 업데이트가 밀렸을 때 몇 분 지난 잡담까지
+    드랍 파이프라인을 돌려 백로그를 더 늘리지 않도록 한다.
+    - 명령어는 배치 맨 앞으로 옮기고 버리지 않음
+    - max_age_seconds보다 오래된 일반 텍스트 메시지는 건너뜀 (stale)
+    - 처리 대기열이 max_queue_depth 이상이면 일반 텍스트 메시지는 건너뜀 (overload)
+    입장/퇴장 같은 텍스트가 아닌 메시지는 그대로 통과시킨다.
+    
+    allowed_chats가 주어지면 그 밖의 그룹 메시지는 가장 먼저 집합 조회로 버린다
+    (봇 초대 메시지만 통과시켜 handle_new_member에서 그룹을 나감).
+    """
+    
+    def __init__(self, max_age_seconds: float = 60.0, max_queue_depth: int = 200, queue_depth=None,
+                 allowed_chats: Optional[set] = None):
+        self.max_age_seconds = max_age_seconds
+        self.max_queue_depth = max_queue_depth
+        self.queue_depth = queue_depth or (lambda: 0)
+        self.allowed_chats = allowed_chats
+        self.stats = {'messages': 0, 'commands': 0, 'stale': 0, 'overload': 0, 'blocked': 0}
+        self.last_lag = None  # 마지막 배치의 가장 최근 메시지가 도착하기까지 걸린 시간(초)
+        self.lock = threading.Lock()
+    
+    def install(self, bot):
+        """bot.process_new_messages 앞에 필터 연결"""
+        process_new_messages = bot.process_new_messages
+        
+        def gated(new_messages):
+            new_messages = self.filter(new_messages)
+            if new_messages:
+                process_new_messages(new_messages)
+        
+        bot.process_new_messages = gated
+    
+    @staticmethod
+    def is_command(message) -> bool:
+        return message.content_type == 'text' and bool(message.text) and message.text.startswith('/')
+    
+    def filter(self, messages: list) -> list:
+        """명령어 우선 정렬 + 오래된/과부하 일반 메시지 제외"""
+        now = time.time()
+        depth = self.queue_depth()
+        commands, others = [], []
+        stale = overload = blocked = 0
+        for message in messages:
+            if (self.allowed_chats is not None and message.chat.type != 'private'
+                    and message.chat.id not in self.allowed_chats and message.content_type != 'new_chat_members'):
+                blocked += 1
+            elif self.is_command(message):
+                commands.append(message)
+            elif message.content_type != 'text':
+                others.append(message)
+            elif now - message.date > self.max_age_seconds:
+                stale += 1
+            elif depth + len(others) >= self.max_queue_depth:
+                overload += 1
+            else:
+                others.append(message)
+        
+        if messages:
+            self.last_lag = max(0.0, now - max(message.date for message in messages))
+        with self.lock:
+            self.stats['messages'] += len(messages)
+            self.stats['commands'] += len(commands)
+            self.stats['stale'] += stale
+            self.stats['overload'] += overload
+            self.stats['blocked'] += blocked
+        if stale or overload:
+            logging.info(f"백로그 메시지 건너뜀: 오래됨 {stale}건, 과부하 {overload}건 (대기열 {depth})")
+        return commands + others
+    
+    def shed_rate(self) -> float:
+        """지금까지 받은 메시지 중 건너뛴 비율"""
+        with self.lock:
+            shed = self.stats['stale'] + self.stats['overload']
+            return shed / self.stats['messages'] if self.stats['messages'] else 0.0
+
+class HealthMonitor:
+    """프로세스 내 헬스 체크 엔드포인트 (GET /health, JSON)
+
+    요청마다 외부 호출을 하지 않고 캐시된 값만 돌려준다.
+    - 폴링 루프 heartbeat: getUpdates가 끝날 때마다 갱신, stall_seconds 넘게 없으면 503
+    - RPC/Gist 연결은 주기 작업의 probe 결과
+    - 그 밖의 값은 add_source로 등록한 함수에서 읽음
+    폴링 시작 전(리더 대기 중)에는 starting으로 200을 돌려준다.
+    """
+    
+    def __init__(self, port: int, stall_seconds: float = 120.0):
+        self.port = port
+        self.stall_seconds = stall_seconds
+        self.started_at = time.time()
+        self.heartbeat_at = None
+        self.probes = {}   # {name: {'ok', 'checked_at', 'latency_ms'}}
+        self.sources = {}  # {name: callable}
+        self.server = None
+    
+    def install(self, bot):
+        """bot.get_updates를 감싸 폴링 heartbeat 기록"""
+        get_updates = bot.get_updates
+        
+        def beating(*args, **kwargs):
+            updates = get_updates(*args, **kwargs)
+            self.heartbeat_at = time.time()
+            return updates
+        
+        bot.get_updates = beating
+    
+    def add_source(self, name: str, source):
+        self.sources[name] = source
+    
+    def probe(self, name: str, check):
+        """연결 확인 실행 후 결과 캐시 (예외는 실패로 기록)"""
+        started = time.perf_counter()
+        try:
+            ok = bool(check())
+        except Exception as e:
+            logging.warning(f"헬스 probe 실패 ({name}): {e}")
+            ok = False
+        self.probes[name] = {
+            'ok': ok,
+            'checked_at': int(time.time()),
+            'latency_ms': round((time.perf_counter() - started) * 1000, 1)
+        }
+    
+    def snapshot(self) -> tuple[bool, Dict[str, Any]]:
+        """(정상 여부, 응답 본문)"""
+        now = time.time()
+        heartbeat_age = now - self.heartbeat_at if self.heartbeat_at else None
+        if heartbeat_age is None:
+            status = 'starting'
+        elif heartbeat_age > self.stall_seconds:
+            status = 'stalled'
+        else:
+            status = 'ok'
+        body = {
+            'status': status,
+            'uptime_seconds': int(now - self.started_at),
+            'heartbeat_age_seconds': round(heartbeat_age, 1) if heartbeat_age is not None else None,
+            'probes': dict(self.probes)
+        }
+        for name, source in self.sources.items():
+            try:
+                body[name] = source()
+            except Exception as e:
+                body[name] = f'error: {e}'
+        return status != 'stalled', body
+    
+    def start(self):
+        """백그라운드 스레드에서 HTTP 서버 시작"""
+        monitor = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+            
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/health', '/healthz'):
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                healthy, body = monitor.snapshot()
+                payload = json.dumps(body, ensure_ascii=False, default=str).encode()
+                self.send_response(200 if healthy else 503)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+        
+        self.server = ThreadingHTTPServer(('0.0.0.0', self.port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='health', daemon=True).start()
+        logging.info(f"헬스 체크 엔드포인트: http://0.0.0.0:{self.server.server_address[1]}/health")
+    
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+class Diagnostics:
+    """운영 중 CPU/메모리 진단 (한 번에 하나, 정해진 시간 동안만)
+
+    - profile: sys._current_frames 스택 샘플링 - 알려진 대기 호출(락/큐/select/소켓/SSL 읽기)
+      안에 있는 샘플은 제외하고 자기 시간(leaf)과 누적 시간 상위 함수 집계.
+      time.sleep처럼 C 안에서 기다리는 구간은 구분할 수 없어 벽시계 기준 비율이다.
+    - memtrace: tracemalloc 시작/종료 스냅샷 비교로 구간 중 늘어난 할당 위치 집계
+    리포트는 report_dir에 파일로 남기고 deliver 콜백으로도 전달한다.
+    """
+    
+    # 스레드가 기다리는 중인 표준 라이브러리 호출 (파일명, 함수명)
+    BLOCKING_CALLS = frozenset({
+        ('threading.py', 'wait'), ('threading.py', 'join'), ('threading.py', '_wait_for_tstate_lock'),
+        ('queue.py', 'get'), ('queue.py', 'put'), ('queues.py', 'get'), ('connection.py', '_recv_bytes'),
+        ('selectors.py', 'select'), ('socketserver.py', 'serve_forever'),
+        ('socket.py', 'readinto'), ('socket.py', 'accept'), ('socket.py', 'create_connection'),
+        ('ssl.py', 'read'), ('ssl.py', 'recv_into'), ('ssl.py', 'do_handshake'),
+    })
+    
+    def __init__(self, report_dir: str = 'logs', interval: float = 0.005, top: int = 15, max_seconds: float = 300.0):
+        self.report_dir = report_dir
+        self.interval = interval
+        self.top = top
+        self.max_seconds = max_seconds
+        self.running = None  # 진행 중인 진단 종류
+        self.lock = threading.Lock()
+    
+    def start(self, kind: str, seconds: float, deliver=None) -> bool:
+        """백그라운드에서 진단 실행 (이미 진행 중이면 False)"""
+        seconds = max(1.0, min(float(seconds), self.max_seconds))
+        with self.lock:
+            if self.running:
+                return False
+            self.running = kind
+        runner = self.profile if kind == 'profile' else self.memtrace
+        threading.Thread(target=self._run, args=(kind, runner, seconds, deliver), name=f'diag-{kind}', daemon=True).start()
+        return True
+    
+    def _run(self, kind: str, runner, seconds: float, deliver):
+        try:
+            report = runner(seconds)
+            path = self.save(kind, report)
+            logging.info(f"진단 리포트 저장: {path}")
+            if deliver:
+                deliver(report, path)
+        except Exception as e:
+            logging.error(f"진단 실패 ({kind}): {e}", exc_info=True)
+        finally:
+            with self.lock:
+                self.running = None
+    
+    def save(self, kind: str, report: str) -> str:
+        os.makedirs(self.report_dir, exist_ok=True)
+        path = os.path.join(self.report_dir, f"{kind}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.txt")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(report)
+        return path
+    
+    @classmethod
+    def _is_blocked(cls, frame) -> bool:
+        """leaf부터 거슬러 올라가며 대기 호출 안인지 확인 (이 모듈 코드에 닿으면 중단 - 그 위는 호출자)"""
+        while frame is not None:
+            code = frame.f_code
+            if (os.path.basename(code.co_filename), code.co_name) in cls.BLOCKING_CALLS:
+                return True
+            if code.co_filename == __file__:
+                return False
+            frame = frame.f_back
+        return False
+    
+    @staticmethod
+    def _label(code) -> str:
+        return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno} {code.co_name}"
+    
+    def profile(self, seconds: float) -> str:
+        """스택 샘플링 CPU 프로파일 리포트"""
+        own = threading.get_ident()
+        leaf, inclusive = Counter(), Counter()
+        samples = idle = 0
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if self._is_blocked(frame):
+                    idle += 1
+                    continue
+                samples += 1
+                leaf[self._label(frame.f_code)] += 1
+                seen = set()
+                while frame is not None:
+                    label = self._label(frame.f_code)
+                    if label not in seen:
+                        seen.add(label)
+                        inclusive[label] += 1
+                    frame = frame.f_back
+            time.sleep(self.interval)
+        
+        lines = [f"🔬 CPU 프로파일 ({seconds:.0f}초, 샘플 {samples}개, 대기 제외 {idle}개)",
+                 "벽시계 기준 - sleep 등 C 안의 대기는 해당 함수 시간에 포함", "", "[자기 시간 상위]"]
+        lines += [f"{count / samples * 100:5.1f}% {label}" for label, count in leaf.most_common(self.top)] if samples else ["(샘플 없음)"]
+        lines += ["", "[누적 시간 상위]"]
+        lines += [f"{count / samples * 100:5.1f}% {label}" for label, count in inclusive.most_common(self.top)] if samples else ["(샘플 없음)"]
+        return '\n'.join(lines)
+    
+    def memtrace(self, seconds: float) -> str:
+        """구간 동안 늘어난 메모리 할당 위치 리포트"""
+        started_here = not tracemalloc.is_tracing()
+        if started_here:
+            tracemalloc.start()
+        try:
+            before = tracemalloc.take_snapshot()
+            time.sleep(seconds)
+            after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            if started_here:
+                tracemalloc.stop()
+        
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        stats = after.filter_traces(filters).compare_to(before.filter_traces(filters), 'lineno')
+        lines = [f"🧠 메모리 추적 ({seconds:.0f}초, 현재 {current / 1024:.0f} KiB, 최대 {peak / 1024:.0f} KiB)", "", "[증가 상위 할당 위치]"]
+        for stat in stats[:self.top]:
+            frame = stat.traceback[0]
+            lines.append(f"{stat.size_diff / 1024:+8.1f} KiB ({stat.count_diff:+d}) {os.path.basename(frame.filename)}:{frame.lineno}")
+        return '\n'.join(lines)
+
+class TemplateRegistry:
+    """응답 템플릿 레지스트리
+
+    설정값은 등록 시점에 미리 채워 두고, 남은 자리표시자만 render에서 채운다.
+    key를 넘기면 같은 key로 마지막에 만든 결과를 그대로 재사용한다
+    (key가 바뀔 때만 다시 렌더링). 값 계산도 캐시 미스에서만 하도록 build로 넘길 수 있다.
+    """
+    
+    def __init__(self):
+        self.templates = {}  # {name: str.format 템플릿}
+        self.cache = {}      # {name: (key, rendered)}
+        self.lock = threading.Lock()
+    
+    def register(self, name: str, text: str):
+        """템플릿 등록/교체 (해당 템플릿 캐시 무효화)"""
+        with self.lock:
+            self.templates[name] = text
+            self.cache.pop(name, None)
+    
+    def render(self, name: str, key: Optional[tuple] = None, build=None, **values) -> str:
+        """템플릿 렌더링 - key가 이전과 같으면 캐시 반환
+        build: 캐시 미스일 때만 호출해 자리표시자 값 dict를 만드는 함수 (포맷 비용 절약)
+        """
+        if key is not None:
+            cached = self.cache.get(name)
+            if cached and cached[0] == key:
+                return cached[1]
+        if build:
+            values.update(build())
+        text = self.templates[name].format(**values) if values else self.templates[name]
+        if key is not None:
+            with self.lock:
+                self.cache[name] = (key, text)
+        return text
+
+class BotConfig(NamedTuple):
+    """핫 리로드 가능한 봇 설정 (불변)
+
+    드랍 경로는 bot.config만 읽고, 리로드는 검증을 통과한 새 객체로 속성 하나를
+    바꿔 끼우므로 처리 중인 메시지는 항상 한 가지 설정만 본다.
+    env에는 키마다 기본값까지 풀어 쓴 문자열을 보관해 변경 비교/샤드 전달에 쓴다.
+    """
+    
+    drop_rate: float
+    max_daily_wei: int
+    max_daily_per_chat_wei: int
+    cooldown_seconds: float
+    rate_limits: tuple  # ((level, interval, burst), ...)
+    rpc_url: str
+    block_shared_wallets: bool
+    env: tuple          # ((key, value), ...)
+    
+    DEFAULTS = (
+        ('DROP_RATE', '0.05'),
+        ('MAX_DAILY_AMOUNT', '0.00003125'),
+        ('MAX_DAILY_AMOUNT_PER_CHAT', None),
+        ('COOLDOWN_SECONDS', '30'),
+        ('GLOBAL_COOLDOWN_SECONDS', '5'),
+        ('GLOBAL_DROP_BURST', '3'),
+        ('CHAT_COOLDOWN_SECONDS', None),
+        ('CHAT_DROP_BURST', '1'),
+        ('USER_COOLDOWN_SECONDS', None),
+        ('USER_DROP_BURST', '1'),
+        ('RPC_URL', 'https://public-node.testnet.rsk.co'),
+        ('BLOCK_SHARED_WALLETS', 'false'),
+        ('DROP_AMOUNT_TIERS', ''),
+        ('CHAT_DROP_RATES', ''),
+        ('ACTIVITY_HALF_LIFE_SECONDS', '600'),
+        ('ACTIVITY_FREE_MESSAGES', '10'),
+    )
+    FALLBACKS = {  # 값이 없으면 따라가는 키
+        'MAX_DAILY_AMOUNT_PER_CHAT': 'MAX_DAILY_AMOUNT',
+        'CHAT_COOLDOWN_SECONDS': 'COOLDOWN_SECONDS',
+        'USER_COOLDOWN_SECONDS': 'COOLDOWN_SECONDS',
+    }
+    KEYS = tuple(key for key, _ in DEFAULTS)
+    
+    @classmethod
+    def from_env(cls, env: Mapping[str, Optional[str]]) -> 'BotConfig':
+        """환경변수 매핑으로 설정 생성 + 검증 (잘못된 값이면 ValueError)"""
+        values = {}
+        for key, default in cls.DEFAULTS:
+            value = env.get(key)
+            values[key] = str(value).strip() if value not in (None, '') else default
+        for key, source in cls.FALLBACKS.items():
+            if values[key] is None:
+                values[key] = values[source]
+        
+        def number(key: str, cast=float):
+            try:
+                return cast(values[key])
+            except (ValueError, ArithmeticError):
+                raise ValueError(f"{key} 값이 올바르지 않습니다: {values[key]}")
+        
+        drop_rate = number('DROP_RATE')
+        if not 0 <= drop_rate <= 1:
+            raise ValueError(f"DROP_RATE는 0~1 사이여야 합니다: {drop_rate}")
+        max_daily_wei = number('MAX_DAILY_AMOUNT', rbtc_to_wei)
+        max_daily_per_chat_wei = number('MAX_DAILY_AMOUNT_PER_CHAT', rbtc_to_wei)
+        if max_daily_wei <= 0 or max_daily_per_chat_wei <= 0:
+            raise ValueError("MAX_DAILY_AMOUNT / MAX_DAILY_AMOUNT_PER_CHAT는 0보다 커야 합니다")
+        
+        rate_limits = []
+        for level in TokenBucketLimiter.LEVELS:
+            interval = number(f'{level.upper()}_COOLDOWN_SECONDS')
+            burst = number(f'{level.upper()}_DROP_BURST')
+            if interval < 0 or burst < 1:
+                raise ValueError(f"{level.upper()} 쿨타임은 0 이상, 버스트는 1 이상이어야 합니다")
+            rate_limits.append((level, interval, burst))
+        cooldown_seconds = number('COOLDOWN_SECONDS')
+        if cooldown_seconds < 0:
+            raise ValueError(f"COOLDOWN_SECONDS는 0 이상이어야 합니다: {cooldown_seconds}")
+        
+        if not values['RPC_URL'].startswith(('http://', 'https://')):
+            raise ValueError("RPC_URL은 http(s) 주소여야 합니다")
+        if values['BLOCK_SHARED_WALLETS'].lower() not in ('true', 'false'):
+            raise ValueError(f"BLOCK_SHARED_WALLETS는 true/false여야 합니다: {values['BLOCK_SHARED_WALLETS']}")
+        number('ACTIVITY_HALF_LIFE_SECONDS')
+        number('ACTIVITY_FREE_MESSAGES')
+        
+        return cls(
+            drop_rate=drop_rate,
+            max_daily_wei=max_daily_wei,
+            max_daily_per_chat_wei=max_daily_per_chat_wei,
+            cooldown_seconds=cooldown_seconds,
+            rate_limits=tuple(rate_limits),
+            rpc_url=values['RPC_URL'],
+            block_shared_wallets=values['BLOCK_SHARED_WALLETS'].lower() == 'true',
+            env=tuple(values.items())
+        )
+    
+    def limits_dict(self) -> Dict[str, tuple]:
+        """TokenBucketLimiter 설정 형식"""
+        return {level: (interval, burst) for level, interval, burst in self.rate_limits}
+    
+    @staticmethod
+    def display(key: str, value: Optional[str]) -> Optional[str]:
+        """로그/감사 기록용 값 (RPC_URL은 API 키가 섞일 수 있어 호스트만)"""
+        if key == 'RPC_URL' and value:
+            parts = urlsplit(value)
+            return f"{parts.scheme}://{parts.netloc}/..." if parts.path.strip('/') or parts.query else value
+        return value
+
+class DropPrefilter:
+    """드랍 사전 체크 (스팸, 사용자, 채팅 타입, 메시지 길이, 공유 주소)
+
+    단일 프로세스 봇과 샤드 워커가 같은 체크를 쓰도록 분리했다.
+    사용하는 클래스는 spam_filter, drop_policy, users, block_shared_wallets와
+    _is_shared_address를 제공해야 한다.
+    """
+    
+    def _prefilter_message(self, message, user_id: str, user_name: str) -> Optional[str]:
+        """드랍 체크 0~4단계 (상태 변경 없는 로컬 체크)
+        Returns: wallet address if message passes, None otherwise
+        """
+        # 0. 스팸/도배 체크 (다른 체크보다 먼저)
+        if not self._check_spam(message, user_id, user_name):
+            return None
+        
+        # 활동량 기록 (드랍 확률 감소용)
+        self.drop_policy.observe(user_id)
+        
+        # 1. 사용자 체크 (블랙리스트 + 지갑 등록)
+        user = self._check_user(user_id, user_name)
+        if not user:
+            return None
+        
+        # 2. 채팅 타입 체크
+        if not self._check_chat_type(message):
+            return None
+        
+        # 3. 메시지 길이 체크
+        if not self._check_message_length(message):
+            return None
+        
+        # 4. 공유 주소 체크
+        if not self._check_shared_wallet(user.wallet, user_name):
+            return None
+        return user.wallet
+    
+    def _check_user(self, user_id: str, user_name: str) -> Optional[UserRecord]:
+        """사용자 체크 - 블랙리스트 및 지갑 등록 (레지스트리 1회 조회)
+        Returns: user record if eligible, None otherwise
+        """
+        user = self.users.get(user_id)
+        if user is None or not user.wallet:
+            logging.info(f"지갑 미등록 사용자: {user_name}")
+            return None
+        if user.blacklisted:
+            logging.info(f"블랙리스트 사용자: {user_name} ({user_id})")
+            return None
+        return user
+    
+    def _check_chat_type(self, message) -> bool:
+        """채팅 타입 체크
+        Returns: True if group chat, False if private
+        """
+        if message.chat.type == 'private':
+            logging.info(f"개인 채팅에서는 드랍이 비활성화됨")
+            return False
+        return True
+    
+    def _check_spam(self, message, user_id: str, user_name: str) -> bool:
+        """스팸 체크 - 짧은 시간 도배, 최근 메시지와 유사한 반복
+        Returns: True if message passes, False otherwise
+        """
+        reason = self.spam_filter.check(user_id, message.text or '')
+        if reason:
+            logging.info(f"스팸 필터 차단 ({reason}): {user_name} ({user_id})")
+            return False
+        return True
+    
+    def _check_message_length(self, message) -> bool:
+        """메시지 길이 체크
+        Returns: True if message is long enough, False otherwise
+        """
+        if not message.text or len(message.text) < 5:
+            logging.info(f"메시지 길이 부족: {len(message.text) if message.text else 0}글자")
+            return False
+        return True
+    
+    def _check_shared_wallet(self, wallet_address: str, user_name: str) -> bool:
+        """공유 주소 체크 (BLOCK_SHARED_WALLETS 활성화시)
+        Returns: True if wallet is not shared (or check disabled), False otherwise
+        """
+        if self.block_shared_wallets and self._is_shared_address(wallet_address):
+            logging.info(f"공유 주소 드랍 거부: {user_name} - {wallet_address[:10]}...")
+            return False
+        return True
+    
+
+class ShardWorker(DropPrefilter):
+    """샤드 워커 프로세스 - 담당 채팅방 메시지의 사전 체크와 드랍 추첨
+
+    당첨 후보만 프론트 프로세스로 돌려보내고, 쿨타임/일일 예산/원장/논스처럼
+    전역으로 맞아야 하는 상태는 프론트 프로세스 한 곳에서만 다룬다.
+    스팸 필터 기록과 활동량 가중치는 워커별이라, 여러 샤드의 채팅방에서 활동하는
+    사용자는 샤드마다 따로 집계된다.
+    """
+    
+    def __init__(self, index: int, snapshot: Dict[str, Any]):
+        self.index = index
+        os.environ.update(snapshot.get('env', {}))  # 프론트 프로세스의 현재 설정 (리로드 반영분 포함)
+        self.spam_filter = SpamFilter.from_env()
+        self.drop_policy = DropPolicy.from_env(float(os.getenv('DROP_RATE', '0.05')), RBTCDropBot.DROP_AMOUNT_WEI)
+        self.block_shared_wallets = os.getenv('BLOCK_SHARED_WALLETS', 'false').lower() == 'true'
+        self.users = UserRegistry()
+        for user_id, wallet, blacklisted in snapshot['users']:
+            self.users.set_wallet(user_id, wallet)
+            self.users.set_blacklisted(user_id, blacklisted)
+        self.shared_addresses = set(snapshot['shared'])
+    
+    def _is_shared_address(self, address: str) -> bool:
+        return address.lower() in self.shared_addresses
+    
+    def serve(self, inbox, outbox):
+        """inbox가 None을 줄 때까지 메시지/상태 변경 처리"""
+        logging.info(f"샤드 워커 #{self.index} 시작 (사용자 {len(self.users)}명)")
+        while True:
+            item = inbox.get()
+            if item is None:
+                break
+            kind = item[0]
+            try:
+                if kind == 'message':
+                    self.evaluate(item[1], outbox)
+                elif kind == 'user':
+                    _, user_id, wallet, blacklisted = item
+                    self.users.set_wallet(user_id, wallet)
+                    self.users.set_blacklisted(user_id, blacklisted)
+                elif kind == 'env':
+                    # 설정 리로드 - 활동량 기록은 이어받음
+                    os.environ.update(item[1])
+                    policy = DropPolicy.from_env(float(os.getenv('DROP_RATE', '0.05')), RBTCDropBot.DROP_AMOUNT_WEI)
+                    policy.activity = self.drop_policy.activity
+                    self.drop_policy = policy
+                    self.block_shared_wallets = os.getenv('BLOCK_SHARED_WALLETS', 'false').lower() == 'true'
+                elif kind == 'shared':
+                    _, address, shared = item
+                    if shared:
+                        self.shared_addresses.add(address)
+                    else:
+                        self.shared_addresses.discard(address)
+            except Exception as e:
+                logging.error(f"샤드 워커 #{self.index} 처리 오류: {e}", exc_info=True)
+        logging.info(f"샤드 워커 #{self.index} 종료 (스팸 통계: {self.spam_filter.stats})")
+    
+    def evaluate(self, payload: Dict[str, Any], outbox):
+        """사전 체크 + 드랍 추첨, 당첨이면 후보를 프론트로 전달"""
+        user_id, user_name = payload['user_id'], payload['user_name']
+        message = ShardDispatcher.to_message(payload)
+        wallet_address = self._prefilter_message(message, user_id, user_name)
+        if not wallet_address:
+            return
+        
+        drop_amount = self.drop_policy.decide(message.chat.id, user_id)
+        if drop_amount is None:
+            rate = self.drop_policy.rate_for(message.chat.id, user_id)
+            logging.info(f"🎲 드랍 확률 실패: {user_name} ({user_id}) - {rate*100:.2f}% 확률 미달")
+            return
+        outbox.put(('candidate', payload, wallet_address, drop_amount))
+
+def run_shard_worker(index: int, inbox, outbox, log_queue, snapshot: Dict[str, Any]):
+    """샤드 워커 프로세스 진입점 (Ctrl+C는 프론트 프로세스가 처리)"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # spawn으로 모듈을 다시 import하면서 붙은 tx_bot.log 핸들러 대신 프론트 프로세스 큐로 기록
+    # (여러 프로세스가 같은 파일을 회전시키면 로그가 덮어써지거나 유실됨)
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(QueueHandler(log_queue))
+    ShardWorker(index, snapshot).serve(inbox, outbox)
+
+class ShardDispatcher:
+    """chat_id 기준으로 그룹 메시지를 N개 워커 프로세스에 분배 (SHARD_WORKERS > 1)
+
+    같은 채팅방은 항상 같은 워커로 가므로 채팅방 단위 순서가 유지된다.
+    워커가 돌려준 당첨 후보는 프론트 프로세스의 스레드 풀에서 실행해
+    일일 예산, 쿨타임, 원장, 발신 계정 논스를 한 프로세스에서 조정한다.
+    """
+    
+    def __init__(self, workers: int, queue_size: int = 1000):
+        self.ctx = multiprocessing.get_context('spawn')
+        self.workers = workers
+        self.inboxes = [self.ctx.Queue(queue_size) for _ in range(workers)]
+        self.outbox = self.ctx.Queue()
+        self.log_queue = self.ctx.Queue()  # 워커 로그 -> 프론트 프로세스 핸들러 (tx_bot.log는 한 프로세스만 씀)
+        self.log_listener = QueueListener(self.log_queue, *logging.getLogger().handlers, respect_handler_level=True)
+        self.processes = []
+        self.reader = None
+        self.executor = None
+        self.stats = {'dispatched': 0, 'overflow': 0, 'candidates': 0}
+    
+    def shard_for(self, chat_id: int) -> int:
+        return chat_id % self.workers
+    
+    @staticmethod
+    def to_payload(message, user_id: str, user_name: str) -> Dict[str, Any]:
+        """워커로 보낼 최소 메시지 정보 (telebot 객체 대신 dict로 직렬화)"""
+        return {
+            'chat_id': message.chat.id,
+            'chat_type': message.chat.type,
+            'message_id': message.message_id,
+            'text': message.text,
+            'user_id': user_id,
+            'user_name': user_name
+        }
+    
+    @staticmethod
+    def to_message(payload: Dict[str, Any]):
+        """체크/답장에 필요한 속성만 가진 메시지 객체 복원"""
+        return SimpleNamespace(
+            chat=SimpleNamespace(id=payload['chat_id'], type=payload['chat_type']),
+            message_id=payload['message_id'],
+            text=payload['text']
+        )
+    
+    def start(self, snapshot: Dict[str, Any], handle_candidate):
+        """워커 프로세스와 후보 수신 스레드 시작"""
+        self.log_listener.start()
+        for index, inbox in enumerate(self.inboxes):
+            process = self.ctx.Process(target=run_shard_worker, args=(index, inbox, self.outbox, self.log_queue, snapshot),
+                                       name=f'shard-{index}', daemon=True)
+            process.start()
+            self.processes.append(process)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='shard-drop')
+        self.reader = threading.Thread(target=self._read_candidates, args=(handle_candidate,),
+                                       name='shard-reader', daemon=True)
+        self.reader.start()
+        logging.info(f"샤드 워커 {self.workers}개 시작")
+    
+    def _read_candidates(self, handle_candidate):
+        while True:
+            item = self.outbox.get()
+            if item is None:
+                break
+            _, payload, wallet_address, drop_amount = item
+            self.stats['candidates'] += 1
+            self.executor.submit(handle_candidate, payload, wallet_address, drop_amount)
+    
+    def dispatch(self, message, user_id: str, user_name: str) -> bool:
+        """메시지를 담당 워커 큐에 넣음 (큐가 가득 차면 버리고 False)"""
+        shard = self.shard_for(message.chat.id)
+        try:
+            self.inboxes[shard].put_nowait(('message', self.to_payload(message, user_id, user_name)))
+        except queue.Full:
+            self.stats['overflow'] += 1
+            logging.warning(f"샤드 #{shard} 큐 가득 참 - 메시지 건너뜀: {user_name} ({user_id})")
+            return False
+        self.stats['dispatched'] += 1
+        return True
+    
+    def depth(self) -> int:
+        """워커 큐에 쌓인 메시지 수 (지원하지 않는 플랫폼은 0)"""
+        try:
+            return sum(inbox.qsize() for inbox in self.inboxes)
+        except NotImplementedError:
+            return 0
+    
+    def broadcast(self, item: tuple):
+        """모든 워커에 상태 변경 전달 (지갑/블랙리스트/공유 주소)"""
+        for inbox in self.inboxes:
+            inbox.put(item)
+    
+    def stop(self, timeout: float = 5.0):
+        """워커 종료 후 남은 당첨 후보까지 처리"""
+        for inbox in self.inboxes:
+            inbox.put(None)
+        deadline = time.time() + timeout
+        for process in self.processes:
+            process.join(max(0.0, deadline - time.time()))
+            if process.is_alive():
+                logging.warning(f"샤드 워커 강제 종료: {process.name}")
+                process.terminate()
+        self.log_listener.stop()
+        self.outbox.put(None)
+        if self.reader:
+            self.reader.join(timeout)
+        if self.executor:
+            self.executor.shutdown(wait=True)
+        logging.info(f"샤드 워커 종료 - 분배 {self.stats['dispatched']}건, 당첨 후보 {self.stats['candidates']}건, "
+                     f"큐 초과 {self.stats['overflow']}건")
+
+class RBTCDropBot(DropPrefilter):
     """USDC 드랍 텔레그램 봇"""
     
+    DROP_AMOUNT_WEI = 2_500_000_000_000  # 고정 드랍 금액: 0.0000025 RBTC
+    MIN_DROP_WEI = 10_000_000_000        # 최소 드랍 금액: 0.00000001 RBTC
+    MYDROPS_PAGE_SIZE = 5                # /mydrops 한 페이지 건수
+    ALLOWED_UPDATES = ['message']        # 핸들러가 쓰는 업데이트 종류만 수신 (편집/반응/멤버 상태 등 제외)
+    
     def __init__(self):
         # 환경변수 로드
         self.bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
-        self.base_rpc = os.getenv('RPC_URL', 'https://public-node.testnet.rsk.co')
         self.private_key = os.getenv('PRIVATE_KEY')
-        self.drop_rate = float(os.getenv('DROP_RATE', '0.05'))  # 5%
-        self.max_daily_amount = float(os.getenv('MAX_DAILY_AMOUNT', '0.00003125'))  # 0.00003125 RBTC (~5000원 at 160M KRW/BTC)
         self.admin_user_id = os.getenv('ADMIN_USER_ID')
+        
+        # 핫 리로드 설정 - 드랍 확률, 일일 한도(기본 0.00003125 RBTC ~5000원), 쿨타임, RPC, 공유 주소 거부 등
+        self.config = BotConfig.from_env(os.environ)
+        self.config_lock = threading.Lock()
+        self.config_overrides = {}  # 관리자 변경값 (Gist config.json, state_load에서 로드)
+        self.config_audit = []
         self.bot_wallet_address = os.getenv('BOT_WALLET_ADDRESS')
+        self.shard_workers = int(os.getenv('SHARD_WORKERS', '0'))  # 2 이상이면 chat_id 기준 멀티 프로세스 처리
+        self.shards = None  # ShardDispatcher (run에서 시작)
+        self.group_control_enabled = os.getenv('GROUP_CONTROL_ENABLED', 'false').lower() == 'true'  # 허용 그룹에서만 동작
+        self.allowed_group_ids = {int(chat_id) for chat_id in os.getenv('ALLOWED_GROUP_IDS', '').split(',') if chat_id.strip()}
         
         
         if not self.bot_token:
             raise ValueError("TELEGRAM_BOT_TOKEN이 설정되지 않았습니다.")
         
-        # 봇 초기화
-        self.bot = telebot.TeleBot(self.bot_token)
-        self.wallet_manager = WalletManager()
+        self.startup = StartupTimer()
         
-        # 트랜잭션 매니저 초기화 (private_key가 있을 때만)
-        if self.private_key:
-            self.tx_manager = TransactionManager(
-                self.base_rpc, 
-                self.private_key
-            )
-        else:
-            self.tx_manager = None
+        # 원격 초기화 병렬 실행 - Gist 스냅샷 / RSK 트랜잭션 매니저(web3 로드) / 텔레그램 봇 정보
+        with self.startup.phase('remote_init'), ThreadPoolExecutor(max_workers=2, thread_name_prefix='startup') as pool:
+            wallet_future = pool.submit(self.startup.timed, 'gist_snapshot', WalletManager)
+            # 트랜잭션 매니저 초기화 (private_key가 있을 때만)
+            tx_future = None
+            if self.private_key:
+                tx_future = pool.submit(
+                    self.startup.timed, 'tx_manager', TransactionManager, self.config.rpc_url, self.private_key,
+                    [key.strip() for key in os.getenv('PRIVATE_KEYS', '').split(',') if key.strip()],
+                    os.getenv('TREASURY_PRIVATE_KEY') or None,
+                    os.getenv('SENDER_SELECTION', 'least_loaded')
+                )
+            
+            # 봇 초기화 및 봇 정보 저장
+            with self.startup.phase('telegram_get_me'):
+                self.bot = telebot.TeleBot(self.bot_token)
+                self.bot_info = self.bot.get_me()
+            
+            self.wallet_manager = wallet_future.result()
+            self.tx_manager = tx_future.result() if tx_future else None
+        
+        if not self.tx_manager:
             logging.warning("PRIVATE_KEY가 설정되지 않았습니다.")
         
-        # 일일 전송량 추적 (Gist에서 로드)
-        self.daily_sent = self.wallet_manager.load_daily_sent()
+        self.outbound = OutboundQueue(self.bot)
+        
+        # 스팸/도배 사전 필터
+        self.spam_filter = SpamFilter.from_env()
+        
+        # 드랍 확률/금액 정책
+        self.drop_policy = DropPolicy.from_env(self.config.drop_rate, self.DROP_AMOUNT_WEI)
         
-        # 일일 한도 알림 기록 로드
-        self.limit_notifications = self.wallet_manager.load_limit_notifications()
+        # 일일 전송량 추적 - 전체/채팅방별
+        self.daily_budget = DailyBudget(
+            self.config.max_daily_wei,
+            self.config.max_daily_per_chat_wei,
+            reset_time=os.getenv('DAILY_RESET_TIME', '09:00'),
+            tz_name=os.getenv('DAILY_RESET_TZ', 'Asia/Seoul'),
+            retention_days=int(os.getenv('DAILY_RETENTION_DAYS', '7'))
+        )
         
-        # [modify] 전송 쿨타임 관리 (새로 추가)
-        self.last_transaction_time = None  # [modify] 전체 채팅방 마지막 전송 시간
-        self.cooldown_seconds = float(os.getenv('COOLDOWN_SECONDS', '30'))  # 기본 30초 쿨타임
+        # 전송 속도 제한 - 전체 / 채팅방별 / 사용자별 토큰 버킷
+        # (기본 30초 쿨타임 - COOLDOWN_SECONDS가 채팅방/사용자 기본값)
+        self.rate_limiter = TokenBucketLimiter(self.config.limits_dict())
         
         # 라운드 로빈 추적
         self.last_winner_tracker = LastWinnerTracker()
+        
+        # 사용자 레지스트리 (지갑/블랙리스트 단일 저장소 - WalletManager 소유)
+        self.users = self.wallet_manager.users
+        
+        # 드랍 원장 (미완료 의도 재처리는 리더가 된 뒤 run에서)
+        self.drop_ledger = DropLedger(self.wallet_manager)
+        
+        # 리더 임대 (run에서 획득) - 대기 인스턴스도 상태는 미리 로드해 둠
+        self.leader_lease = None
+        with self.startup.phase('state_load'):
+            self._load_state()
+        
+        # 백그라운드 작업 스케줄러 (지연 삭제, 상태 저장, 날짜 정리, 잔고 갱신)
+        self.dirty_state = set()
+        self.dirty_lock = threading.Lock()
+        self.bot_balance = None  # 잔고 갱신 작업에서 캐시
+        from apscheduler.schedulers.background import BackgroundScheduler
+        self.scheduler = BackgroundScheduler(timezone=self.daily_budget.tz or 'UTC')
+        self.setup_jobs()
+        
+        # 응답 템플릿, 핸들러 설정
+        self.templates = TemplateRegistry()
+        self.setup_templates()
+        self.setup_handlers()
+        
+        # 백로그 load shedding (핸들러 매칭 전에 오래된/과부하 메시지 제외, 명령어 우선)
+        self.update_gate = UpdateGate(
+            max_age_seconds=float(os.getenv('STALE_MESSAGE_SECONDS', '60')),
+            max_queue_depth=int(os.getenv('SHED_QUEUE_DEPTH', '200')),
+            queue_depth=self.pending_updates,
+            allowed_chats=self.allowed_group_ids if self.group_control_enabled else None
+        )
+        self.update_gate.install(self.bot)
+        
+        # 운영 중 CPU/메모리 진단 (/profile, /memtrace, SIGUSR1/SIGUSR2)
+        self.diagnostics = Diagnostics(
+            report_dir=os.getenv('PROFILE_DIR', 'logs'),
+            top=int(os.getenv('PROFILE_TOP', '15')),
+            max_seconds=float(os.getenv('PROFILE_MAX_SECONDS', '300'))
+        )
+        self.profile_seconds = float(os.getenv('PROFILE_SECONDS', '30'))  # 명령/시그널 기본 진단 시간
+        
+        # 헬스 체크 엔드포인트 (HEALTH_PORT=0이면 비활성화, 서버는 run에서 시작)
+        health_port = int(os.getenv('HEALTH_PORT') or os.getenv('PORT') or '8080')
+        self.health = HealthMonitor(health_port, float(os.getenv('HEALTH_STALL_SECONDS', '120'))) if health_port else None
+        if self.health:
+            self.health.install(self.bot)
+            self.setup_health()
+        logging.info(f"봇 초기화 완료: @{self.bot_info.username}")
+        
+        # 관리자가 저장해 둔 설정 변경값 적용
+        if self.config_overrides:
+            try:
+                self.reload_config('startup', audit=False)
+            except ValueError as e:
+                logging.error(f"저장된 설정 변경값 무시 (검증 실패): {e}")
+        
+        # 설정 출력
+        logging.info(f"=== 봇 설정 ===")
+        logging.info(f"드랍 확률: {self.config.drop_rate*100}% (채팅방별 설정: {len(self.drop_policy.chat_rates)}개)")
+        logging.info(f"드랍 금액: {self.drop_policy.describe_amount()} ({len(self.drop_policy.tiers)}개 구간)")
+        logging.info(f"일일 한도: {format_rbtc(self.config.max_daily_wei)} RBTC (채팅방별 {format_rbtc(self.config.max_daily_per_chat_wei)} RBTC)")
+        logging.info(f"쿨타임: {self.config.cooldown_seconds}초 (속도 제한: {self.rate_limiter.limits})")
+        logging.info(f"그룹 제한: {f'허용 그룹 {len(self.allowed_group_ids)}개' if self.group_control_enabled else '비활성화'}")
+        logging.info(f"RSK RPC: {BotConfig.display('RPC_URL', self.config.rpc_url)}")
+        logging.info(f"봇 지갑: {self.bot_wallet_address[:10]}...{self.bot_wallet_address[-8:] if self.bot_wallet_address else 'None'}")
+        logging.info(f"TX Manager: {'활성화' if self.tx_manager else '비활성화'}")
+        logging.info(f"================")
+    
+    @property
+    def block_shared_wallets(self) -> bool:
+        return self.config.block_shared_wallets
+    
+    def _config_env(self) -> Dict[str, str]:
+        """리로드 입력 - env 파일 < 프로세스 환경변수 < 관리자 변경값(Gist) 순으로 덮어씀 (시작시 load_dotenv와 같은 우선순위)"""
+        env = dict(os.environ)
+        env_file = os.getenv('CONFIG_ENV_FILE', '.env')
+        if os.path.exists(env_file):
+            env.update({key: value for key, value in dotenv_values(env_file).items() if value is not None})
+        env.update(PROCESS_ENV)  # 시작 전부터 있던 값은 파일보다 우선 (.env에서 들어온 값만 파일 변경 반영)
+        env.update(self.config_overrides)
+        return env
+    
+    def reload_config(self, source: str, actor: str = 'system', audit: bool = True) -> Dict[str, list]:
+        """설정 다시 읽기 - 검증을 통과하면 한 번에 교체하고 감사 기록 남김
+        Returns: 변경 내역 {키: [이전, 이후]} (검증 실패시 ValueError - 기존 설정 유지)
+        """
+        with self.config_lock:
+            env = self._config_env()
+            config = BotConfig.from_env(env)
+            old_env, new_env = dict(self.config.env), dict(config.env)
+            changes = {
+                key: [BotConfig.display(key, old_env.get(key)), BotConfig.display(key, new_env.get(key))]
+                for key in BotConfig.KEYS if old_env.get(key) != new_env.get(key)
+            }
+            if not changes:
+                return changes
+            
+            # 드랍 경로가 읽는 설정 교체 + 파생 객체 갱신 (활동량/버킷/오늘 사용량은 유지)
+            self.config = config
+            self.daily_budget.set_limits(config.max_daily_wei, config.max_daily_per_chat_wei)
+            self.rate_limiter.set_limits(config.limits_dict())
+            policy = DropPolicy.from_env(config.drop_rate, self.DROP_AMOUNT_WEI, new_env)
+            policy.activity = self.drop_policy.activity
+            self.drop_policy = policy
+            if self.tx_manager and 'RPC_URL' in changes:
+                self.tx_manager.set_rpc_url(config.rpc_url)
+            self.setup_templates()
+            if self.shards:
+                self.shards.broadcast(('env', new_env))
+            
+            logging.info(f"⚙️ 설정 변경 ({source}, {actor}): {changes}")
+            if audit:
+                self.config_audit.append({
+                    'at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    'source': source,
+                    'actor': actor,
+                    'changes': changes
+                })
+                self.config_audit = self.config_audit[-100:]
+                self.wallet_manager.save_config({'overrides': self.config_overrides, 'audit': self.config_audit})
+        return changes
+    
+    def _reload_config_from_signal(self):
+        """SIGHUP - 저장소 변경값을 다시 받아 리로드"""
+        try:
+            self.config_overrides = {key: str(value) for key, value in self.wallet_manager.load_config().get('overrides', {}).items()
+                                     if key in BotConfig.KEYS}
+            changes = self.reload_config('signal')
+            logging.info(f"SIGHUP 설정 리로드: 변경 {len(changes)}개")
+        except ValueError as e:
+            logging.error(f"SIGHUP 설정 리로드 실패 (기존 설정 유지): {e}")
+    
+    def setup_health(self):
+        """헬스 응답 항목과 연결 확인 주기 작업 등록"""
+        self.health.add_source('leader', lambda: bool(self.leader_lease and self.leader_lease.is_leader()))
+        self.health.add_source('update_lag_seconds',
+                               lambda: round(self.update_gate.last_lag, 1) if self.update_gate.last_lag is not None else None)
+        self.health.add_source('pending_updates', self.pending_updates)
+        self.health.add_source('outbound_queue', self.outbound.depth)
+        self.health.add_source('open_drop_intents', lambda: len(self.drop_ledger.open_intents()))
+        self.health.add_source('shed', lambda: {**self.update_gate.stats, 'rate': round(self.update_gate.shed_rate(), 4)})
+        self.health.add_source('last_drop_at', self._last_drop_at)
+        
+        probe_seconds = int(os.getenv('HEALTH_PROBE_SECONDS', '60'))
+        self.scheduler.add_job(self.probe_health, 'interval', seconds=probe_seconds, next_run_time=datetime.now(self.scheduler.timezone),
+                               id='probe_health', coalesce=True, max_instances=1)
+    
+    def probe_health(self):
+        """RPC/Gist 연결 확인 (헬스 응답에는 캐시된 결과만 사용)"""
+        if self.tx_manager:
+            self.health.probe('rpc', self.tx_manager.is_connected)
+        self.health.probe('gist', self.wallet_manager.ping)
+    
+    def _last_drop_at(self) -> Optional[str]:
+        """마지막 드랍 성공 시각"""
+        with self.drop_columns.lock:
+            if not len(self.drop_columns):
+                return None
+            timestamp = self.drop_columns.columns['timestamp'][-1]
+        return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+    
+    def start_diagnostics(self, kind: str, seconds: float, chat_id=None):
+        """진단 시작 - 끝나면 리포트를 chat_id(없으면 관리자)에게 전송"""
+        chat_id = chat_id or self.admin_user_id
+        
+        def deliver(report: str, path: str):
+            if chat_id:
+                self.outbound.send(chat_id, f"{report[:3800]}\n\n📁 {path}", priority=OutboundQueue.PRIORITY_LOW)
+        
+        if not self.diagnostics.start(kind, seconds, deliver):
+            logging.info(f"진단 진행 중 - 요청 무시: {kind}")
+            if chat_id:
+                self.outbound.send(chat_id, f"⏳ 이미 진단이 진행 중입니다: {self.diagnostics.running}")
+            return
+        logging.info(f"진단 시작: {kind} {seconds}초")
+        if chat_id:
+            self.outbound.send(chat_id, f"🔬 {kind} 시작 - {min(seconds, self.diagnostics.max_seconds):.0f}초 후 리포트를 보냅니다.")
+    
+    def pending_updates(self) -> int:
+        """핸들러 스레드 풀 + 샤드 워커 큐에 밀린 메시지 수"""
+        worker_pool = getattr(self.bot, 'worker_pool', None)
+        depth = worker_pool.tasks.qsize() if worker_pool else 0
+        if self.shards:
+            depth += self.shards.depth()
+        return depth
+    
+    def _load_state(self, refresh: bool = False):
+        """저장소에서 상태 로드 (refresh시 Gist를 새로 한 번 받아 지갑/원장까지 다시 로드)"""
+        if refresh:
+            self.wallet_manager.take_snapshot()
+            self.wallet_manager.reload_wallets()
+            self.drop_ledger.reload()
+        
+        # 일일 전송량 (Gist에서 로드)
+        self.daily_budget.load_from_dict(self.wallet_manager.load_daily_sent())
+        
+        # 일일 한도 알림 기록 로드 (지난 날짜 정리)
+        self.limit_notifications = self.daily_budget.prune(self.wallet_manager.load_limit_notifications())
+        
+        # 쿨타임 버킷 상태
+        self.rate_limiter.load_from_dict(self.wallet_manager.load_rate_limits())
+        
+        # 라운드 로빈 상태
         last_winners_data = self.wallet_manager.load_last_winners()
         self.last_winner_tracker.load_from_dict(last_winners_data)
         
+        # 설정 변경값/감사 기록
+        config_state = self.wallet_manager.load_config()
+        self.config_overrides = {key: str(value) for key, value in config_state.get('overrides', {}).items() if key in BotConfig.KEYS}
+        self.config_audit = config_state.get('audit', [])
+        
         # 블랙리스트 로드
-        self.blacklist = self.wallet_manager.load_blacklist()
-        logging.info(f"블랙리스트 로드: {len(self.blacklist)}명")
+        self.users.load_blacklist(self.wallet_manager.load_blacklist())
+        logging.info(f"블랙리스트 로드: {len(self.users.blacklisted_ids())}명")
         
         # 드랍 이력 로드
         self.drop_history = self.wallet_manager.load_drop_history()
         logging.info(f"드랍 이력 로드: {len(self.drop_history)}건")
         
-        # 핸들러 설정
-        self.setup_handlers()
+        # 이전 형식(amount_rbtc float) 이력을 정수 wei로 변환 - 다음 저장 때 반영
+        migrated = 0
+        for record in self.drop_history:
+            if 'amount_wei' not in record:
+                record['amount_wei'] = DropHistoryColumns.amount_wei(record)
+                record.pop('amount_rbtc', None)
+                migrated += 1
+        if migrated:
+            logging.info(f"드랍 이력 wei 변환: {migrated}건")
+        
+        self.wallet_manager.release_snapshot()
+        
+        # 집계용 컬럼 생성
+        self.drop_columns = DropHistoryColumns.from_records(self.drop_history)
+        self.drop_index = DropHistoryIndex.from_records(self.drop_history)
+        logging.info(f"사용자 레지스트리: {len(self.users)}명")
+    
+    def get_today_key(self) -> str:
+        """리셋 시각(기본 오전 9시, DAILY_RESET_TZ 기준)으로 오늘 날짜 키 반환"""
+        return self.daily_budget.today_key()
+    
+    def setup_jobs(self):
+        """주기 작업 등록 (스케줄러 시작은 run에서)"""
+        flush_seconds = int(os.getenv('STATE_FLUSH_SECONDS', '60'))
+        self.scheduler.add_job(self.flush_state, 'interval', seconds=flush_seconds,
+                               id='flush_state', coalesce=True, max_instances=1)
+        
+        # 일일 리셋 직후 지난 날짜 키 정리
+        reset_hour, reset_minute = divmod(int(self.daily_budget.reset_offset.total_seconds()) // 60, 60)
+        self.scheduler.add_job(self.prune_old_days, 'cron', hour=reset_hour, minute=reset_minute,
+                               id='prune_old_days', coalesce=True, max_instances=1)
+        
+        if self.tx_manager:
+            self.scheduler.add_job(self.refresh_balance, 'interval', minutes=5, next_run_time=datetime.now(self.scheduler.timezone),
+                                   id='refresh_balance', coalesce=True, max_instances=1)
+            self.scheduler.add_job(self.reconcile_drop_ledger, 'interval', minutes=5,
+                                   id='reconcile_drop_ledger', coalesce=True, max_instances=1)
+            self.scheduler.add_job(self.refresh_senders, 'interval', minutes=1, next_run_time=datetime.now(self.scheduler.timezone),
+                                   id='refresh_senders', coalesce=True, max_instances=1)
+    
+    def schedule_message_deletion(self, chat_id: int, message_ids: List[int], delay_seconds: float):
+        """메시지 지연 삭제 예약"""
+        run_date = datetime.now(self.scheduler.timezone) + timedelta(seconds=delay_seconds)
+        self.scheduler.add_job(self._delete_messages, 'date', run_date=run_date, args=[chat_id, message_ids],
+                               misfire_grace_time=None)
+    
+    def _delete_messages(self, chat_id: int, message_ids: List[int]):
+        """예약된 메시지 삭제"""
+        for message_id in message_ids:
+            try:
+                self.bot.delete_message(chat_id, message_id)
+            except Exception as e:
+                logging.warning(f"메시지 삭제 실패: {chat_id}/{message_id} - {e}")
+    
+    def _leader_heartbeat(self):
+        """리더 임대 갱신 - 상실시 폴링 중단"""
+        if not self.leader_lease.renew():
+            logging.error("리더 임대 상실 - 폴링 중단")
+            self.bot.stop_polling()
+    
+    def mark_state_dirty(self, *names: str):
+        """다음 flush 때 저장할 상태 표시"""
+        with self.dirty_lock:
+            self.dirty_state.update(names)
+    
+    def flush_state(self):
+        """변경된 상태만 저장 (주기 작업 및 종료시)"""
+        # 이번에 저장되는 일일 전송량/이력에 반영된 완료 의도 (이후 완료분은 다음 flush)
+        completed = self.drop_ledger.deferred_ids()
+        with self.dirty_lock:
+            names, self.dirty_state = self.dirty_state, set()
+        
+        # 순서대로 저장 - 원장 완료 기록은 일일 전송량/이력이 저장된 뒤에만
+        savers = {
+            'daily_sent': lambda: self.wallet_manager.save_daily_sent(self.daily_budget.save_to_dict()),
+            'drop_history': lambda: self.wallet_manager.save_drop_history(self.drop_history),
+            'rate_limits': lambda: self.wallet_manager.save_rate_limits(self.rate_limiter.save_to_dict()),
+            'last_winners': lambda: self.wallet_manager.save_last_winners(self.last_winner_tracker.save_to_dict()),
+            'limit_notifications': lambda: self.wallet_manager.save_limit_notifications(self.limit_notifications)
+        }
+        failed = set()
+        for name in savers:
+            if name in names and not savers[name]():
+                logging.error(f"상태 저장 실패, 다음 주기에 재시도: {name}")
+                self.mark_state_dirty(name)
+                failed.add(name)
+        
+        if completed and not failed & {'daily_sent', 'drop_history'}:
+            if not self.drop_ledger.commit(completed):
+                logging.error(f"드랍 원장 완료 기록 실패, 다음 주기에 재시도: {len(completed)}건")
+    
+    def prune_old_days(self):
+        """보관 기간이 지난 일일 전송량/한도 알림 날짜 키 정리"""
+        self.daily_budget.prune()
+        self.limit_notifications = self.daily_budget.prune(self.limit_notifications)
+        self.mark_state_dirty('daily_sent', 'limit_notifications')
+        logging.info(f"지난 날짜 정리 완료 - 보관 일수: {self.daily_budget.retention_days}일")
+    
+    def refresh_balance(self):
+        """봇 지갑 잔고 캐시 갱신"""
+        address = self.bot_wallet_address or self.tx_manager.account.address
+        self.bot_balance = self.tx_manager.get_balance_wei(address)
+        logging.info(f"봇 지갑 잔고: {format_rbtc(self.bot_balance)} RBTC")
+    
+    def refresh_senders(self):
+        """송금 계정 풀 상태 갱신 후 잔고 부족 계정 충전 (TREASURY_PRIVATE_KEY 설정시)"""
+        self.tx_manager.refresh_senders()
+        self.tx_manager.top_up_senders(
+            rbtc_to_wei(os.getenv('HOT_WALLET_MIN_BALANCE', '0.0001')),
+            rbtc_to_wei(os.getenv('HOT_WALLET_TOP_UP_AMOUNT', '0.0005'))
+        )
+    
+    def reconcile_drop_ledger(self):
+        """오래 열려 있는 드랍 의도 확정 (진행 중인 드랍과 겹치지 않도록 2분 이상 된 것만)"""
+        cutoff = time.time() - 120
+        for intent in self.drop_ledger.open_intents():
+            if intent['updated_at'] < cutoff:
+                try:
+                    self._resolve_intent(intent)
+                except Exception as e:
+                    logging.error(f"드랍 의도 재처리 실패: {intent['id']} - {e}")
+    
+    def setup_templates(self):
+        """설정값이 반영된 응답 템플릿 등록 (설정 변경시 다시 호출)"""
+        self.templates.register('start', f"""
+🎯 RSK RBTC 드랍 봇에 오신 것을 환영합니다!
+
+💰 주요 기능:
+• /set 0x주소 - 지갑 주소 등록
+• /wallet - 내 지갑 정보 확인
+• /mydrops - 내 드랍 이력
+• /info - 봇 상태 및 설정 확인
+
+🎲 RBTC 에어드랍:
+• 채팅 메시지 작성시 {self.config.drop_rate*100:.1f}% 확률로 자동 드랍
+• 1회 드랍량: {self.drop_policy.describe_amount()}
+• 일일 최대: {format_rbtc(self.config.max_daily_wei)} RBTC
+• 쿨다운: {self.config.cooldown_seconds}초
+
+💡 시작하려면 /set 명령어로 지갑을 등록하세요!
+            """)
         
-        # 봇 정보 저장
-        self.bot_info = self.bot.get_me()
-        logging.info(f"봇 초기화 완료: @{self.bot_info.username}")
+        bot_wallet = f"{self.bot_wallet_address[:10]}...{self.bot_wallet_address[-8:]}" if self.bot_wallet_address else "None"
+        self.templates.register('info', f"""
+📊 봇 설정 정보:
+
+🎲 드랍 확률: 비밀 🤫
+💰 하루 최대: {format_rbtc(self.config.max_daily_wei)} RBTC
+📈 오늘 전송: {{today_sent}} RBTC
+👥 등록 지갑: {{wallet_count}}개
+⏰ 전송 쿨타임: {int(self.config.cooldown_seconds)}초
+
+🌐 체인: Rootstock Network
+💳 봇 지갑: `{bot_wallet}`{{balance_line}}
+            """)
         
-        # 설정 출력
-        logging.info(f"=== 봇 설정 ===")
-        logging.info(f"드랍 확률: {self.drop_rate*100}%")
-        logging.info(f"일일 한도: {self.max_daily_amount} RBTC")
-        logging.info(f"쿨타임: {self.cooldown_seconds}초")
-        logging.info(f"RSK RPC: {self.base_rpc}")
-        logging.info(f"봇 지갑: {self.bot_wallet_address[:10]}...{self.bot_wallet_address[-8:] if self.bot_wallet_address else 'None'}")
-        logging.info(f"TX Manager: {'활성화' if self.tx_manager else '비활성화'}")
-        logging.info(f"================")
-    
-    def get_today_key(self) -> str:
-        """오전 9시 기준으로 오늘 날짜 키 반환"""
-        now = datetime.now()
-        if now.hour < 9:
-            # 오전 9시 이전이면 전날로 계산
-            return (now - timedelta(days=1)).date().isoformat()
-        else:
-            return now.date().isoformat()
+        self.templates.register('drop', """
+💸 RBTC 드랍! 🎉
+
+👤 {user_name}
+💰 {amount} RBTC
+🔗 [트랜잭션 확인](https://explorer.rsk.co/tx/{tx_hash})
+            """)
     
     def setup_handlers(self):
         """메시지 핸들러 설정"""
@@ -844,23 +3633,7 @@ class RBTCDropBot:
             username = message.from_user.username or "No username"
             logging.info(f"User ID: {user_id}, Username: @{username}")
             
-            welcome_text = f"""
-🎯 RSK RBTC 드랍 봇에 오신 것을 환영합니다!
-
-💰 주요 기능:
-• /set 0x주소 - 지갑 주소 등록
-• /wallet - 내 지갑 정보 확인
-• /info - 봇 상태 및 설정 확인
-
-🎲 RBTC 에어드랍:
-• 채팅 메시지 작성시 {self.drop_rate*100:.1f}% 확률로 자동 드랍
-• 1회 드랍량: 0.0000025 RBTC
-• 일일 최대: {self.max_daily_amount:.8f} RBTC
-• 쿨다운: {self.cooldown_seconds}초
-
-💡 시작하려면 /set 명령어로 지갑을 등록하세요!
-            """
-            self.bot.reply_to(message, welcome_text)
+            self.bot.reply_to(message, self.templates.render('start'))
         
         @self.bot.message_handler(commands=['create_wallet'])
         def handle_create_wallet(message):
@@ -880,7 +3653,7 @@ class RBTCDropBot:
                 user_name = f"@{message.from_user.username}" if message.from_user.username else message.from_user.first_name or "Unknown"
                 
                 # 지갑 저장
-                if self.wallet_manager.set_wallet(user_id, account.address):
+                if self.register_wallet(user_id, account.address):
                     response_text = f"""✅ 새 지갑이 생성되었습니다!
 
 💳 주소: `{account.address}`
@@ -889,15 +3662,9 @@ class RBTCDropBot:
 ⚠️ **중요**: Private Key를 안전하게 보관하세요!
 이 메시지는 곧 삭제됩니다."""
                     
-                    # 메시지 전송 후 10초 뒤 삭제
+                    # 메시지 전송 후 10초 뒤 삭제 (스케줄러 작업 - 핸들러는 대기하지 않음)
                     sent_msg = self.bot.reply_to(message, response_text, parse_mode='Markdown')
-                    import time
-                    time.sleep(10)
-                    try:
-                        self.bot.delete_message(message.chat.id, sent_msg.message_id)
-                        self.bot.delete_message(message.chat.id, message.message_id)
-                    except:
-                        pass
+                    self.schedule_message_deletion(message.chat.id, [sent_msg.message_id, message.message_id], delay_seconds=10)
                 else:
                     self.bot.reply_to(message, "❌ 지갑 생성 실패")
             except Exception as e:
@@ -923,7 +3690,7 @@ class RBTCDropBot:
                 return
             
             # 인라인 처리: 즉시 검증 및 저장
-            if self.wallet_manager.set_wallet(user_id, wallet_address):
+            if self.register_wallet(user_id, wallet_address):
                 success_text = "✅ 등록완료했습니다!"  # [modify] 메시지 간소화
                 self.bot.reply_to(message, success_text)
                 logging.info(f"지갑 등록 성공: {user_name} ({user_id}) -> {wallet_address}")
@@ -938,38 +3705,85 @@ class RBTCDropBot:
             
             if wallet:
                 # RBTC 잔액 조회
-                balance = 0.0
+                balance = 0
                 if self.tx_manager:
-                    balance = self.tx_manager.get_rbtc_balance(wallet)
+                    balance = self.tx_manager.get_balance_wei(wallet)
                 
                 wallet_text = f"""
 💳 내 지갑 정보
 
 📍 주소: `{wallet}`
-💰 잔액: {balance:.8f} RBTC
+💰 잔액: {format_rbtc(balance)} RBTC
                 """
                 self.bot.reply_to(message, wallet_text, parse_mode='Markdown')
             else:
                 self.bot.reply_to(message, "❌ 등록된 지갑이 없습니다. /set 명령어로 지갑을 등록해주세요.")
         
+        @self.bot.message_handler(commands=['mydrops'])
+        def handle_my_drops(message):
+            """내 드랍 이력 (최신순, 페이지 단위)
+            /mydrops [페이지] - 내 계정이 받은 드랍
+            /mydrops wallet [페이지] - 등록 지갑 주소로 받은 드랍
+            """
+            user_id = str(message.from_user.id)
+            parts = message.text.split()[1:]
+            by_wallet = bool(parts) and parts[0].lower() == 'wallet'
+            if by_wallet:
+                parts = parts[1:]
+            try:
+                page = max(1, int(parts[0])) if parts else 1
+            except ValueError:
+                self.bot.reply_to(message, "사용법: /mydrops [페이지] 또는 /mydrops wallet [페이지]")
+                return
+            
+            if by_wallet:
+                wallet = self.wallet_manager.get_wallet(user_id)
+                if not wallet:
+                    self.bot.reply_to(message, "❌ 등록된 지갑이 없습니다. /set 명령어로 지갑을 등록해주세요.")
+                    return
+                key = DropHistoryIndex.key(wallet=wallet)
+                title = f"💳 지갑 드랍 이력 ({wallet[:10]}...{wallet[-6:]})"
+            else:
+                key = DropHistoryIndex.key(user_id=user_id)
+                title = "🎁 내 드랍 이력"
+            
+            count, total = self.drop_index.summary(key)
+            if not count:
+                self.bot.reply_to(message, "📭 아직 받은 드랍이 없습니다. 그룹에서 채팅하면 랜덤으로 드랍됩니다!")
+                return
+            
+            records, pages = self.drop_index.page(self.drop_history, key, page, self.MYDROPS_PAGE_SIZE)
+            if not records:
+                self.bot.reply_to(message, f"❌ 페이지 범위를 벗어났습니다. (전체 {pages}페이지)")
+                return
+            
+            lines = [title, "", f"총 {count}회, {format_rbtc(total)} RBTC", ""]
+            for record in records:
+                amount = format_rbtc(DropHistoryColumns.amount_wei(record))
+                tx_hash = record.get('tx_hash') or ''
+                lines.append(f"• {record.get('timestamp', '')} - {amount} RBTC\n  [트랜잭션 확인](https://explorer.rsk.co/tx/{tx_hash})")
+            lines += ["", f"📄 {page}/{pages} 페이지"]
+            if page < pages:
+                lines.append(f"다음: /mydrops {'wallet ' if by_wallet else ''}{page + 1}")
+            self.bot.reply_to(message, '\n'.join(lines), parse_mode='Markdown', disable_web_page_preview=True)
+        
         @self.bot.message_handler(commands=['info'])
         def handle_info(message):
             """봇 정보 및 설정"""
-            today = self.get_today_key()
-            today_sent = self.daily_sent.get(today, 0)
+            today_sent = self.daily_budget.spent(self.get_today_key())
+            wallet_count = self.wallet_manager.wallet_count()
             
-            info_text = f"""
-📊 봇 설정 정보:
-
-🎲 드랍 확률: 비밀 🤫
-💰 하루 최대: {self.max_daily_amount:.8f} RBTC
-📈 오늘 전송: {today_sent:.8f} RBTC
-👥 등록 지갑: {len(self.wallet_manager.get_all_wallets())}개
-⏰ 전송 쿨타임: {int(self.cooldown_seconds)}초
-
-🌐 체인: Rootstock Network
-💳 봇 지갑: `{self.bot_wallet_address[:10]}...{self.bot_wallet_address[-8:]}`
-            """
+            balance = self.bot_balance
+            
+            # 오늘 전송량/지갑 수/잔고가 바뀌었을 때만 포맷 + 렌더링 (원시값만 key로 비교)
+            info_text = self.templates.render(
+                'info', key=(today_sent, wallet_count, balance),
+                build=lambda: {
+                    'today_sent': format_rbtc(today_sent),
+                    'wallet_count': wallet_count,
+                    'balance_line': f"\n💰 봇 잔액: {format_rbtc(balance)} RBTC" if balance is not None else ""
+                }
+            )
             self.bot.reply_to(message, info_text)
         
         @self.bot.message_handler(commands=['stats'])
@@ -986,7 +3800,7 @@ class RBTCDropBot:
             
             # 통계 계산
             total_drops = len(self.drop_history)
-            total_amount = sum(record['amount_rbtc'] for record in self.drop_history)
+            total_amount = sum(record['amount_wei'] for record in self.drop_history)
             
             # 사용자별 통계
             user_stats = {}
@@ -1001,7 +3815,7 @@ class RBTCDropBot:
                         'wallet': record['wallet_address']
                     }
                 user_stats[user_id]['count'] += 1
-                user_stats[user_id]['total'] += record['amount_rbtc']
+                user_stats[user_id]['total'] += record['amount_wei']
             
             # 상위 10명
             top_users = sorted(user_stats.items(), key=lambda x: x[1]['total'], reverse=True)[:10]
@@ -1009,13 +3823,16 @@ class RBTCDropBot:
             stats_text = f"""📊 드랍 통계
             
 총 드랍 횟수: {total_drops}회
-총 지급 RBTC: {total_amount:.8f}
+총 지급 RBTC: {format_rbtc(total_amount)}
 총 참여자 수: {len(user_stats)}명
+🚫 스팸 차단: 도배 {self.spam_filter.stats['flood']}회, 반복 {self.spam_filter.stats['duplicate']}회 (검사 {self.spam_filter.stats['checked']}회)
+⏭️ 백로그 건너뜀: 오래됨 {self.update_gate.stats['stale']}회, 과부하 {self.update_gate.stats['overload']}회 ({self.update_gate.shed_rate()*100:.1f}%)
+🚧 미허용 그룹 메시지: {self.update_gate.stats['blocked']}회
 
 🏆 TOP 10 사용자:
 """
             for i, (user_id, stats) in enumerate(top_users, 1):
-                stats_text += f"{i}. {stats['username']} - {stats['count']}회, {stats['total']:.8f} RBTC\n"
+                stats_text += f"{i}. {stats['username']} - {stats['count']}회, {format_rbtc(stats['total'])} RBTC\n"
             
             self.bot.reply_to(message, stats_text)
         
@@ -1042,11 +3859,12 @@ class RBTCDropBot:
             action = parts[1].lower()
             
             if action == 'list':
-                if not self.blacklist:
+                blacklist = self.users.blacklisted_ids()
+                if not blacklist:
                     self.bot.reply_to(message, "📋 블랙리스트가 비어있습니다.")
                 else:
-                    list_text = f"🚫 블랙리스트 ({len(self.blacklist)}명):\n\n"
-                    for user_id in self.blacklist:
+                    list_text = f"🚫 블랙리스트 ({len(blacklist)}명):\n\n"
+                    for user_id in blacklist:
                         list_text += f"• {user_id}\n"
                     self.bot.reply_to(message, list_text)
             
@@ -1065,19 +3883,23 @@ class RBTCDropBot:
                     self.bot.reply_to(message, "❌ 올바른 사용자 ID를 입력해주세요.")
                     return
                 
+                user = self.users.get(user_id)
+                blacklisted = bool(user and user.blacklisted)
                 if action == 'add':
-                    if user_id not in self.blacklist:
-                        self.blacklist.append(user_id)
-                        self.wallet_manager.save_blacklist(self.blacklist)
+                    if not blacklisted:
+                        self.users.set_blacklisted(user_id, True)
+                        self._sync_shard_user(user_id)
+                        self.wallet_manager.save_blacklist(self.users.blacklisted_ids())
                         self.bot.reply_to(message, f"✅ {user_id}를 블랙리스트에 추가했습니다.")
                         logging.info(f"블랙리스트 추가: {user_id} by {message.from_user.id}")
                     else:
                         self.bot.reply_to(message, f"⚠️ {user_id}는 이미 블랙리스트에 있습니다.")
                 
                 elif action == 'remove':
-                    if user_id in self.blacklist:
-                        self.blacklist.remove(user_id)
-                        self.wallet_manager.save_blacklist(self.blacklist)
+                    if blacklisted:
+                        self.users.set_blacklisted(user_id, False)
+                        self._sync_shard_user(user_id)
+                        self.wallet_manager.save_blacklist(self.users.blacklisted_ids())
                         self.bot.reply_to(message, f"✅ {user_id}를 블랙리스트에서 제거했습니다.")
                         logging.info(f"블랙리스트 제거: {user_id} by {message.from_user.id}")
                     else:
@@ -1086,6 +3908,153 @@ class RBTCDropBot:
                 self.bot.reply_to(message, "❌ 잘못된 명령어 형식입니다. /blacklist 를 입력해 도움말을 확인하세요.")
         
         
+        @self.bot.message_handler(commands=['lookup'])
+        def handle_lookup(message):
+            """지갑 주소/사용자 조회 (관리자 전용)"""
+            # 관리자 확인
+            if str(message.from_user.id) != self.admin_user_id:
+                self.bot.reply_to(message, "❌ 관리자만 사용할 수 있는 명령어입니다.")
+                return
+            
+            parts = message.text.split()
+            if len(parts) < 2:
+                help_text = """
+🔍 지갑 조회:
+
+/lookup 0x주소 - 주소를 등록한 사용자
+/lookup user_id - 사용자의 등록 주소
+/lookup shared - 여러 계정이 공유하는 주소 목록
+                """
+                self.bot.reply_to(message, help_text)
+                return
+            
+            target = parts[1]
+            
+            if target.lower() == 'shared':
+                shared = self.wallet_manager.get_shared_addresses()
+                if not shared:
+                    self.bot.reply_to(message, "✅ 공유된 주소가 없습니다.")
+                    return
+                lookup_text = f"⚠️ 공유 주소 ({len(shared)}개):\n\n"
+                for address, users in shared.items():
+                    lookup_text += f"• {address}\n  {', '.join(users)}\n"
+                self.bot.reply_to(message, lookup_text)
+            
+            elif target.startswith('0x'):
+                users = self.wallet_manager.get_users_by_address(target)
+                if users:
+                    count, total = self.drop_index.summary(DropHistoryIndex.key(wallet=target))
+                    self.bot.reply_to(message, f"🔍 {target}\n등록 사용자 ({len(users)}명): {', '.join(users)}\n"
+                                               f"드랍 수신: {count}회, {format_rbtc(total)} RBTC")
+                else:
+                    self.bot.reply_to(message, "❌ 해당 주소를 등록한 사용자가 없습니다.")
+            
+            else:
+                wallet = self.wallet_manager.get_wallet(target)
+                if wallet:
+                    shared_note = " (⚠️ 공유 주소)" if self.wallet_manager.is_shared_address(wallet) else ""
+                    self.bot.reply_to(message, f"🔍 {target}\n주소: {wallet}{shared_note}")
+                else:
+                    self.bot.reply_to(message, "❌ 등록된 지갑이 없습니다.")
+        
+        @self.bot.message_handler(commands=['analytics'])
+        def handle_analytics(message):
+            """일별/채팅방별/사용자별 드랍 집계 (관리자 전용)"""
+            # 관리자 확인
+            if str(message.from_user.id) != self.admin_user_id:
+                self.bot.reply_to(message, "❌ 관리자만 사용할 수 있는 명령어입니다.")
+                return
+            
+            parts = message.text.split()
+            group_by = parts[1].lower() if len(parts) > 1 else 'day'
+            if group_by not in DropHistoryColumns.GROUP_KEYS:
+                self.bot.reply_to(message, "사용법: /analytics [day|chat|user]")
+                return
+            
+            if not len(self.drop_columns):
+                self.bot.reply_to(message, "📊 아직 드랍 이력이 없습니다.")
+                return
+            
+            self.bot.reply_to(message, self.drop_columns.report(group_by, self.daily_budget.day_offset()))
+        
+        @self.bot.message_handler(commands=['profile', 'memtrace'])
+        def handle_diagnostics(message):
+            """CPU 프로파일 / 메모리 추적 (관리자 전용)"""
+            # 관리자 확인
+            if str(message.from_user.id) != self.admin_user_id:
+                self.bot.reply_to(message, "❌ 관리자만 사용할 수 있는 명령어입니다.")
+                return
+            
+            parts = message.text.split()
+            kind = 'profile' if parts[0].lstrip('/').split('@')[0] == 'profile' else 'memtrace'
+            try:
+                seconds = float(parts[1]) if len(parts) > 1 else self.profile_seconds
+            except ValueError:
+                self.bot.reply_to(message, f"사용법: /{kind} [초={self.profile_seconds:g}]")
+                return
+            
+            self.start_diagnostics(kind, seconds, message.chat.id)
+        
+        @self.bot.message_handler(commands=['config'])
+        def handle_config(message):
+            """설정 조회/변경/리로드 (관리자 전용)"""
+            # 관리자 확인
+            if str(message.from_user.id) != self.admin_user_id:
+                self.bot.reply_to(message, "❌ 관리자만 사용할 수 있는 명령어입니다.")
+                return
+            
+            parts = message.text.split(maxsplit=3)
+            action = parts[1].lower() if len(parts) > 1 else 'show'
+            actor = str(message.from_user.id)
+            
+            if action == 'show':
+                lines = ["⚙️ 현재 설정 (* = 관리자 변경값)", ""]
+                for key, value in self.config.env:
+                    mark = '*' if key in self.config_overrides else ' '
+                    lines.append(f"{mark} {key} = {BotConfig.display(key, value)}")
+                lines += ["", "/config set 키 값 | /config unset 키 | /config reload | /config audit"]
+                self.bot.reply_to(message, '\n'.join(lines))
+                return
+            
+            if action == 'audit':
+                if not self.config_audit:
+                    self.bot.reply_to(message, "📜 설정 변경 기록이 없습니다.")
+                    return
+                lines = ["📜 최근 설정 변경", ""]
+                for entry in self.config_audit[-10:]:
+                    changed = ', '.join(f"{key}: {old} → {new}" for key, (old, new) in entry['changes'].items())
+                    lines.append(f"{entry['at']} [{entry['source']}/{entry['actor']}] {changed}")
+                self.bot.reply_to(message, '\n'.join(lines))
+                return
+            
+            previous = dict(self.config_overrides)
+            if action == 'set' and len(parts) == 4 and parts[2].upper() in BotConfig.KEYS:
+                self.config_overrides[parts[2].upper()] = parts[3].strip()
+            elif action == 'unset' and len(parts) >= 3 and parts[2].upper() in BotConfig.KEYS:
+                self.config_overrides.pop(parts[2].upper(), None)
+            elif action == 'reload':
+                self.config_overrides = {key: str(value) for key, value in self.wallet_manager.load_config().get('overrides', {}).items()
+                                         if key in BotConfig.KEYS}
+            else:
+                self.bot.reply_to(message, f"사용법: /config [set 키 값|unset 키|reload|audit]\n변경 가능: {', '.join(BotConfig.KEYS)}")
+                return
+            
+            try:
+                changes = self.reload_config('command' if action != 'reload' else 'reload', actor)
+            except ValueError as e:
+                self.config_overrides = previous
+                self.bot.reply_to(message, f"❌ 설정 검증 실패 - 적용하지 않았습니다.\n{e}")
+                return
+            
+            if action != 'reload' and not changes:
+                # 값은 그대로지만 변경값 목록은 저장 (unset 후 기본값과 같은 경우 등)
+                self.wallet_manager.save_config({'overrides': self.config_overrides, 'audit': self.config_audit})
+            if not changes:
+                self.bot.reply_to(message, "✅ 변경된 설정이 없습니다.")
+                return
+            changed = '\n'.join(f"• {key}: {old} → {new}" for key, (old, new) in changes.items())
+            self.bot.reply_to(message, f"✅ 설정 적용 완료\n{changed}")
+        
         @self.bot.message_handler(content_types=['new_chat_members'])
         def handle_new_member(message):
             """봇이 새 그룹에 추가되었을 때"""
@@ -1098,6 +4067,24 @@ class RBTCDropBot:
                     
                     logging.info(f"🎉 봇이 새 그룹에 추가됨: {chat_title} (ID: {chat_id}) by {inviter}")
                     
+                    # 허용되지 않은 그룹이면 바로 나감 (GROUP_CONTROL_ENABLED)
+                    if self.group_control_enabled and chat_id not in self.allowed_group_ids:
+                        logging.info(f"🚫 허용되지 않은 그룹 - 나감: {chat_title} (ID: {chat_id})")
+                        try:
+                            self.bot.leave_chat(chat_id)
+                        except Exception as e:
+                            logging.error(f"그룹 나가기 실패: {e}")
+                        if self.admin_user_id:
+                            admin_msg = f"""🚫 허용되지 않은 그룹에 초대되어 나왔습니다.
+                            
+📍 그룹: {chat_title}
+🆔 ID: {chat_id}
+👤 초대자: {inviter}
+
+허용하려면 ALLOWED_GROUP_IDS에 ID를 추가하세요."""
+                            self.outbound.send(self.admin_user_id, admin_msg, priority=OutboundQueue.PRIORITY_LOW)
+                        return
+                    
                     # 관리자에게 알림 (ADMIN_USER_ID가 설정된 경우)
                     if self.admin_user_id:
                         try:
@@ -1107,7 +4094,7 @@ class RBTCDropBot:
 🆔 ID: {chat_id}
 👤 초대자: {inviter}
 🕐 시간: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"""
-                            self.bot.send_message(self.admin_user_id, admin_msg)
+                            self.outbound.send(self.admin_user_id, admin_msg, priority=OutboundQueue.PRIORITY_LOW)
                         except Exception as e:
                             logging.error(f"관리자 알림 실패: {e}")
                     
@@ -1116,7 +4103,8 @@ class RBTCDropBot:
                     
 채팅하면 랜덤으로 RBTC를 드랍합니다.
 먼저 개인 채팅에서 /set 명령어로 지갑을 등록하세요!"""
-                    self.bot.send_message(chat_id, welcome_msg)
+                    self.outbound.send(chat_id, welcome_msg, priority=OutboundQueue.PRIORITY_LOW,
+                                       dedupe_key=('welcome', chat_id))
         
         @self.bot.message_handler(content_types=['left_chat_member'])
         def handle_left_member(message):
@@ -1135,7 +4123,7 @@ class RBTCDropBot:
 📍 그룹: {chat_title}
 🆔 ID: {chat_id}
 🕐 시간: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"""
-                        self.bot.send_message(self.admin_user_id, admin_msg)
+                        self.outbound.send(self.admin_user_id, admin_msg, priority=OutboundQueue.PRIORITY_LOW)
                     except:
                         pass
         
@@ -1154,8 +4142,11 @@ class RBTCDropBot:
                 if message.text and message.text.startswith('/'):
                     return
                 
-                # 랜덤 드랍 처리
-                self.process_message_drop(message, user_id, user_name)
+                # 랜덤 드랍 처리 (멀티 프로세스 모드면 그룹 메시지는 담당 샤드로)
+                if self.shards and message.chat.type != 'private':
+                    self.shards.dispatch(message, user_id, user_name)
+                else:
+                    self.process_message_drop(message, user_id, user_name)
     
     @staticmethod
     def parse_set_command(command_text: str) -> Optional[str]:
@@ -1175,56 +4166,44 @@ class RBTCDropBot:
         
         return None
     
-    def _check_blacklist(self, user_id: str, user_name: str) -> bool:
-        """블랙리스트 체크
-        Returns: True if user can receive drop, False if blacklisted
-        """
-        if self.blacklist is None:
-            self.blacklist = []
-        
-        if user_id in self.blacklist:
-            logging.info(f"블랙리스트 사용자: {user_name} ({user_id})")
+    def register_wallet(self, user_id: str, wallet_address: str) -> bool:
+        """지갑 등록 후 샤드 워커 반영 (레지스트리는 WalletManager가 갱신)"""
+        previous = self.wallet_manager.get_wallet(user_id)
+        if not self.wallet_manager.set_wallet(user_id, wallet_address):
             return False
+        self._sync_shard_user(user_id, previous, self.wallet_manager.get_wallet(user_id))
         return True
     
-    def _check_chat_type(self, message) -> bool:
-        """채팅 타입 체크
-        Returns: True if group chat, False if private
-        """
-        if message.chat.type == 'private':
-            logging.info(f"개인 채팅에서는 드랍이 비활성화됨")
-            return False
-        return True
+    def _sync_shard_user(self, user_id: str, *addresses: Optional[str]):
+        """지갑/블랙리스트 변경을 샤드 워커에 반영 (주소가 주어지면 공유 여부도)"""
+        if not self.shards:
+            return
+        user = self.users.get(user_id)
+        self.shards.broadcast(('user', user_id, user.wallet if user else None, bool(user and user.blacklisted)))
+        for address in addresses:
+            if address:
+                self.shards.broadcast(('shared', address.lower(), self.wallet_manager.is_shared_address(address)))
     
-    def _check_message_length(self, message) -> bool:
-        """메시지 길이 체크
-        Returns: True if message is long enough, False otherwise
-        """
-        if not message.text or len(message.text) < 5:
-            logging.info(f"메시지 길이 부족: {len(message.text) if message.text else 0}글자")
-            return False
-        return True
+    def _shard_snapshot(self) -> Dict[str, Any]:
+        """샤드 워커 초기 상태 - 지갑/블랙리스트, 공유 주소"""
+        with self.users.lock:
+            users = [(record.user_id, record.wallet, record.blacklisted) for record in self.users.records.values()]
+        shared = [address for address in self.wallet_manager.address_index if self.wallet_manager.is_shared_address(address)]
+        return {'users': users, 'shared': shared, 'env': dict(self.config.env)}
     
-    def _check_wallet_registration(self, user_id: str, user_name: str) -> Optional[str]:
-        """지갑 등록 체크
-        Returns: wallet address if registered, None otherwise
-        """
-        wallet_address = self.wallet_manager.get_wallet(user_id)
-        if not wallet_address:
-            logging.info(f"지갑 미등록 사용자: {user_name}")
-            return None
-        return wallet_address
+    def _is_shared_address(self, address: str) -> bool:
+        return self.wallet_manager.is_shared_address(address)
     
-    def _check_cooldown(self, user_id: str, user_name: str) -> bool:
-        """쿨타임 체크 - 전체 채팅방 쿨다운
+    def _check_cooldown(self, chat_id: int, user_id: str, user_name: str, reserve: bool = False) -> bool:
+        """쿨타임 체크 - 전체/채팅방/사용자 토큰 버킷
+        reserve=True면 통과와 동시에 토큰 차감 (드랍이 중단되면 호출측에서 refund)
         Returns: True if cooldown passed, False otherwise
         """
-        now = datetime.now()
-        if self.last_transaction_time:
-            time_diff = (now - self.last_transaction_time).total_seconds()
-            if time_diff < self.cooldown_seconds:
-                logging.info(f"전체 쿨타임 중: {self.cooldown_seconds - time_diff:.1f}초 남음")
-                return False
+        blocked = self.rate_limiter.reserve(chat_id, user_id) if reserve else self.rate_limiter.check(chat_id, user_id)
+        if blocked:
+            level, wait_seconds = blocked
+            logging.info(f"쿨타임 중 ({level}): {user_name} - {wait_seconds:.1f}초 남음")
+            return False
         return True
     
     def _check_chat_members(self, message) -> tuple[int, int, bool]:
@@ -1251,178 +4230,369 @@ class RBTCDropBot:
             return False
         return True
     
-    def _check_daily_limit(self, chat_id: int) -> tuple[str, float, bool]:
-        """일일 한도 체크
-        Returns: (today_key, today_sent, can_drop)
+    def _check_daily_limit(self, chat_id: int) -> tuple[str, int, bool]:
+        """일일 한도 체크 - 전체 및 채팅방별
+        Returns: (today_key, remaining_budget_wei, can_drop)
         """
         today = self.get_today_key()
-        today_sent = self.daily_sent.get(today, 0)
+        remaining = self.daily_budget.remaining(today, chat_id)
         
-        if today_sent >= self.max_daily_amount:
+        if remaining < self.MIN_DROP_WEI:
             # 오늘 처음으로 한도 도달시에만 알림 (채팅방별로)
             today_notifications = self.limit_notifications.get(today, [])
             
             if chat_id not in today_notifications:
                 limit_msg = "💸 오늘의 RBTC 드랍이 모두 소진되었습니다!\n내일 다시 찾아주세요~ 🌙"
-                self.bot.send_message(chat_id, limit_msg)
+                self.outbound.send(chat_id, limit_msg, priority=OutboundQueue.PRIORITY_LOW,
+                                   dedupe_key=('daily_limit', chat_id, today))
                 
                 today_notifications.append(chat_id)
                 self.limit_notifications[today] = today_notifications
-                self.wallet_manager.save_limit_notifications(self.limit_notifications)
+                self.limit_notifications = self.daily_budget.prune(self.limit_notifications)
+                self.mark_state_dirty('limit_notifications')
                 
-                logging.info(f"일일 한도 도달 알림: {today_sent:.8f}/{self.max_daily_amount:.8f} RBTC")
-            return today, today_sent, False
+                logging.info(f"일일 한도 도달 알림: 전체 {format_rbtc(self.daily_budget.spent(today))}/{format_rbtc(self.config.max_daily_wei)}, "
+                             f"채팅방 {format_rbtc(self.daily_budget.spent(today, chat_id))}/{format_rbtc(self.config.max_daily_per_chat_wei)} RBTC")
+            return today, remaining, False
         
-        return today, today_sent, True
+        return today, remaining, True
     
     def _execute_drop(self, message, user_id: str, user_name: str, wallet_address: str, 
-                      chat_id: int, today: str, today_sent: float) -> bool:
-        """드랍 실행
+                      chat_id: int, today: str, remaining_budget: int, drop_amount: int) -> bool:
+        """드랍 실행 (원장 선기록 -> 서명 -> 브로드캐스트 -> 정산)
         Returns: True if drop successful, False otherwise
         """
-        # 드랍 금액
-        drop_amount = 0.0000025  # 고정 금액: 0.0000025 RBTC
-        
-        # 일일 한도 체크
-        if today_sent + drop_amount > self.max_daily_amount:
-            drop_amount = self.max_daily_amount - today_sent
-            if drop_amount < 0.00000001:
+        # 일일 한도 체크 (전체/채팅방 잔여 예산 내로 조정)
+        if drop_amount > remaining_budget:
+            drop_amount = remaining_budget
+            if drop_amount < self.MIN_DROP_WEI:
                 return False
         
-        # RBTC 전송 (최대 5회 재시도)
+        # 리더 임대 확인 (fencing) - 임대를 잃은 인스턴스는 송금하지 않음
+        if self.leader_lease and not self.leader_lease.is_leader():
+            logging.warning(f"리더 임대 없음 - 드랍 중단: {user_name} ({user_id})")
+            return False
+        
+        # 1단계: 드랍 의도 선기록 (같은 메시지로 두 번 드랍하지 않음)
+        intent_id = DropLedger.make_intent_id(chat_id, message.message_id)
+        if self.drop_ledger.exists(intent_id):
+            logging.info(f"이미 처리된 메시지 - 드랍 건너뜀: {intent_id}")
+            return False
+        
+        intent = self.drop_ledger.create(
+            intent_id,
+            chat_id=chat_id,
+            user_id=user_id,
+            user_name=user_name,
+            wallet_address=wallet_address,
+            amount_wei=drop_amount,
+            day=today,
+            fencing_token=self.leader_lease.token if self.leader_lease else None
+        )
+        if not intent:
+            logging.error(f"드랍 의도 기록 실패: {intent_id}")
+            return False
+        
+        # 2단계: 서명 후 raw 트랜잭션과 nonce를 브로드캐스트 전에 저장
+        try:
+            signed = self.tx_manager.build_signed_transfer(wallet_address, drop_amount)
+        except Exception as e:
+            logging.error(f"드랍 트랜잭션 서명 실패: {user_name} ({user_id}) - {e}")
+            self.drop_ledger.update(intent_id, status='failed')
+            return False
+        
+        tx_hashes = [signed['tx_hash']]
+        if not self.drop_ledger.update(intent_id, status='signed', sender=signed['sender'], nonce=signed['nonce'],
+                                       raw_tx=signed['raw_tx'], tx_hash=signed['tx_hash'], tx_hashes=tx_hashes):
+            logging.error(f"드랍 원장 저장 실패 - 브로드캐스트 중단: {intent_id}")
+            self.drop_ledger.update(intent_id, status='failed')
+            # 예약한 nonce를 브로드캐스트하지 않으므로 재동기화 (이후 트랜잭션이 공백 뒤에 막히지 않도록)
+            self.tx_manager.resync_nonce(signed['sender'])
+            return False
+        
+        # 3단계: 브로드캐스트 (최대 5회, 같은 서명 바이트만 재전송)
         max_retries = 5
-        tx_hash = None
+        sent = False
         
         for attempt in range(max_retries):
-            tx_hash = self.tx_manager.send_rbtc(wallet_address, drop_amount)
-            
-            if tx_hash:
+            # fencing - 의도를 기록한 임대(token)를 아직 보유할 때만 브로드캐스트
+            if self.leader_lease and not self.leader_lease.holds(intent.get('fencing_token')):
+                logging.error(f"리더 임대 토큰 불일치 - 브로드캐스트 중단: {intent_id} (token {intent.get('fencing_token')})")
                 break
-            else:
-                logging.warning(f"드랍 전송 실패 (시도 {attempt + 1}/{max_retries}): {user_name}")
-                if attempt < max_retries - 1:
-                    import time
-                    time.sleep(2)
-        
-        if tx_hash:
-            # 일일 전송량 업데이트
-            self.daily_sent[today] = today_sent + drop_amount
-            self.wallet_manager.save_daily_sent(self.daily_sent)
-            
-            # 쿨타임 업데이트 - 전체 채팅방
-            self.last_transaction_time = datetime.now()
+            result = self.tx_manager.broadcast_signed(signed['raw_tx'], signed['tx_hash'])
             
-            # 드랍 알림
-            explorer_url = f"https://explorer.rsk.co/tx/{tx_hash}"
-            
-            drop_text = f"""
-💸 RBTC 드랍! 🎉
-
-👤 {user_name}
-💰 {drop_amount:.8f} RBTC
-🔗 [트랜잭션 확인]({explorer_url})
-            """
+            if result == 'sent':
+                sent = True
+                break
             
-            self.bot.reply_to(message, drop_text, parse_mode='Markdown', disable_web_page_preview=True)
-            logging.info(f"드랍 성공: {user_name} ({user_id}) -> {drop_amount:.8f} RBTC")
+            if result == 'underpriced' and signed['retry_count'] < 3:
+                # 같은 nonce로 가스 가격만 올려 교체 - 둘 중 하나만 체결될 수 있음
+                try:
+                    signed = self.tx_manager.build_signed_transfer(
+                        wallet_address, drop_amount, nonce=signed['nonce'], retry_count=signed['retry_count'] + 1,
+                        sender=signed['sender']
+                    )
+                except Exception as e:
+                    # 실패 처리(아래 not sent)에서 송금 계정 nonce 재동기화
+                    logging.error(f"교체 트랜잭션 서명 실패: {e}")
+                    break
+                tx_hashes.append(signed['tx_hash'])
+                if not self.drop_ledger.update(intent_id, raw_tx=signed['raw_tx'], tx_hash=signed['tx_hash'],
+                                               tx_hashes=tx_hashes):
+                    logging.error(f"드랍 원장 저장 실패 - 재전송 중단: {intent_id}")
+                    break
             
-            # 라운드 로빈 업데이트
-            self.last_winner_tracker.update_winner(chat_id, user_id)
-            self.wallet_manager.save_last_winners(self.last_winner_tracker.save_to_dict())
+            logging.warning(f"드랍 전송 실패 (시도 {attempt + 1}/{max_retries}): {user_name}")
+            if attempt < max_retries - 1:
+                time.sleep(2)
+        
+        if not sent:
+            # 이 nonce가 노드에 도달하지 않았을 수 있으므로 송금 계정 nonce를 체인 기준으로 재동기화
+            self.tx_manager.resync_nonce(signed['sender'])
+            # 의도는 열린 상태로 남겨 재시작시 체인 상태로 확정
+            logging.error(f"드랍 전송 완전 실패: {user_name} ({user_id}) - 모든 재시도 소진, 원장 보류: {intent_id}")
+            return False
+        
+        # 4단계: 정산 (일일 전송량, 쿨타임, 라운드 로빈, 이력) - 원장 완료 기록과 함께 flush에서 저장
+        # (저장 전 재시작하면 원장은 signed로 남아 체인 상태로 다시 정산)
+        self._apply_drop_accounting(intent_id, signed['tx_hash'], rate_reserved=True)
+        
+        # 드랍 알림
+        drop_text = self.templates.render('drop', user_name=user_name, amount=format_rbtc(drop_amount),
+                                          tx_hash=signed['tx_hash'])
+        
+        self.outbound.reply_to(message, drop_text, priority=OutboundQueue.PRIORITY_HIGH,
+                               parse_mode='Markdown', disable_web_page_preview=True)
+        logging.info(f"드랍 성공: {user_name} ({user_id}) -> {format_rbtc(drop_amount)} RBTC")
+        return True
+    
+    def _apply_drop_accounting(self, intent_id: str, tx_hash: str, rate_reserved: bool = False):
+        """브로드캐스트된 드랍 의도의 정산 반영 (멱등 - 이력에 같은 해시가 있으면 건너뜀)
+        rate_reserved: 실행 전에 쿨타임 토큰을 이미 예약했으면 True (원장 재처리는 여기서 차감)
+        """
+        intent = self.drop_ledger.get(intent_id)
+        if not intent or intent.get('accounted'):
+            return
+        
+        day = intent['day']
+        chat_id = intent['chat_id']
+        user_id = intent['user_id']
+        drop_amount = intent['amount_wei'] if 'amount_wei' in intent else rbtc_to_wei(intent['amount_rbtc'])
+        
+        if not any(record.get('tx_hash') == tx_hash for record in self.drop_history[-100:]):
+            # 일일 전송량 업데이트 (전체 + 채팅방)
+            self.daily_budget.add(day, chat_id, drop_amount)
             
             # 드랍 이력 기록
             drop_record = {
-                "wallet_address": wallet_address,
-                "amount_rbtc": drop_amount,
-                "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S KST'),
+                "wallet_address": intent['wallet_address'],
+                "amount_wei": drop_amount,
+                "timestamp": datetime.fromtimestamp(intent['created_at']).strftime('%Y-%m-%d %H:%M:%S KST'),
                 "telegram_id": user_id,
-                "telegram_username": user_name,
+                "telegram_username": intent['user_name'],
                 "tx_hash": tx_hash,
                 "chat_id": chat_id
             }
-            self.drop_history.append(drop_record)
-            self.wallet_manager.save_drop_history(self.drop_history)
-            return True
+            self.drop_index.append(self.drop_history, drop_record)
+            self.drop_columns.append(drop_record)
+        
+        # 쿨타임 업데이트 - 전체/채팅방/사용자 토큰 차감 (예약된 드랍은 이미 차감됨)
+        if not rate_reserved:
+            self.rate_limiter.consume(chat_id, user_id)
+        
+        # 라운드 로빈 업데이트
+        self.last_winner_tracker.update_winner(chat_id, user_id)
+        
+        # 일일 전송량/이력/쿨타임/당첨자 상태와 원장 완료 기록은 주기적 flush 작업에서 저장
+        self.drop_ledger.complete(intent_id, tx_hash=tx_hash)
+        self.mark_state_dirty('daily_sent', 'drop_history', 'rate_limits', 'last_winners')
+    
+    def _replay_drop_ledger(self):
+        """재시작시 미완료 드랍 의도 확정 - 새로 서명하지 않고 저장된 바이트만 재전송"""
+        open_intents = self.drop_ledger.open_intents()
+        if not open_intents:
+            return
+        
+        logging.info(f"미완료 드랍 의도 재처리: {len(open_intents)}건")
+        for intent in open_intents:
+            try:
+                self._resolve_intent(intent)
+            except Exception as e:
+                logging.error(f"드랍 의도 재처리 실패: {intent['id']} - {e}")
+    
+    def _resolve_intent(self, intent: Dict):
+        """열린 드랍 의도 하나를 체인 상태 기준으로 확정"""
+        intent_id = intent['id']
+        
+        # 서명 전에 중단됨 - 브로드캐스트된 적 없음
+        if intent['status'] == 'created' or not intent.get('raw_tx'):
+            logging.info(f"서명 전 중단된 드랍 의도 폐기: {intent_id}")
+            self.drop_ledger.update(intent_id, status='failed')
+            return
+        
+        if not self.tx_manager:
+            logging.warning(f"TransactionManager 없음 - 드랍 의도 보류: {intent_id}")
+            return
+        
+        # 교체 트랜잭션 포함, 이미 전파/체결된 해시가 있으면 정산만 반영
+        for tx_hash in intent.get('tx_hashes') or [intent['tx_hash']]:
+            if self.tx_manager.get_tx_state(tx_hash) in ('mined', 'pending'):
+                logging.info(f"전파 확인된 드랍 의도 정산: {intent_id} ({tx_hash})")
+                self._apply_drop_accounting(intent_id, tx_hash)
+                return
+        
+        # nonce가 이미 다른 트랜잭션에 사용됨 - 이 의도는 체결될 수 없음
+        if self.tx_manager.get_tx_state(intent['tx_hash'], intent.get('nonce'), intent.get('sender')) == 'replaced':
+            logging.info(f"nonce 소진된 드랍 의도 폐기: {intent_id}")
+            self.drop_ledger.update(intent_id, status='failed')
+            return
+        
+        # 노드에 도달하지 않음 - 같은 서명 바이트 재전송
+        if self.tx_manager.broadcast_signed(intent['raw_tx'], intent['tx_hash']) == 'sent':
+            self.drop_ledger.update(intent_id, status='broadcast')
+            self._apply_drop_accounting(intent_id, intent['tx_hash'])
         else:
-            logging.error(f"드랍 전송 완전 실패: {user_name} ({user_id}) - 모든 재시도 소진")
-            return False
+            logging.warning(f"드랍 의도 재전송 실패, 다음 재시작시 재시도: {intent_id}")
     
     def process_message_drop(self, message, user_id: str, user_name: str):
         """메시지별 드랍 처리 - 리팩토링된 버전"""
         try:
             logging.info(f"드랍 처리 시작 - 사용자: {user_name} ({user_id})")
             
-            # 1. 블랙리스트 체크
-            if not self._check_blacklist(user_id, user_name):
-                return
-            
-            # 2. 채팅 타입 체크
-            if not self._check_chat_type(message):
-                return
-            
-            # 3. 메시지 길이 체크
-            if not self._check_message_length(message):
-                return
-            
-            # 4. 지갑 등록 체크
-            wallet_address = self._check_wallet_registration(user_id, user_name)
+            # 0~4. 스팸/사용자/채팅 타입/길이/공유 주소 체크
+            wallet_address = self._prefilter_message(message, user_id, user_name)
             if not wallet_address:
                 return
             
-            # 5. 쿨타임 체크
-            if not self._check_cooldown(user_id, user_name):
-                return
-            
-            # 6. 채팅방 인원 체크
-            chat_id, chat_member_count, has_enough_members = self._check_chat_members(message)
-            if not has_enough_members:
-                return
-            
-            # 7. 연속 당첨 방지 체크
-            if not self._check_consecutive_winner(chat_id, user_id, user_name, chat_member_count):
-                return
-            
-            # 8. 일일 한도 체크
-            today, today_sent, can_drop = self._check_daily_limit(chat_id)
-            if not can_drop:
-                return
-            
-            # 9. 랜덤 드랍 여부 결정
-            if not self.tx_manager:
-                logging.error("TransactionManager가 초기화되지 않았습니다.")
-                return
-            
-            if not self.tx_manager.should_drop(self.drop_rate):
-                logging.info(f"🎲 드랍 확률 실패: {user_name} ({user_id}) - {self.drop_rate*100}% 확률 미달")
-                return  # 드랍 안함
-            
-            logging.info(f"🎉 드랍 당첨! 사용자: {user_name}, 지갑: {wallet_address[:10]}...")
-            
-            # 10. 드랍 실행
-            self._execute_drop(message, user_id, user_name, wallet_address, chat_id, today, today_sent)
+            # 5~10. 쿨타임/인원/연속 당첨/일일 한도/추첨/실행
+            self._complete_drop(message, user_id, user_name, wallet_address)
                 
         except Exception as e:
             logging.error(f"드랍 처리 중 예외 발생: {e}", exc_info=True)
             logging.error(f"예외 타입: {type(e).__name__}")
             logging.error(f"사용자: {user_name} ({user_id})")
     
+    def _handle_shard_candidate(self, payload: Dict[str, Any], wallet_address: str, drop_amount: int):
+        """샤드 워커가 보낸 당첨 후보 처리 (5단계 이후는 프론트 프로세스에서)"""
+        user_id, user_name = payload['user_id'], payload['user_name']
+        try:
+            self._complete_drop(ShardDispatcher.to_message(payload), user_id, user_name, wallet_address, drop_amount)
+        except Exception as e:
+            logging.error(f"샤드 당첨 후보 처리 중 예외 발생: {e}", exc_info=True)
+            logging.error(f"사용자: {user_name} ({user_id})")
+    
+    def _complete_drop(self, message, user_id: str, user_name: str, wallet_address: str,
+                       drop_amount: Optional[int] = None):
+        """드랍 체크 5~10단계 - 전역 상태(쿨타임/일일 예산/원장/논스)를 쓰는 체크와 실행
+        drop_amount가 주어지면 샤드 워커에서 이미 추첨한 것으로 보고 9단계를 건너뜀
+        """
+        # 5. 쿨타임 체크
+        if not self._check_cooldown(message.chat.id, user_id, user_name):
+            return
+        
+        # 6. 채팅방 인원 체크
+        chat_id, chat_member_count, has_enough_members = self._check_chat_members(message)
+        if not has_enough_members:
+            return
+        
+        # 7. 연속 당첨 방지 체크
+        if not self._check_consecutive_winner(chat_id, user_id, user_name, chat_member_count):
+            return
+        
+        # 8. 일일 한도 체크
+        today, remaining_budget, can_drop = self._check_daily_limit(chat_id)
+        if not can_drop:
+            return
+        
+        # 9. 랜덤 드랍 여부 결정
+        if not self.tx_manager:
+            logging.error("TransactionManager가 초기화되지 않았습니다.")
+            return
+        
+        if drop_amount is None:
+            drop_amount = self.drop_policy.decide(chat_id, user_id)
+            if drop_amount is None:
+                rate = self.drop_policy.rate_for(chat_id, user_id)
+                logging.info(f"🎲 드랍 확률 실패: {user_name} ({user_id}) - {rate*100:.2f}% 확률 미달")
+                return  # 드랍 안함
+        
+        logging.info(f"🎉 드랍 당첨! 사용자: {user_name}, 지갑: {wallet_address[:10]}...")
+        
+        # 10. 쿨타임 토큰 예약 후 드랍 실행 (5단계 이후 다른 스레드가 토큰을 썼으면 여기서 걸러짐)
+        if not self._check_cooldown(chat_id, user_id, user_name, reserve=True):
+            return
+        dropped = False
+        try:
+            dropped = self._execute_drop(message, user_id, user_name, wallet_address, chat_id, today,
+                                         remaining_budget, drop_amount)
+        finally:
+            if not dropped:
+                self.rate_limiter.refund(chat_id, user_id)
+    
     def run(self):
         """봇 실행"""
         import uuid
         instance_id = str(uuid.uuid4())[:8]
         logging.info(f"RBTC 드랍 봇 시작 - Instance: {instance_id}")
-        logging.info(f"드랍 확률: {self.drop_rate*100:.1f}%, 일일 한도: {self.max_daily_amount:.8f} RBTC")
+        logging.info(f"드랍 확률: {self.config.drop_rate*100:.1f}%, 일일 한도: {format_rbtc(self.config.max_daily_wei)} RBTC")
+        
+        # 헬스 체크는 리더 대기 중에도 응답 (starting)
+        if self.health:
+            self.health.start()
+        
+        # 리더 임대 획득 (다른 인스턴스가 리더면 대기 - 임대 만료/반납 즉시 이어받음)
+        lease_seconds = float(os.getenv('LEADER_LEASE_SECONDS') or '30')
+        self.leader_lease = LeaderLease(self.wallet_manager, instance_id, lease_seconds)
+        self.wallet_manager.write_fence = self.leader_lease.is_leader  # 임대 없는 동안(대기/상실) 상태 저장 차단
+        # 대기 인스턴스 확인 주기 - 반납된 임대는 다음 확인에서 이어받음
+        standby_poll = float(os.getenv('LEADER_STANDBY_POLL_SECONDS') or max(2.0, lease_seconds / 3))
+        if not self.wallet_manager.use_local and self.wallet_manager.lease_gist_id == self.wallet_manager.gist_id:
+            logging.warning("LEADER_LEASE_GIST_ID 미설정 - 임대 확인마다 상태 Gist 전체(드랍 이력 포함) 조회")
+        with self.startup.phase('leader_lease'):
+            waited = self.leader_lease.wait_for_leadership(poll_seconds=standby_poll)
         
-        # 초기 대기 (이전 인스턴스 종료 대기)
-        logging.info("초기화 대기 중...")
-        time.sleep(3)
+        # 대기하는 동안 이전 리더가 바꾼 상태 반영 (Gist 1회 조회)
+        if waited:
+            with self.startup.phase('state_refresh'):
+                self._load_state(refresh=True)
+        
+        with self.startup.phase('ledger_replay'):
+            self._replay_drop_ledger()
+        
+        # 멀티 프로세스 모드 - 그룹 메시지를 chat_id 기준으로 워커에 분배
+        if self.shard_workers > 1:
+            with self.startup.phase('shard_workers'):
+                self.shards = ShardDispatcher(self.shard_workers, int(os.getenv('SHARD_QUEUE_SIZE', '1000')))
+                self.shards.start(self._shard_snapshot(), self._handle_shard_candidate)
+        
+        self.scheduler.add_job(self._leader_heartbeat, 'interval', seconds=lease_seconds / 3,
+                               id='leader_heartbeat', coalesce=True, max_instances=1)
+        self.scheduler.start()
+        self.startup.report()
+        
+        # SIGTERM(배포 교체, timeout 종료)시 폴링을 멈추고 임대를 반납
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.bot.stop_polling())
+        
+        # SIGHUP: 설정 리로드 (env 파일 + 저장소 변경값)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(
+                target=self._reload_config_from_signal, name='config-reload', daemon=True).start())
+        
+        # SIGUSR1: CPU 프로파일, SIGUSR2: 메모리 추적 (PROFILE_SECONDS 동안, 리포트는 파일 + 관리자)
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.start_diagnostics('profile', self.profile_seconds))
+            signal.signal(signal.SIGUSR2, lambda signum, frame: self.start_diagnostics('memtrace', self.profile_seconds))
+        
+        # 핸드오프면 이전 리더가 남긴 대기 업데이트를 이어서 처리 (원장이 중복 드랍 방지)
+        skip_pending = not self.leader_lease.handoff
         
         retry_count = 0
         while retry_count < 10:
             try:
                 logging.info(f"봇 폴링 시작... (시도: {retry_count + 1})")
                 logging.info("메시지 대기 중... (정상 작동 중)")
-                self.bot.infinity_polling(timeout=10, long_polling_timeout=5, skip_pending=True)
+                self.bot.infinity_polling(timeout=10, long_polling_timeout=5, skip_pending=skip_pending,
+                                         allowed_updates=self.ALLOWED_UPDATES)
                 break  # 정상 종료시 루프 탈출
             except Exception as e:
                 retry_count += 1
@@ -1435,11 +4605,78 @@ class RBTCDropBot:
                     logging.error("최대 재시도 횟수 초과. 봇 종료.")
                     break
         
+        # 샤드 워커 종료, 예약 작업 정리, 남은 상태 저장, 대기 중인 발신 메시지 전송 후 종료
+        if self.shards:
+            self.shards.stop()
+        self.scheduler.shutdown(wait=False)
+        if self.leader_lease.is_leader():
+            self.flush_state()
+        else:
+            logging.warning("리더 임대 없음 - 종료 시 상태 저장 생략 (새 리더 상태 보호)")
+        self.outbound.stop()
+        self.leader_lease.release()
+        if self.health:
+            self.health.stop()
         logging.info("RBTC 드랍 봇 종료")
     
 
+def run_analytics(args: List[str]):
+    """드랍 이력 집계 CLI
+
+    사용법: python rbtc_bot.py analytics [day|chat|user] [--export 파일경로]
+    """
+    export_path = None
+    if '--export' in args:
+        index = args.index('--export')
+        export_path = args[index + 1] if index + 1 < len(args) else 'drop_history.cols'
+        args = args[:index] + args[index + 2:]
+    group_by = args[0].lower() if args else 'day'
+    if group_by not in DropHistoryColumns.GROUP_KEYS:
+        print("사용법: python rbtc_bot.py analytics [day|chat|user] [--export 파일경로]")
+        return
+    
+    columns = DropHistoryColumns.from_records(WalletManager().load_drop_history())
+    budget = DailyBudget(0, 0, reset_time=os.getenv('DAILY_RESET_TIME', '09:00'),
+                         tz_name=os.getenv('DAILY_RESET_TZ', 'Asia/Seoul'))
+    print(columns.report(group_by, budget.day_offset(), limit=len(columns) or 1))
+    if export_path:
+        size = columns.export(export_path)
+        print(f"컬럼 파일 저장: {export_path} ({size} bytes)")
+
+def run_simulation(args: List[str]):
+    """드랍 정책 시뮬레이션 CLI - 현재 환경변수 설정으로 하루 지출 예측
+
+    사용법: python rbtc_bot.py simulate [메시지수=1000000] [사용자수=500] [채팅방수=5]
+    """
+    messages, users, chats = (list(map(int, args)) + [1_000_000, 500, 5][len(args):])[:3]
+    drop_rate = float(os.getenv('DROP_RATE', '0.05'))
+    max_daily_wei = rbtc_to_wei(os.getenv('MAX_DAILY_AMOUNT', '0.00003125'))
+    max_per_chat_wei = rbtc_to_wei(os.getenv('MAX_DAILY_AMOUNT_PER_CHAT') or os.getenv('MAX_DAILY_AMOUNT', '0.00003125'))
+    policy = DropPolicy.from_env(drop_rate, RBTCDropBot.DROP_AMOUNT_WEI)
+    
+    started = time.perf_counter()
+    result = policy.simulate(messages, users, chats, max_daily_wei, max_per_chat_wei)
+    elapsed = time.perf_counter() - started
+    
+    exhausted = result['exhausted_at']
+    print(f"🎲 드랍 정책 시뮬레이션 ({messages:,}개 메시지, 사용자 {users}명, 채팅방 {chats}개, {elapsed:.1f}초)")
+    print(f"기본 확률: {drop_rate*100:.2f}%, 금액: {policy.describe_amount()}, 기대 금액: {format_rbtc(int(policy.expected_amount()))} RBTC")
+    print(f"드랍: {result['drops']:,}회")
+    print(f"일일 지출: {format_rbtc(result['spent_wei'])} / {format_rbtc(max_daily_wei)} RBTC")
+    print(f"한도 없을 때 지출: {format_rbtc(result['uncapped_wei'])} RBTC")
+    print(f"한도 소진 시각: {timedelta(seconds=int(exhausted)) if exhausted is not None else '소진 안됨'}")
+    for chat_id, spent in sorted(result['chat_spent_wei'].items()):
+        print(f"  채팅방 {chat_id}: {format_rbtc(spent)} RBTC")
+
 def main():
     """메인 함수"""
+    if len(sys.argv) > 1 and sys.argv[1] == 'analytics':
+        run_analytics(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'simulate':
+        run_simulation(sys.argv[2:])
+        return
+    
     try:
         bot = RBTCDropBot()
         bot.run()